@@ -0,0 +1,372 @@
+"""
+Benchmark suite for KLEGA
+Measures tokenizer and lexical diversity throughput on a reproducible synthetic Korean corpus.
+
+Run: python src/klega/benchmark.py -t okt mecab -n 200 -l 300 -o bench.json
+     python src/klega/benchmark.py -t okt --compare bench.json   (exit code 1 on regression)
+     python src/klega/benchmark.py --startup -t okt --startup-budget 1.0   (cold import and tagger start-up times)
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from korean_tokenizer import tokenize, remove_function_words, warm_up, tear_down, tagger_stats, reset_tagger_stats, \
+    TOKENIZERS
+from ld_analyser import LOI
+from ld_engine import FastLexdiv, parallel_ld, to_type_ids
+
+PARTICLES = ["은", "는", "이", "가", "을", "를", "에", "에서", "의", "도", "와", "과", "로"]
+ENDINGS = ["다", "요", "습니다", "었다", "고", "지만", "어서"]
+
+
+def _syllable(rng):
+    # precomposed hangul syllable: 0xAC00 + (initial * 21 + medial) * 28 + final
+    final = rng.choice([0] * 3 + list(range(1, 28)))
+    return chr(0xAC00 + (rng.randrange(19) * 21 + rng.randrange(21)) * 28 + final)
+
+
+def generate_corpus(n_texts=100, length=300, vocab_size=2000, zipf=1.1, seed=0):
+    """
+    Generate a synthetic Korean corpus offline
+    :param n_texts: int, number of texts
+    :param length: int, number of words (eojeols) per text
+    :param vocab_size: int, number of distinct stems
+    :param zipf: float, exponent of the Zipf distribution of stem frequencies (larger: less diverse texts)
+    :param seed: int, random seed, so that the same arguments always give the same corpus
+    :return: list of str
+    """
+    rng = random.Random(seed)
+    vocab = set()
+    while len(vocab) < vocab_size:
+        vocab.add("".join(_syllable(rng) for _ in range(rng.choice([1, 2, 2, 2, 3]))))
+    vocab = sorted(vocab)
+    rng.shuffle(vocab)
+    cum_weights = []
+    total = 0.0
+    for rank in range(1, vocab_size + 1):
+        total += 1 / rank ** zipf
+        cum_weights.append(total)
+
+    texts = []
+    for _ in range(n_texts):
+        words = []
+        for i, stem in enumerate(rng.choices(vocab, cum_weights=cum_weights, k=length)):
+            if rng.random() < 0.2:
+                words.append(stem + rng.choice(ENDINGS) + ("." if rng.random() < 0.5 else ""))
+            else:
+                words.append(stem + rng.choice(PARTICLES))
+        texts.append(" ".join(words) + ".")
+    return texts
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # not available on Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024, 2)
+
+
+def bench_tokenizer(tokenizer, texts):
+    """
+    :return: dict, construction, tagging and filtering timings of the tokenizer on the texts
+    """
+    tear_down([tokenizer])
+    reset_tagger_stats()
+    start = time.perf_counter()
+    warm_up([tokenizer])
+    construction = time.perf_counter() - start
+
+    filtering = 0.0
+    ntokens = 0
+    start = time.perf_counter()
+    for text in texts:
+        _, pos_tuple, tokens = tokenize(tokenizer, text)
+        filter_start = time.perf_counter()
+        remove_function_words(pos_tuple, tokenizer)
+        filtering += time.perf_counter() - filter_start
+        ntokens += len(tokens)
+    total = time.perf_counter() - start
+    tagging = tagger_stats()[tokenizer]["tagging_time"]
+    peak = _peak(lambda: [tokenize(tokenizer, text) for text in texts[:10]])
+    tear_down([tokenizer])
+    return {"construction_s": construction,
+            "tagging_s": tagging,
+            "filtering_s": filtering,
+            "total_s": total,
+            "texts_per_s": len(texts) / total,
+            "tokens_per_s": ntokens / total,
+            "peak_mb": peak}
+
+
+def _taaled_index_functions():
+    from taaled import lexdiv
+    ld = lexdiv()  # without text: only used for its index methods
+    return {"ntokens": len,
+            "ntypes": lambda text: len(set(text)),
+            "mtld": ld.MTLD,
+            "mtldo": lambda text: ld.MTLD(text, outputs=True)[2],
+            "mattr": ld.MATTR,
+            "ttr": ld.TTR,
+            "rttr": ld.RTTR,
+            "lttr": ld.LTTR,
+            "maas": ld.MAAS,
+            "msttr": ld.MSTTR,
+            "hdd": ld.HDD}
+
+
+def _timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def _peak(function, *args):
+    """
+    Peak Python memory allocated while running the function, in MB
+    Measured in a separate run: tracing allocations slows pure Python code down by an order of magnitude
+    """
+    tracemalloc.start()
+    try:
+        function(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(peak / 1024 / 1024, 2)
+
+
+def bench_indices(token_lists, mx=200):
+    """
+    :param token_lists: list of token lists
+    :return: dict, per-index cost of TAALED and whole-text cost of both engines (seconds per text)
+    """
+    from taaled import lexdiv, parallel
+
+    result = {"taaled_index_s": {}, "engines": {}}
+    functions = _taaled_index_functions()
+    for index in LOI:
+        timings = [_timed(functions[index], tokens) for tokens in token_lists]
+        result["taaled_index_s"][index] = sum(timings) / len(timings)
+
+    long_lists = [tokens for tokens in token_lists if len(tokens) >= mx]
+    engines = {"taaled": (lambda tokens: lexdiv(tokens).vald,
+                          lambda tokens: parallel(text=tokens, clss=True, funct=lexdiv, loi=LOI, mx=mx).ldvals),
+               "numpy": (lambda tokens: FastLexdiv(ids=to_type_ids(tokens)).vald,
+                         lambda tokens: parallel_ld(tokens, loi=LOI, mx=mx))}
+    for engine, (lexdiv_function, parallel_function) in engines.items():
+        entry = {"lexdiv_s": sum(_timed(lexdiv_function, tokens) for tokens in token_lists) / len(token_lists),
+                 "lexdiv_peak_mb": _peak(lexdiv_function, max(token_lists, key=len))}
+        if long_lists:
+            entry["parallel_s"] = sum(_timed(parallel_function, tokens) for tokens in long_lists) / len(long_lists)
+            entry["parallel_peak_mb"] = _peak(parallel_function, long_lists[0])
+        result["engines"][engine] = entry
+    return result
+
+
+KLEGA_DIR = os.path.dirname(os.path.abspath(__file__))
+# imports measured in startup mode: the entry points, then the backends they import on first use
+ENTRY_POINTS = {"main": "import main", "server": "import klega.server", "web": "import klega.web"}
+BACKENDS = ["numpy", "pandas", "taaled", "pyarrow", "konlpy.tag", "mecab_ko", "stanza"]
+
+
+def _run_cold(code):
+    """
+    Run code in a new interpreter (cold imports) with the import paths of the CLI and of the klega package
+    :return: tuple (wall time in seconds, stderr) or None if the code failed
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [KLEGA_DIR, os.path.dirname(KLEGA_DIR),
+                                                      env.get("PYTHONPATH")]))
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=KLEGA_DIR, env=env,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    elapsed = time.perf_counter() - start
+    if process.returncode != 0:
+        logging.warning("Startup of %r failed: %s", code, process.stderr.strip().splitlines()[-1:])
+        return None
+    return elapsed, process.stderr
+
+
+def _slowest_imports(importtime, top=5):
+    """
+    :param importtime: str, output of python -X importtime
+    :return: list of tuple (module, self time in seconds), the slowest modules by self time
+    """
+    times = []
+    for line in importtime.splitlines():
+        fields = line.split("|")
+        if len(fields) == 3 and fields[0].startswith("import time:") and fields[0][12:].strip().isdigit():
+            times.append((fields[2].strip(), int(fields[0][12:]) / 1e6))
+    return sorted(times, key=lambda item: -item[1])[:top]
+
+
+def bench_startup(tokenizers, repeat=3):
+    """
+    Cold start-up times, each measured in a new interpreter (best of repeat runs, minus the interpreter start-up)
+    :return: dict, import times of the entry points and backends, and tagger start-up times (with the JVM)
+    """
+    baseline = min(_run_cold("pass")[0] for _ in range(repeat))
+
+    def measure(code):
+        runs = []
+        for _ in range(repeat):
+            run = _run_cold(code)
+            if run is None:  # e.g. the backend is not installed
+                return None
+            runs.append(run)
+        elapsed, importtime = min(runs)
+        return {"import_s": max(0.0, elapsed - baseline),
+                "slowest": [[module, seconds] for module, seconds in _slowest_imports(importtime)]}
+
+    results = {"interpreter_s": baseline, "entry_points": {}, "backends": {}, "taggers": {}}
+    for name, code in ENTRY_POINTS.items():
+        results["entry_points"][name] = measure(code)
+    for module in BACKENDS:
+        results["backends"][module] = measure("import " + module)
+    for tokenizer in tokenizers:
+        # construction of the tagger in a new process: imports its backend and, for konlpy, starts the JVM
+        results["taggers"][tokenizer] = measure("from korean_tokenizer import warm_up; warm_up([{!r}])"
+                                                .format(tokenizer))
+    return results
+
+
+def run_startup(tokenizers, repeat=3):
+    return {"config": {"mode": "startup", "tokenizers": tokenizers, "repeat": repeat},
+            "machine": {"python": platform.python_version(), "platform": platform.platform(),
+                        "processor": platform.processor()},
+            "results": bench_startup(tokenizers, repeat)}
+
+
+def _flatten(d, prefix=""):
+    flat = {}
+    for key, value in d.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, prefix + key + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(result, baseline, threshold=0.1, min_seconds=1e-3):
+    """
+    Compare timings with a saved baseline
+    :param threshold: float, relative slowdown reported as a regression (0.1: 10% slower)
+    :param min_seconds: float, timings shorter than this in the baseline are too noisy to compare
+    :return: list of tuple (metric, baseline value, new value, relative change) of regressions
+    """
+    new = _flatten(result["results"])
+    old = _flatten(baseline["results"])
+    regressions = []
+    for metric, old_value in old.items():
+        if metric not in new or not old_value:
+            continue
+        change = (new[metric] - old_value) / old_value
+        if metric.endswith("per_s"):  # throughput: lower is worse
+            change = -change
+        elif metric.endswith("_s"):
+            if old_value < min_seconds:
+                continue
+        elif not metric.endswith("_mb"):
+            continue
+        if change > threshold:
+            regressions.append((metric, old_value, new[metric], change))
+    return regressions
+
+
+def run(tokenizers, n_texts, length, vocab_size, zipf, seed, mx=200):
+    texts = generate_corpus(n_texts, length, vocab_size, zipf, seed)
+    results = {"tokenizers": {}, "indices": None}
+    token_lists = []
+    for tokenizer in tokenizers:
+        logging.info("Benchmarking tokenizer %s . . .", tokenizer)
+        try:
+            results["tokenizers"][tokenizer] = bench_tokenizer(tokenizer, texts)
+        except Exception as e:  # e.g. the tokenizer package is not installed
+            logging.warning("Tokenizer %s skipped: %s: %s", tokenizer, type(e).__name__, e)
+            continue
+        if not token_lists:
+            token_lists = [tokenize(tokenizer, text)[2] for text in texts]
+            tear_down([tokenizer])
+    if not token_lists:  # no tokenizer available: benchmark the indices on whitespace tokens
+        token_lists = [text.split(" ") for text in texts]
+
+    logging.info("Benchmarking lexical diversity indices . . .")
+    results["indices"] = bench_indices(token_lists, mx=mx)
+    results["peak_rss_mb"] = _peak_rss_mb()
+    return {"config": {"tokenizers": tokenizers, "n_texts": n_texts, "length": length, "vocab_size": vocab_size,
+                       "zipf": zipf, "seed": seed, "mx": mx},
+            "machine": {"python": platform.python_version(), "platform": platform.platform(),
+                        "processor": platform.processor()},
+            "results": results}
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="KLEGA benchmark")
+    parser.add_argument("-t", "--tokenizer", nargs='+', default=["okt"],
+                        help="Tokenizers to benchmark: (okt, komoran, mecab, kkma, hannanum, stanza)")
+    parser.add_argument("-n", "--ntexts", type=int, default=100, help="Number of synthetic texts")
+    parser.add_argument("-l", "--length", type=int, default=300, help="Number of words per text")
+    parser.add_argument("--vocab", type=int, default=2000, help="Vocabulary size of the synthetic corpus")
+    parser.add_argument("--zipf", type=float, default=1.1, help="Zipf exponent of the word distribution")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", help="Baseline JSON file to compare the results with")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="Relative slowdown reported as a regression in compare mode (default: 0.1)")
+    parser.add_argument("--startup", action="store_true",
+                        help="Measure cold start-up instead: import times of the entry points and backends, "
+                             "and tagger construction of the tokenizers, each in a new interpreter")
+    parser.add_argument("--startup-budget", type=float,
+                        help="Startup mode: exit code 1 if importing an entry point takes longer (in seconds)")
+    parser.add_argument("--repeat", type=int, default=3, help="Startup mode: runs per measurement (best is kept)")
+    args = parser.parse_args()
+
+    for tokenizer in args.tokenizer:
+        if tokenizer not in TOKENIZERS:
+            parser.error("tokenizer must be one of these options: (okt, komoran, mecab, kkma, hannanum, stanza)")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    if args.startup or (args.compare and baseline["config"].get("mode") == "startup"):
+        result = run_startup(args.tokenizer, args.repeat)
+    elif args.compare:  # benchmark with the same corpus as the baseline
+        config = baseline["config"]
+        result = run(args.tokenizer, config["n_texts"], config["length"], config["vocab_size"], config["zipf"],
+                     config["seed"], config["mx"])
+    else:
+        result = run(args.tokenizer, args.ntexts, args.length, args.vocab, args.zipf, args.seed)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        logging.info("Benchmark results saved as: %s", args.output)
+    else:
+        print(json.dumps(result, indent=2))
+
+    if args.startup_budget is not None and result["config"].get("mode") == "startup":
+        over = [name for name, entry in result["results"]["entry_points"].items()
+                if entry is not None and entry["import_s"] > args.startup_budget]
+        for name in over:
+            logging.warning("STARTUP %s: import takes %.3fs, over the budget of %.3fs", name,
+                            result["results"]["entry_points"][name]["import_s"], args.startup_budget)
+        if over:
+            sys.exit(1)
+        logging.info("Start-up of all entry points within %.3fs", args.startup_budget)
+
+    if args.compare:
+        regressions = compare(result, baseline, args.threshold)
+        for metric, old_value, new_value, change in regressions:
+            logging.warning("REGRESSION %s: %.6g -> %.6g (%+.1f%%)", metric, old_value, new_value, change * 100)
+        if regressions:
+            sys.exit(1)
+        logging.info("No regression over %.0f%% against %s", args.threshold * 100, args.compare)
@@ -0,0 +1,260 @@
+"""
+Persistent corpus token store
+The tagged texts of a run (without stopwords, as analysed) are kept per tokenizer so that new questions
+(another mx, a subset of texts, pooled indices of groups of texts) are answered without tagging the corpus again:
+    vocab.json                  token types, the position of a type is its id
+    texts.json                  text ids, in the order of the run
+    tokens.npy, pos.npy         type ids (int32) and POS ids (uint16) of all texts, concatenated
+    offsets.npy                 int64, tokens of the i-th text are tokens[offsets[i]:offsets[i + 1]]
+    counts_all_words.npz        document x type count matrices in CSR form (data, indices, indptr, shape),
+    counts_content_only.npz     with and without function words
+    store.json                  tokenizer, POS tags and function word tags
+Arrays are memory-mapped when the store is opened: a text or a group is read without loading the rest of the store,
+and the indices of ld_engine.COUNT_INDICES of any group, up to the whole corpus, come from the count matrices.
+The other indices of a group need its tokens in memory (about 10 bytes per token, for the whole corpus too).
+Indices are calculated with the numpy engine (see ld_engine).
+"""
+import json
+import logging
+import os
+
+import numpy as np
+
+from ld_engine import COUNT_INDICES, INDICES, FastLexdiv, count_indices, parallel_ld
+from token_stream import VOCABULARY, TokenStream, tag_set
+
+STORE_VERSION = 1
+COUNTS = {True: "counts_all_words.npz", False: "counts_content_only.npz"}  # by include_function_words
+
+
+class CorpusStoreWriter:
+    """
+    Write the token streams of a run into a store, one text at a time
+    Tokens are appended to temporary files while the texts are analysed, so streamed corpora are not kept in memory
+    """
+
+    def __init__(self, path, tokenizer):
+        """
+        :param path: str, directory of the store (one store per tokenizer)
+        :param tokenizer: str, possible options: (okt, komoran, mecab, kkma, hannanum, stanza)
+        """
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.path = path
+        self.tokenizer = tokenizer
+        self._tag_set = tag_set(tokenizer)
+        self._texts = []
+        self._offsets = [0]
+        self._types = []  # strings of the store vocabulary
+        self._remap = np.zeros(0, dtype=np.int32)  # process vocabulary id -> store id (-1: not in the store yet)
+        self._counts = {True: ([], [], [0]), False: ([], [], [0])}  # CSR data, indices and indptr
+        self._tokens = open(os.path.join(path, "tokens.npy.tmp"), "wb")
+        self._pos = open(os.path.join(path, "pos.npy.tmp"), "wb")
+
+    def _store_ids(self, type_ids):
+        """
+        :param type_ids: np.ndarray, ids of the process vocabulary (token_stream.VOCABULARY)
+        :return: np.ndarray of int32, ids of the store vocabulary (new types get ids in order of first occurrence)
+        """
+        if len(self._remap) < len(VOCABULARY):
+            self._remap = np.concatenate([self._remap, np.full(len(VOCABULARY) - len(self._remap), -1, np.int32)])
+        ids = self._remap[type_ids]
+        new = ids < 0
+        if new.any():
+            unseen, first = np.unique(type_ids[new], return_index=True)
+            unseen = unseen[np.argsort(first)]
+            self._remap[unseen] = np.arange(len(self._types), len(self._types) + len(unseen), dtype=np.int32)
+            self._types.extend(VOCABULARY.decode(unseen))
+            ids = self._remap[type_ids]
+        return ids
+
+    def add(self, text_id, stream):
+        """
+        :param text_id: str
+        :param stream: token_stream.TokenStream of the text without stopwords (see ld_analyser.tokenize_streams())
+        """
+        ids = self._store_ids(stream.type_ids)
+        self._tokens.write(ids.tobytes())
+        self._pos.write(stream.pos_ids.astype(np.uint16).tobytes())
+        self._texts.append(text_id)
+        self._offsets.append(self._offsets[-1] + len(ids))
+
+        content = ~self._tag_set.functionword[stream.pos_ids]
+        for include_function_words, selected in ((True, ids), (False, ids[content])):
+            data, indices, indptr = self._counts[include_function_words]
+            types, counts = np.unique(selected, return_counts=True)
+            indices.append(types.astype(np.int32))
+            data.append(counts.astype(np.int32))
+            indptr.append(indptr[-1] + len(types))
+
+    def close(self):
+        """
+        Write the arrays of the store
+        """
+        self._tokens.close()
+        self._pos.close()
+        ntokens = self._offsets[-1]
+        for name, dtype in (("tokens", np.int32), ("pos", np.uint16)):
+            temporary = os.path.join(self.path, name + ".npy.tmp")
+            array = np.lib.format.open_memmap(os.path.join(self.path, name + ".npy"), mode="w+", dtype=dtype,
+                                              shape=(ntokens,))
+            if ntokens:
+                array[:] = np.memmap(temporary, dtype=dtype, mode="r", shape=(ntokens,))
+            array.flush()
+            del array
+            os.remove(temporary)
+        np.save(os.path.join(self.path, "offsets.npy"), np.array(self._offsets, dtype=np.int64))
+
+        for include_function_words, (data, indices, indptr) in self._counts.items():
+            np.savez(os.path.join(self.path, COUNTS[include_function_words]),
+                     data=np.concatenate(data) if data else np.zeros(0, np.int32),
+                     indices=np.concatenate(indices) if indices else np.zeros(0, np.int32),
+                     indptr=np.array(indptr, dtype=np.int64),
+                     shape=np.array([len(self._texts), len(self._types)], dtype=np.int64))
+
+        with open(os.path.join(self.path, "vocab.json"), "w", encoding="utf-8") as f:
+            json.dump(self._types, f, ensure_ascii=False)
+        with open(os.path.join(self.path, "texts.json"), "w", encoding="utf-8") as f:
+            json.dump(self._texts, f, ensure_ascii=False)
+        tags = self._tag_set.tags[:len(self._tag_set.functionword)]
+        with open(os.path.join(self.path, "store.json"), "w", encoding="utf-8") as f:
+            json.dump({"version": STORE_VERSION, "tokenizer": self.tokenizer, "texts": len(self._texts),
+                       "tokens": ntokens, "types": len(self._types), "tags": tags,
+                       "functionword": self._tag_set.functionword[:len(tags)].tolist()}, f, ensure_ascii=False)
+        logging.info("Token store is saved in %s: %s texts, %s tokens, %s types", self.path, len(self._texts),
+                     ntokens, len(self._types))
+
+
+class CorpusStore:
+    """
+    Read-only view of a store written by CorpusStoreWriter, with the lexical diversity indices of single texts,
+    groups of texts and the whole corpus
+    """
+
+    def __init__(self, path):
+        """
+        :param path: str, directory of the store
+        """
+        self.path = path
+        with open(os.path.join(path, "store.json"), encoding="utf-8") as f:
+            info = json.load(f)
+        if info["version"] != STORE_VERSION:
+            raise ValueError("{} is a store of version {}, expected {}".format(path, info["version"], STORE_VERSION))
+        self.tokenizer = info["tokenizer"]
+        self.tags = info["tags"]
+        self.functionword = np.array(info["functionword"], dtype=bool)
+        with open(os.path.join(path, "vocab.json"), encoding="utf-8") as f:
+            self.vocabulary = json.load(f)
+        with open(os.path.join(path, "texts.json"), encoding="utf-8") as f:
+            self.texts = json.load(f)
+        self._positions = {text_id: i for i, text_id in enumerate(self.texts)}
+        self.tokens = np.load(os.path.join(path, "tokens.npy"), mmap_mode="r")
+        self.pos = np.load(os.path.join(path, "pos.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "offsets.npy"))
+        self._counts = {}
+
+    def __len__(self):
+        return len(self.texts)
+
+    def stream(self, text_id, include_function_words=True):
+        """
+        :return: token_stream.TokenStream of the text (ids of the store vocabulary), without stopwords
+        """
+        i = self._positions[text_id]
+        start, end = self.offsets[i], self.offsets[i + 1]
+        stream = TokenStream(np.asarray(self.tokens[start:end]), np.asarray(self.pos[start:end]))
+        return stream if include_function_words else stream.without(self.functionword)
+
+    def tokens_of(self, text_id, include_function_words=True):
+        """
+        :return: list of str, the tokens of the text
+        """
+        vocabulary = self.vocabulary
+        return [vocabulary[type_id] for type_id in self.stream(text_id, include_function_words).type_ids.tolist()]
+
+    def counts(self, include_function_words=True):
+        """
+        :return: tuple (data, indices, indptr, shape), the document x type count matrix in CSR form
+                 (e.g. scipy.sparse.csr_matrix((data, indices, indptr), shape=shape))
+        """
+        if include_function_words not in self._counts:
+            with np.load(os.path.join(self.path, COUNTS[include_function_words])) as npz:
+                self._counts[include_function_words] = (npz["data"], npz["indices"], npz["indptr"],
+                                                        tuple(npz["shape"].tolist()))
+        return self._counts[include_function_words]
+
+    def frequencies(self, text_ids=None, include_function_words=True):
+        """
+        :param text_ids: list of str, texts of the group. None: the whole corpus
+        :return: np.ndarray, number of tokens of every type of the store vocabulary in the texts
+        """
+        data, indices, indptr, shape = self.counts(include_function_words)
+        if text_ids is None:
+            return np.bincount(indices, weights=data, minlength=shape[1]).astype(np.int64)
+        positions = [self._positions[text_id] for text_id in text_ids]
+        selected = np.concatenate([np.arange(indptr[i], indptr[i + 1]) for i in positions]) if positions \
+            else np.zeros(0, dtype=np.int64)
+        return np.bincount(indices[selected], weights=data[selected], minlength=shape[1]).astype(np.int64)
+
+    def text_indices(self, text_id, include_function_words=False, parallel_analysis=False, mx=200, loi=None):
+        """
+        Indices of a single text, the same values as a run with the numpy engine (in a process with the same hash
+        seed, see ld_engine.hdd()). Indices in ld_engine.COUNT_INDICES alone are calculated from the count matrix,
+        with HD-D summed in the order of the vocabulary
+        :param mx: int, minimum length of a text for parallel analysis
+        :param loi: list of indexes to calculate (see ld_engine.INDICES). None: all indices
+        :return: dict {index: value}, or {length: {index: value}} with parallel analysis.
+                 None if the text has no tokens, or is shorter than mx for parallel analysis
+        """
+        loi = loi or INDICES
+        if not parallel_analysis and set(loi) <= set(COUNT_INDICES):  # only the type frequencies are needed
+            frequencies = self.frequencies([text_id], include_function_words)
+            return {index: value for index, value in count_indices(frequencies).items()
+                    if index in loi} if frequencies.any() else None
+        stream = self.stream(text_id, include_function_words)
+        if len(stream) < 1 or (parallel_analysis and len(stream) < mx):
+            return None
+        vocabulary = self.vocabulary  # the tokens give HD-D the summation order of the run
+        tokens = [vocabulary[type_id] for type_id in stream.type_ids.tolist()]
+        if parallel_analysis:
+            return parallel_ld(tokens, loi=loi, mx=mx)
+        vald = FastLexdiv(tokens).vald
+        return {index: vald[index] for index in loi}
+
+    def group_indices(self, text_ids=None, include_function_words=False, loi=None):
+        """
+        Indices of a group of texts pooled into one text (tokens concatenated in the order of text_ids)
+        Indices in ld_engine.COUNT_INDICES are calculated from the count matrix without reading any token.
+        The other indices hold the type ids of the group in memory, and HD-D is summed in the order of the ids
+        :param text_ids: list of str, texts of the group. None: the whole corpus
+        :param loi: list of indexes to calculate (see ld_engine.INDICES). None: all indices
+        :return: dict {index: value}, None if the group has no tokens
+        """
+        loi = loi or INDICES
+        if set(loi) <= set(COUNT_INDICES):
+            frequencies = self.frequencies(text_ids, include_function_words)
+            if not frequencies.any():
+                return None
+            vald = count_indices(frequencies)
+        else:
+            if text_ids is None:  # the mapped arrays of the corpus, without a copy per text
+                stream = TokenStream(self.tokens, self.pos)
+            else:
+                positions = [self._positions[text_id] for text_id in text_ids]  # KeyError for an unknown text
+                bounds = [(self.offsets[i], self.offsets[i + 1]) for i in positions]
+                stream = TokenStream(
+                    np.concatenate([self.tokens[start:end] for start, end in bounds] or [np.zeros(0, np.int32)]),
+                    np.concatenate([self.pos[start:end] for start, end in bounds] or [np.zeros(0, np.uint16)]))
+            if not include_function_words:
+                stream = stream.without(self.functionword)
+            if len(stream) < 1:
+                return None
+            vald = FastLexdiv(ids=stream.dense_ids()).vald
+        return {index: vald[index] for index in loi}
+
+    def groups_indices(self, groups, include_function_words=False, loi=None):
+        """
+        :param groups: dict {group name: list of text ids}, e.g. texts by proficiency level
+        :return: dict {group name: indices of the pooled texts of the group}, see group_indices()
+        """
+        return {name: self.group_indices(text_ids, include_function_words, loi) for name, text_ids in groups.items()}
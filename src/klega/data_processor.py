@@ -1,81 +1,77 @@
 import logging
 
-import os
-import codecs
 import re
-import pandas as pd
-import importlib.util
-from util import current_time_as_str
+from spellcheck import MsWordChecker
 
-
-def import_win32com_client():
-    try:
-        import win32com.client
-        print("pywin32 is successfully imported. Typo removal function is enabled.")
-    except ImportError:
-        print("pywin32 is not installed. Typo removal function is disabled.")
+_WORD = re.compile(r'\w+')
+_SPLIT = re.compile(r'(\W+)')
 
 
+class TypoMatcher:
+    """
+    Delete the typos of a text in one scan.
+    Typos are matched literally as whole words, with the same result as r'\b(?:typo1|typo2)\b' on the typos of the text.
+    A typo made of word characters only (nearly all of them) is a whole word run of the text: the text is split once
+    into word runs and separators, and each word run is looked up in the typos of the text, which takes linear time
+    whatever the number of typos. Typos with other characters (e.g. a hyphen) can overlap each other and the word
+    runs, so the few texts with such a typo are processed with the escaped alternation of their own typos
+    """
 
-def typodelete(txt_id, txt_list, output_dir, save=True):
+    def __init__(self, typos):
+        """
+        :param typos: iterable of str, typos of the corpus
+        """
+        self.others = set(typo for typo in typos if typo and not _WORD.fullmatch(typo))
+
+    def delete(self, text, typos):
+        """
+        :param text: str
+        :param typos: list of str, typos of this text, in the order of the spellchecker
+                      (the first of several typos matching at the same position is deleted)
+        :return: str, text without its typos
+        """
+        if not typos:
+            return text
+        if not self.others.isdisjoint(typos):
+            return re.sub(r'\b(?:%s)\b' % '|'.join(re.escape(typo) for typo in typos), '', text)
+        typos = set(typos)
+        parts = _SPLIT.split(text)  # word runs at even positions, separators at odd positions
+        parts[0::2] = ["" if word in typos else word for word in parts[0::2]]
+        return "".join(parts)
+
+
+def typodelete(txt_id, txt_list, output_dir, save=True, backend=None, workers=1):
     """
-    Detect typo in a list of texts using MSword and delete the typos
+    Detect typo in a list of texts using MSword (or another spellcheck backend) and delete the typos
     :param output_dir: str, output directory to save the processed text
     :param txt_id: unique id of texts
     :param txt_list: list of texts
     :param save: boolean, if True, save the result file to excel
+    :param backend: spellcheck.SpellChecker, default: spellcheck.MsWordChecker (Microsoft Word)
+    :param workers: int, number of worker processes of the spellcheck backend (if supported)
     :return: df, which contains raw text, typos, and typo deleted text
     """
 
+    import pandas as pd
+
     logging.info("Processing the raw input: typo deletion . . .")
-    # make df to store results
-    df_column = ['raw', 'typo', 'processed']
-    output_df = pd.DataFrame(index=txt_id, columns=df_column)
-
-    # save the raw text into ms word form to use ms word typo corrector
-    current_time = current_time_as_str()
-    file_path = os.path.abspath(current_time + ".txt")
-    # logging.info("Concatenating files into a single .txt . . .")
-    with codecs.open(file_path, 'w', encoding='utf-8') as f:
-        index = 0
-        for text in txt_list:
-            index += 1
-            f.write(text)
-            if len(txt_list) > index:  # do not add \n at the end of the file
-                f.write('\n')
-
-    # open the ms word document
-    msword = win32com.client.DispatchEx('Word.Application')
-    # logging.info("Loading .txt into MS Word . . .")
-    doc = msword.Documents.Open(file_path)
-    assert int(doc.Paragraphs.Count) == len(txt_list)
-
-    # for each text(Paragraph in word), detect error
-    # logging.info("Processing text started . . .")
-    for i, p in enumerate(doc.Paragraphs):  # process per text
+    if backend is None:
+        backend = MsWordChecker()
+    typo_lists = backend.spelling_errors(txt_list, workers=workers)
+    # one matcher for the typos of the whole corpus
+    matcher = TypoMatcher(set(typo for typo_list in typo_lists for typo in typo_list))
+
+    # results are collected as columns, and the df is made once at the end
+    raw_column = []
+    processed_column = []
+    for i, typo_list in enumerate(typo_lists):  # process per text
         tab_removed_raw = re.sub("\t", " ", txt_list[i])  # remove all tabs to store the data as tsv file
-        typos = p.Range.SpellingErrors
-        item = []
-        typo_list = []
+        raw_column.append(tab_removed_raw)
+        processed_column.append(matcher.delete(tab_removed_raw, typo_list))  # delete typos in text
 
-        for typo in typos:  # make typo list
-            typo_list.append(str(typo))
-
-        # delete typos in text
-        pattern = re.compile(r'\b(?:%s)\b' % '|'.join(typo_list))
-        processed = re.sub(pattern, '', tab_removed_raw)
-
-        item.append(tab_removed_raw)
-        item.append(typo_list)
-        item.append(processed)
-        output_df.loc[txt_id[i]] = item
-
-        assert "\t" not in tab_removed_raw, f"File {txt_id[i]} contains tab, Please remove all tabs in the file for generating tsv file. "
-
-    # close and delete temporary files
-    doc.Close(0)
-    msword.Quit(0)
-    os.remove(file_path)
+    df_column = ['raw', 'typo', 'processed']
+    output_df = pd.DataFrame({'raw': raw_column, 'typo': typo_lists, 'processed': processed_column},
+                             index=txt_id, columns=df_column)
 
     if save:
         file_path = output_dir + '/' + "processed_data" + ".tsv"
@@ -1,44 +1,166 @@
 import os
+import mmap
+import hashlib
+import time
 import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from string import digits
+from metrics import stage
+
+MMAP_THRESHOLD = 4 * 1024 * 1024  # files from this size (in bytes) on are memory-mapped instead of read
+
+# single-pass normalizers: newlines to spaces (and digits removed)
+_NEWLINES = str.maketrans({"\r": " ", "\n": " "})
+_NEWLINES_N_DIGITS = str.maketrans(dict({"\r": " ", "\n": " "}, **{digit: None for digit in digits}))
+
+
+def _read_raw(file_path, use_mmap=True):
+    """
+    Read and decode a utf-8 file in one go. Large files are decoded straight from a memory map.
+    :return: tuple (text, number of bytes read)
+    """
+    with open(file_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if use_mmap and size >= MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                txt = str(mapped, 'utf-8')
+        else:
+            txt = f.read().decode('utf-8')
+    if "\r" in txt:  # same as reading in text mode (universal newlines): \r\n counts as a single newline
+        txt = txt.replace("\r\n", "\n")
+    return txt, size
 
 
 def read_text_file(file_path):
-    with open(file_path, 'r', encoding='utf-8') as f:
-        txt = f.read()
-        txt = txt.replace("\n", " ")
-    return txt
+    txt, _ = _read_raw(file_path)
+    return txt.translate(_NEWLINES)
+
+
+def _read_entry(file_path, remove_num):
+    """
+    :return: tuple (text or None if the file is empty, number of bytes read)
+    """
+    with stage("read"):
+        txt, size = _read_raw(file_path)
+        if len(txt) < 1:
+            return None, size
+        return txt.translate(_NEWLINES_N_DIGITS if remove_num else _NEWLINES), size
+
+
+def shard_of(name, count):
+    """
+    Stable partition of the corpus: the shard only depends on the file name, so it is the same on every machine,
+    in every run and for every directory order (unlike hash(), which is salted per process)
+    :param name: str, file name
+    :param count: int, number of shards
+    :return: int, shard index of the file, from 1 to count
+    """
+    digest = hashlib.sha1(name.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count + 1
+
+
+def _scan(path, shard=None):
+    """
+    :param shard: tuple (index, count), only list the files of this shard (see shard_of). None: all files
+    :return: list of tuple (file name, file path) of plain text files (.txt) in the path, in directory order
+    """
+    with os.scandir(path) as entries:
+        files = [(entry.name, entry.path) for entry in entries if entry.name.endswith(".txt")]
+    if shard is not None:
+        index, count = shard
+        files = [(name, file_path) for name, file_path in files if shard_of(name, count) == index]
+    return files
+
+
+def list_texts(path, shard=None):
+    """
+    :param shard: tuple (index, count), only list the files of this shard (see shard_of). None: all files
+    :return: list of str, names of the plain text files (.txt) in the path, in the order they are analysed
+    """
+    return [name for name, _ in _scan(path, shard)]
 
 
-def read_texts_into_lists(path, remove_num=True):
+def count_texts(path, shard=None):
+    """
+    :return: int, number of plain text files (.txt) in the path (or in the shard of the path)
+    """
+    return len(_scan(path, shard))
+
+
+def _log_throughput(nfiles, nbytes, start):
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    logging.info("Read %s files (%.2f MB) in %.2fs: %.1f files/s, %.2f MB/s", nfiles, nbytes / 1024 / 1024, elapsed,
+                 nfiles / elapsed, nbytes / 1024 / 1024 / elapsed)
+
+
+def iter_texts(path, remove_num=True, threads=1, shard=None):
+    """
+    Lazily read plain text files (.txt) in the path, one file at a time
+    :param path: str, directory to the input files
+    :param remove_num: bool, if set True, remove numbers in the text (see read_texts_into_lists)
+    :param threads: int, number of threads reading files ahead (useful on network filesystems)
+    :param shard: tuple (index, count), only read the files of this shard (see shard_of). None: all files
+    :return: generator of tuple (txt_id, text) where txt_id is the file name
+    """
+    start = time.perf_counter()
+    files = _scan(path, shard)
+    count = 0
+    nbytes = 0
+
+    if threads > 1:
+        pool = ThreadPoolExecutor(max_workers=threads)
+        pending = deque()
+        files_iter = iter(files)
+
+        def contents():
+            for name, file_path in files_iter:  # keep a bounded number of files read ahead
+                pending.append((name, pool.submit(_read_entry, file_path, remove_num)))
+                if len(pending) >= 4 * threads:
+                    name, future = pending.popleft()
+                    yield name, future.result()
+            while pending:
+                name, future = pending.popleft()
+                yield name, future.result()
+    else:
+        pool = None
+
+        def contents():
+            for name, file_path in files:
+                yield name, _read_entry(file_path, remove_num)
+
+    try:
+        for name, (txt, size) in contents():
+            nbytes += size
+            if txt is None:
+                logging.info("%s is empty file. Skipped", name)
+                continue
+            count += 1
+            yield name, txt
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+    logging.info("%s files read successfully.", count)
+    _log_throughput(len(files), nbytes, start)
+
+
+def read_texts_into_lists(path, remove_num=True, threads=1, shard=None):
     """
     read all plain text files (.txt) in the path and return text id (file name) and text contents as list
     :param remove_num: bool, if set True, remove numbers in the text.
                         default is set True. (Processing numbers are not consistent for korean tokenizers, so remove nums beforehand.)
     :param path: str, directory to the input files
+    :param threads: int, number of threads reading files concurrently (useful on network filesystems)
+    :param shard: tuple (index, count), only read the files of this shard (see shard_of). None: all files
     :return: tuple (txt_id, text_list)
                 where (txt_id) is a list of file names
                       (text_list) is a list of file contents as string
     """
-    owd = os.getcwd()
-    os.chdir(path)
     text_list = list()
     txt_id = list()
-    for file in os.listdir():
-        if file.endswith(".txt"):
-            txt = read_text_file(file)
-            if len(txt) < 1:
-                logging.info("%s is empty file. Skipped", file)
-                continue
-            txt_id.append(file)
-            txt = read_text_file(file)
-            text_list.append(txt)
-
-    os.chdir(owd)
-
-    if remove_num:   # remove number
-        text_list = [txt.translate(str.maketrans('', '', digits)) for txt in text_list]
-
-    logging.info("%s files read successfully.", len(txt_id))
+    for file, txt in iter_texts(path, remove_num=remove_num, threads=threads, shard=shard):
+        txt_id.append(file)
+        text_list.append(txt)
 
     return txt_id, text_list
@@ -1,16 +1,11 @@
-from konlpy.tag import Okt, Komoran, Kkma, Hannanum
+import importlib
+import logging
+import threading
+import time
 
-try:
-    import mecab_ko as MeCab
-except:
-    print("mecab_ko is not installed. If you want to use the mecab tokenizer, please install the package.")
-    pass
-
-try:
-    import stanza
-except:
-    print("stanza is not installed. If you want to use the stanza tokenizer, please install the package.")
-    pass
+# the tagger packages are imported on first use (see _import()): konlpy loads JPype and starts a JVM with its first
+# tagger, and stanza imports torch, which would slow down every start of the CLI and of the web workers
+_PACKAGES = {"mecab": "mecab_ko", "stanza": "stanza"}
 
 OKT_STOPWORDS = ["Punctuation", "Foreign", "Alpha", "Number", "Unknown", "KoreanParticle", "Hashtag", "ScreenName",
                  "Email", "URL"]
@@ -45,51 +40,238 @@ def remove_pos(token_pos_tuple, pos_list):
     :param pos_list: list of POS to be removed
     :return: cleaned tuple of ('token', 'Part-Of-Speech') as list
     """
-    pos_tuple_cleaned = []
+    pos_set = frozenset(pos_list)  # constant-time membership instead of scanning the list for every token
 
-    for index, pair in enumerate(token_pos_tuple):
-        if pair[1] not in pos_list:
-            pos_tuple_cleaned.append(pair)
+    return [pair for pair in token_pos_tuple if pair[1] not in pos_set]
 
-    return pos_tuple_cleaned
 
+TOKENIZERS = ["okt", "komoran", "mecab", "kkma", "hannanum", "stanza"]
 
-def tokenize(tokenizer, text):
+STOPWORDS = {"okt": OKT_STOPWORDS, "komoran": KOMORAN_STOPWORDS, "mecab": MECAB_STOPWORDS,
+             "kkma": KKMA_STOPWORDS, "hannanum": HANNANUM_STOPWORDS, "stanza": STANZA_STOPWORDS}
+
+# stanza has no function word tags (functionwords=False is not provided for stanza)
+FUNCTIONWORDS = {"okt": OKT_FUNCTIONWORDS, "komoran": KOMORAN_FUNCTIONWORDS, "mecab": MECAB_FUNCTIONWORDS,
+                 "kkma": KKMA_FUNCTIONWORDS, "hannanum": HANNANUM_FUNCTIONWORDS}
+
+BATCH_SIZE = 32  # texts tagged together by tokenize_batch()
+
+# mecab writes only the surface and the top-level POS of each morpheme instead of the whole feature string
+# (MeCab splits the arguments on whitespace and keeps quotes, so the formats must not be quoted)
+MECAB_LEAN_ARGS = "--node-format=%m\\t%f[0]\\n --eos-format=EOS\\n"
+_mecab_lean = False  # whether the mecab tagger was built with MECAB_LEAN_ARGS
+
+# joins okt texts in a batch: a standalone Latin word is a chunk of its own, tagged Alpha,
+# and open-korean-text analyses every chunk separately, so it cannot change the tags of its neighbours
+_OKT_BOUNDARY = "KLEGABATCHBOUNDARY"
+
+# process-wide tagger registry: each tagger is built once on first use and reused afterwards
+_registry_lock = threading.Lock()
+_taggers = {}
+_tagger_locks = {}
+_tagger_stats = {}
+_versions = {}
+
+
+def _build_tagger(tokenizer):
     """
-    tokenize sequences using konlpy tokenizer.
+    Construct a new tagger instance. Use get_tagger() instead of calling this directly.
     :param tokenizer: str, possible options: (okt, komoran, mecab, kkma, hannanum, stanza)
-    :param text: str, raw text
-    :return: tuple (pos_tuple_all, pos_tuple_cleaned, tokens_cleaned)
-            where pos_tuple_all consists of tuple ('token', 'Part-Of-Speech') of all raw tokens (including stopwords like punctuation, numbers, URL ...)
-                  pos_tuple_cleaned consists of tuple ('token', 'Part-Of-Speech') of contents words (+ function words if the param include_function_words=True)
-                  tokens_cleaned is a list of stopword removed tokens (if the param include_function_words=True, function words are also included)
+    :return: tagger object of the given tokenizer
     """
-
     if tokenizer == 'okt':
-        tagger = Okt()
-        stopwords = OKT_STOPWORDS
+        from konlpy.tag import Okt
+        return Okt()
     elif tokenizer == 'komoran':
-        tagger = Komoran()
-        stopwords = KOMORAN_STOPWORDS
+        from konlpy.tag import Komoran
+        return Komoran()
     elif tokenizer == 'mecab':
-        tagger = MeCab.Tagger()
-        stopwords = MECAB_STOPWORDS
+        return _build_mecab()
     elif tokenizer == 'kkma':
-        tagger = Kkma()
-        stopwords = KKMA_STOPWORDS
+        from konlpy.tag import Kkma
+        return Kkma()
     elif tokenizer == 'hannanum':
-        tagger = Hannanum()
-        stopwords = HANNANUM_STOPWORDS
+        from konlpy.tag import Hannanum
+        return Hannanum()
     elif tokenizer == 'stanza':
-        tagger = stanza.Pipeline('ko', processors='tokenize,pos', package='gsd')
-        stopwords = STANZA_STOPWORDS
+        return _import('stanza').Pipeline('ko', processors='tokenize,pos', package='gsd')
     else:
         raise ValueError("tokenizer must be one of these options: (okt, komoran, mecab, kkma, hannanum, stanza)")
 
-    # tokenize
+
+def _import(tokenizer):
+    """
+    :return: module, the package of the mecab or stanza tokenizer (imported once, on first use)
+    """
+    try:
+        return importlib.import_module(_PACKAGES[tokenizer])
+    except ImportError as e:
+        raise ImportError("{} is not installed. If you want to use the {} tokenizer, please install the package."
+                          .format(_PACKAGES[tokenizer], tokenizer)) from e
+
+
+def _build_mecab():
+    global _mecab_lean
+    MeCab = _import('mecab')
+    try:
+        tagger = MeCab.Tagger(MECAB_LEAN_ARGS)
+    except RuntimeError:  # output format options not accepted: parse the default output
+        _mecab_lean = False
+        logging.info("MeCab does not accept %s: parsing its default output", MECAB_LEAN_ARGS)
+        return MeCab.Tagger()
+    # check the output format once: every morpheme line must be exactly "surface<TAB>POS"
+    lines = tagger.parse("형태소 분석기").split("\n")
+    _mecab_lean = lines[-2:] == ["EOS", ""] and all(line.count("\t") == 1 and "," not in line.split("\t")[1]
+                                                    for line in lines[:-2])
+    if not _mecab_lean:
+        logging.info("MeCab does not write surface and POS with %s: parsing its default output", MECAB_LEAN_ARGS)
+        return MeCab.Tagger()
+    return tagger
+
+
+def _parse_mecab(output):
+    """
+    Split the output of a tagger built with MECAB_LEAN_ARGS ("surface<TAB>POS" lines, then "EOS")
+    Surfaces never contain tabs or newlines, so one flat split gives surface and POS in turn
+    :return: list of tuple ('token', 'Part-Of-Speech')
+    """
+    fields = output[:-len("EOS\n")].replace("\n", "\t").split("\t")
+    return list(zip(fields[0::2], fields[1::2]))
+
+
+def _new_stats():
+    return {"constructions": 0, "construction_time": 0.0, "calls": 0, "tagging_time": 0.0}
+
+
+def get_tagger(tokenizer):
+    """
+    Return the shared tagger of the given tokenizer, building it on first use (thread-safe)
+    :param tokenizer: str, possible options: (okt, komoran, mecab, kkma, hannanum, stanza)
+    :return: tagger object of the given tokenizer
+    """
+    tagger = _taggers.get(tokenizer)
+    if tagger is not None:
+        return tagger
+
+    with _registry_lock:
+        tagger = _taggers.get(tokenizer)
+        if tagger is None:
+            start = time.perf_counter()
+            tagger = _build_tagger(tokenizer)
+            elapsed = time.perf_counter() - start
+            stats = _tagger_stats.setdefault(tokenizer, _new_stats())
+            stats["constructions"] += 1
+            stats["construction_time"] += elapsed
+            _tagger_locks[tokenizer] = threading.Lock()
+            _taggers[tokenizer] = tagger
+            if _observer is not None:
+                _observer("tagger_construction", elapsed, 0)
+    return tagger
+
+
+def warm_up(tokenizers):
+    """
+    Build the taggers in advance so that the first text does not pay the loading cost
+    :param tokenizers: list of tokenizer names
+    :return: none
+    """
+    for tokenizer in tokenizers:
+        get_tagger(tokenizer)
+
+
+def tear_down(tokenizers=None):
+    """
+    Release the shared taggers. They are built again on the next use.
+    :param tokenizers: list of tokenizer names to release. If None, release all taggers
+    :return: none
+    """
+    with _registry_lock:
+        for tokenizer in list(_taggers if tokenizers is None else tokenizers):
+            _taggers.pop(tokenizer, None)
+            _tagger_locks.pop(tokenizer, None)
+
+
+def tagger_stats():
+    """
+    Timing counters of the tagger registry, separating tagger construction from tagging
+    :return: dict, {tokenizer: {"constructions", "construction_time", "calls", "tagging_time"}}
+    """
+    with _registry_lock:
+        return {tokenizer: dict(stats) for tokenizer, stats in _tagger_stats.items()}
+
+
+def reset_tagger_stats():
+    with _registry_lock:
+        _tagger_stats.clear()
+
+
+def tagger_version(tokenizer):
+    """
+    Version string of the tokenizer package (and of its dictionary, where available)
+    Tagging results depend on this version, so it is part of the tokenization cache key
+    :param tokenizer: str, possible options: (okt, komoran, mecab, kkma, hannanum, stanza)
+    :return: str, version string
+    """
+    version = _versions.get(tokenizer)
+    if version is not None:
+        return version
+
+    if tokenizer == 'stanza':
+        version = "stanza-" + _import('stanza').__version__ + "-gsd"
+    elif tokenizer == 'mecab':  # building a mecab tagger is cheap, and it knows its dictionary version
+        version = "mecab_ko-" + getattr(_import('mecab'), "__version__", "unknown")
+        tagger = get_tagger(tokenizer)
+        if hasattr(tagger, "dictionary_info"):
+            version += "-dic" + str(getattr(tagger.dictionary_info(), "version", ""))
+    else:  # konlpy bundles the dictionaries of its taggers
+        import konlpy
+        version = "konlpy-" + konlpy.__version__
+    _versions[tokenizer] = version
+    return version
+
+
+# optional persistent tokenization cache (see token_cache.TokenCache)
+_cache = None
+
+
+def set_cache(cache):
+    """
+    Make tokenize() consult a tokenization cache before tagging
+    :param cache: token_cache.TokenCache object, or None to disable caching
+    :return: none
+    """
+    global _cache
+    _cache = cache
+
+
+def get_cache():
+    return _cache
+
+
+# optional timing observer (see metrics.record)
+_observer = None
+
+
+def set_observer(observer):
+    """
+    Report the duration of every tagger construction and tagging call
+    :param observer: callable (stage, seconds, number of tokens), or None to disable
+    :return: none
+    """
+    global _observer
+    _observer = observer
+
+
+def _tag(tokenizer, tagger, text):
+    """
+    Run the tagger on a text
+    :return: list of tuple ('token', 'Part-Of-Speech') of all raw tokens
+    """
     if tokenizer == 'stanza':
         doc = tagger(text)
         pos_tuple_all = [(word.text, word.upos) for sent in doc.sentences for word in sent.words]
+    elif tokenizer == 'mecab' and _mecab_lean:
+        pos_tuple_all = _parse_mecab(tagger.parse(text))
     elif tokenizer == 'mecab':
         tmp_mecab = tagger.parse(text)
         tmp_mecab = tmp_mecab.split("\n")
@@ -99,8 +281,105 @@ def tokenize(tokenizer, text):
     else:
         pos_tuple_all = tagger.pos(text)
 
+    return pos_tuple_all
+
+
+def _tag_okt_batch(tagger, texts):
+    """
+    Tag okt texts with a single call to the JVM, joined by boundary markers
+    :return: list of pos_tuple_all, one per text
+    """
+    results = [None] * len(texts)
+    # texts containing the marker (or nothing to tag) are tagged on their own
+    joinable = [i for i, text in enumerate(texts) if text.strip() and _OKT_BOUNDARY not in text]
+    if len(joinable) > 1:
+        segments = [[]]
+        for pair in tagger.pos((" " + _OKT_BOUNDARY + " ").join(texts[i] for i in joinable)):
+            if pair == (_OKT_BOUNDARY, "Alpha"):
+                segments.append([])
+            else:
+                segments[-1].append(pair)
+        if len(segments) == len(joinable):  # otherwise some marker was not tagged alone: tag text by text
+            for i, segment in zip(joinable, segments):
+                results[i] = segment
+    for i, text in enumerate(texts):
+        if results[i] is None:
+            results[i] = tagger.pos(text)
+    return results
+
+
+def _tag_batch(tokenizer, tagger, texts, batch_size):
+    """
+    Run the tagger on several texts, in bulk where the tagger supports it
+    stanza processes documents together, and okt texts are joined into one call. The other konlpy taggers and
+    mecab analyse whole sentences (komoran: lines), so joined texts could change each other's tags: they run per text
+    :return: list of pos_tuple_all, one per text, same as _tag() on each text
+    """
+    if tokenizer == 'stanza' and hasattr(tagger, "bulk_process"):
+        Document = _import('stanza').Document
+        results = []
+        for i in range(0, len(texts), batch_size):
+            docs = tagger.bulk_process([Document([], text=text) for text in texts[i:i + batch_size]])
+            results.extend([(word.text, word.upos) for sent in doc.sentences for word in sent.words] for doc in docs)
+        return results
+    elif tokenizer == 'okt':
+        results = []
+        for i in range(0, len(texts), batch_size):
+            results.extend(_tag_okt_batch(tagger, texts[i:i + batch_size]))
+        return results
+    return [_tag(tokenizer, tagger, text) for text in texts]
+
+
+def tag(tokenizer, text):
+    """
+    Tag a text with the shared tagger of the given tokenizer (thread-safe)
+    :param tokenizer: str, possible options: (okt, komoran, mecab, kkma, hannanum, stanza)
+    :param text: str, raw text
+    :return: list of tuple ('token', 'Part-Of-Speech') of all raw tokens
+    """
+    tagger = get_tagger(tokenizer)
+    lock = _tagger_locks.setdefault(tokenizer, threading.Lock())
+    with lock:  # taggers are not guaranteed to be safe for concurrent use
+        start = time.perf_counter()
+        pos_tuple_all = _tag(tokenizer, tagger, text)
+        elapsed = time.perf_counter() - start
+        stats = _tagger_stats.setdefault(tokenizer, _new_stats())
+        stats["calls"] += 1
+        stats["tagging_time"] += elapsed
+    if _observer is not None:
+        _observer("tagging", elapsed, len(pos_tuple_all))
+
+    return pos_tuple_all
+
+
+def tag_batch(tokenizer, texts, batch_size=BATCH_SIZE):
+    """
+    Tag several texts with the shared tagger of the given tokenizer (thread-safe)
+    :param texts: list of str
+    :param batch_size: int, maximum number of texts tagged in one call
+    :return: list of pos_tuple_all, one per text (see tag())
+    """
+    tagger = get_tagger(tokenizer)
+    lock = _tagger_locks.setdefault(tokenizer, threading.Lock())
+    with lock:
+        start = time.perf_counter()
+        results = _tag_batch(tokenizer, tagger, texts, batch_size)
+        elapsed = time.perf_counter() - start
+        stats = _tagger_stats.setdefault(tokenizer, _new_stats())
+        stats["calls"] += len(texts)
+        stats["tagging_time"] += elapsed
+    if _observer is not None:
+        _observer("tagging", elapsed, sum(len(pos_tuple_all) for pos_tuple_all in results))
+
+    return results
+
+
+def _clean(tokenizer, pos_tuple_all):
+    """
+    :return: tuple (pos_tuple_all, pos_tuple_cleaned, tokens_cleaned), see tokenize()
+    """
     # remove stopwords
-    pos_tuple_cleaned = remove_pos(pos_tuple_all, pos_list=stopwords)
+    pos_tuple_cleaned = remove_pos(pos_tuple_all, pos_list=STOPWORDS[tokenizer])
 
     # separate lists for tokens
     tokens_cleaned = [item[0] for item in pos_tuple_cleaned]
@@ -108,6 +387,72 @@ def tokenize(tokenizer, text):
     return pos_tuple_all, pos_tuple_cleaned, tokens_cleaned
 
 
+def tokenize(tokenizer, text):
+    """
+    tokenize sequences using konlpy tokenizer.
+    The tagger is taken from the process-wide registry, so it is only built once per process.
+    :param tokenizer: str, possible options: (okt, komoran, mecab, kkma, hannanum, stanza)
+    :param text: str, raw text
+    :return: tuple (pos_tuple_all, pos_tuple_cleaned, tokens_cleaned)
+            where pos_tuple_all consists of tuple ('token', 'Part-Of-Speech') of all raw tokens (including stopwords like punctuation, numbers, URL ...)
+                  pos_tuple_cleaned consists of tuple ('token', 'Part-Of-Speech') of contents words (+ function words if the param include_function_words=True)
+                  tokens_cleaned is a list of stopword removed tokens (if the param include_function_words=True, function words are also included)
+    """
+    if tokenizer not in STOPWORDS:
+        raise ValueError("tokenizer must be one of these options: (okt, komoran, mecab, kkma, hannanum, stanza)")
+
+    # tokenize (or take the tagging result from the cache)
+    if _cache is not None:
+        version = tagger_version(tokenizer)
+        pos_tuple_all = _cache.get(tokenizer, version, text)
+        if pos_tuple_all is None:
+            pos_tuple_all = tag(tokenizer, text)
+            _cache.put(tokenizer, version, text, pos_tuple_all)
+    else:
+        pos_tuple_all = tag(tokenizer, text)
+
+    return _clean(tokenizer, pos_tuple_all)
+
+
+def tag_texts(tokenizer, texts, batch_size=BATCH_SIZE):
+    """
+    Tag several texts at once, taking the results from the tokenization cache where possible
+    :param tokenizer: str, possible options: (okt, komoran, mecab, kkma, hannanum, stanza)
+    :param texts: list of str
+    :param batch_size: int, maximum number of texts tagged in one call
+    :return: list of pos_tuple_all (see tokenize()) in the same order as texts
+    """
+    if tokenizer not in STOPWORDS:
+        raise ValueError("tokenizer must be one of these options: (okt, komoran, mecab, kkma, hannanum, stanza)")
+    texts = list(texts)
+
+    pos_tuples = [None] * len(texts)
+    if _cache is not None:
+        version = tagger_version(tokenizer)
+        pos_tuples = [_cache.get(tokenizer, version, text) for text in texts]
+    missing = [i for i, pos_tuple_all in enumerate(pos_tuples) if pos_tuple_all is None]
+    if missing:
+        tagged = tag_batch(tokenizer, [texts[i] for i in missing], batch_size)
+        for i, pos_tuple_all in zip(missing, tagged):
+            pos_tuples[i] = pos_tuple_all
+            if _cache is not None:
+                _cache.put(tokenizer, version, texts[i], pos_tuple_all)
+
+    return pos_tuples
+
+
+def tokenize_batch(tokenizer, texts, batch_size=BATCH_SIZE):
+    """
+    Tokenize several texts at once. Each result is the same as tokenize() on the text, but stanza and okt
+    tag the texts in bulk instead of paying the per-call overhead (neural batching, JVM calls) for every text
+    :param tokenizer: str, possible options: (okt, komoran, mecab, kkma, hannanum, stanza)
+    :param texts: list of str
+    :param batch_size: int, maximum number of texts tagged in one call
+    :return: list of tuple (pos_tuple_all, pos_tuple_cleaned, tokens_cleaned) in the same order as texts
+    """
+    return [_clean(tokenizer, pos_tuple_all) for pos_tuple_all in tag_texts(tokenizer, texts, batch_size)]
+
+
 def remove_function_words(pos_tuple, tokenizer):
     """
     Remove function words from tokenized pos tuple
@@ -117,18 +462,7 @@ def remove_function_words(pos_tuple, tokenizer):
     :return:
     """
 
-    functionwords = []
-
-    if tokenizer == 'okt':
-        functionwords = OKT_FUNCTIONWORDS
-    elif tokenizer == 'komoran':
-        functionwords = KOMORAN_FUNCTIONWORDS
-    elif tokenizer == 'mecab':
-        functionwords = MECAB_FUNCTIONWORDS
-    elif tokenizer == 'kkma':
-        functionwords = KKMA_FUNCTIONWORDS
-    elif tokenizer == 'hannanum':
-        functionwords = HANNANUM_FUNCTIONWORDS
+    functionwords = FUNCTIONWORDS.get(tokenizer, [])
 
     pos_tuple_cleaned = remove_pos(pos_tuple, pos_list=functionwords)
 
@@ -1,89 +1,371 @@
-from korean_tokenizer import tokenize, remove_function_words
-from taaled import parallel, lexdiv
+from korean_tokenizer import tag_texts, warm_up, get_cache, set_cache, set_observer
+from token_stream import VOCABULARY, encode, tag_set
+from token_cache import TokenCache
+from ld_engine import get_lexdiv, parallel_ld, FastLexdiv
+from corpus_store import CorpusStoreWriter
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 import logging
-from util import current_time_as_str
+import os
+import time
+from metrics import METRICS, Progress, stage, record, profiled
+from result_writer import WRITERS, columns, open_writer, resolve_format
 
+# indexes
+LOI = ["ntokens", "ntypes", "mtld", "mtldo", "mattr", "ttr", "rttr", "lttr", "maas", "msttr", "hdd"]
 
-def tokenize_n_make_ld_matrix(data, tokenizer, include_function_words, parallel_analysis, output_dir, mx=200):
+
+def result_file_name(output_dir, tokenizer, include_function_words, parallel_analysis, extension=".tsv"):
     """
-    Tokenize and calculate all files in the df data and write output as tsv
-    (This code includes partial modification of TAALED package source code)
-    :param output_dir: str, output directory to store result files
+    :param extension: str, extension of the output format (see result_writer)
+    :return: str, path of the result file for the given configuration
+    """
+    if include_function_words:
+        file_name = output_dir + "/" + tokenizer + "_all_words"
+        if parallel_analysis:
+            file_name = output_dir + "/" + tokenizer + "_all_words_prll"
+    else:
+        file_name = output_dir + "/" + tokenizer + "_content_only"
+        if parallel_analysis:
+            file_name = output_dir + "/" + tokenizer + "_content_only_prll"
+    return file_name + extension
+
+
+def _make_rows(stream, parallel_analysis, mx, loi, engine="taaled"):
+    """
+    Calculate lexical diversity indices of a token stream
+    :param stream: token_stream.TokenStream
+    :return: tuple (status, rows), see analyse_text()
+    """
+    lexdiv = get_lexdiv(engine)
+    if len(stream) < 1:  # nothing to analysis
+        return "empty", []
+
+    rows = []
+    if parallel_analysis:
+        if len(stream) < mx:  # in case the text is too short for parallel analysis
+            return "short", []
+        with stage("parallel", mx):
+            if engine == "numpy":  # single sweep over the text instead of analysing every sample from scratch
+                # the tokens give HD-D the summation order of taaled (see ld_engine.hdd())
+                ld_lists = parallel_ld(VOCABULARY.decode(stream.type_ids[:mx]), loi=loi, mx=mx)
+            else:
+                from taaled import parallel
+                tokens_cleaned = stream.tokens(VOCABULARY)
+                ld_lists = parallel(text=tokens_cleaned, clss=True, functd=None, funct=lexdiv, loi=loi, mx=mx).ldvals
+        for length in ld_lists:  # iterate through text slices
+            outl = [length]  # list of items to write, will add each index below
+            for index in loi:  # iterate through index list:
+                outl.append(ld_lists[length][index])  # add index to outr list (in same order as loi list)
+            rows.append(outl)
+    else:  # no parallel analysis
+        with stage("lexdiv", len(stream)):
+            if engine == "numpy":  # the tokens give HD-D the summation order of taaled (see ld_engine.hdd())
+                ldout = FastLexdiv(stream.tokens(VOCABULARY)).vald
+            else:
+                ldout = lexdiv(stream.tokens(VOCABULARY)).vald  # get dictionary version of lexical diversity output
+        outl = []  # list of items to write, will add each index below
+        for index in loi:  # iterate through index list:
+            outl.append(ldout[index])  # add index to outr list (in same order as loi list)
+        rows.append(outl)
+
+    return None, rows
+
+
+def tokenize_streams(tokenizer, texts):
+    """
+    Tag texts (in one batch) and encode them as token streams without stopwords
+    :return: list of token_stream.TokenStream, same tokens as tokens_cleaned of korean_tokenizer.tokenize()
+    """
+    start = time.perf_counter()
+    tags = tag_set(tokenizer)
+    # the mask is read after encoding: encoding a text may add new tags to the tag set
+    streams = [encode(tokenizer, pos_tuple_all).without(tags.stopword) for pos_tuple_all in tag_texts(tokenizer, texts)]
+    record("tokenize", time.perf_counter() - start, sum(len(stream) for stream in streams))
+    return streams
+
+
+def analyse_text(text, tokenizer, configs, mx=200, loi=LOI, engine="taaled", stream=None):
+    """
+    Tokenize a single text once and calculate its lexical diversity indices for every configuration
+    :param text: str, processed (typo removed) text
+    :param tokenizer: str, possible options: (okt, komoran, mecab, kkma, hannanum, stanza)
+    :param configs: list of tuple (include_function_words, parallel_analysis)
+    :param mx: int, minimum length of a text for parallel analysis
+    :param loi: list of indexes to calculate
+    :param engine: str, lexical diversity engine, possible options: (taaled, numpy)
+    :param stream: TokenStream of the text without stopwords, if it was already tokenized (see tokenize_streams())
+    :return: list of tuple (status, rows) in the same order as configs
+            where status is None if the text is analysed, "empty" if it has no analysable tokens
+                  and "short" if it is too short for parallel analysis
+                  rows is a list of rows to write, each row being a list of index values (float)
+                  (parallel analysis rows start with the text length)
+    """
+    if stream is None:
+        stream = tokenize_streams(tokenizer, [text])[0]
+    stream_content = None
+
+    results = []
+    for include_function_words, parallel_analysis in configs:
+        if include_function_words:
+            selected = stream
+        else:
+            if stream_content is None:  # function words are removed once for all content-only configurations
+                with stage("remove_function_words", len(stream)):
+                    stream_content = stream.without(tag_set(tokenizer).functionword)
+            selected = stream_content
+        results.append(_make_rows(selected, parallel_analysis, mx, loi, engine))
+
+    return results
+
+
+def _init_worker(tokenizer, cache_settings):
+    set_observer(record)  # tagger timings are sent back to the parent process with every chunk
+    if cache_settings is not None:  # the tagger is built on the first cache miss
+        set_cache(TokenCache(*cache_settings))
+    else:  # every worker process builds its own tagger once, before the first chunk arrives
+        warm_up([tokenizer])
+
+
+def _tokenize_n_analyse_text(text, tokenizer, configs, mx, loi, engine):
+    """
+    :return: tuple (results, TokenStream of the text), see analyse_text()
+    """
+    stream = tokenize_streams(tokenizer, [text])[0]
+    return analyse_text(text, tokenizer, configs, mx, loi, engine, stream=stream), stream
+
+
+def _analyse_batch(chunk, tokenizer, configs, mx, loi, engine, profile, keep_streams=False):
+    """
+    Tokenize a chunk of (text id, text) records in one batch, then analyse each text
+    :param keep_streams: bool, if set True, also return the token stream of each text
+    :return: list of tuple (text id, results, TokenStream or None), see analyse_text()
+    """
+    # a profiled text is tokenized on its own, so that its profile includes tagging
+    batch = [text for text_id, text in chunk if profile is None or text_id != profile[0]]
+    streams = iter(tokenize_streams(tokenizer, batch))
+
+    results = []
+    for text_id, text in chunk:
+        if profile is not None and text_id == profile[0]:
+            text_results, stream = profiled(profile[1], _tokenize_n_analyse_text, text, tokenizer, configs, mx, loi,
+                                            engine)
+        else:
+            stream = next(streams)
+            text_results = analyse_text(text, tokenizer, configs, mx, loi, engine, stream=stream)
+        results.append((text_id, text_results, stream if keep_streams else None))
+    return results
+
+
+def _analyse_chunk(chunk, tokenizer, configs, mx, loi, engine, profile, keep_streams):
+    results = _analyse_batch(chunk, tokenizer, configs, mx, loi, engine, profile, keep_streams)
+    if keep_streams:  # type ids are only valid in this process: streams are sent back as (token, POS) tuples
+        tags = tag_set(tokenizer)
+        results = [(text_id, text_results, stream.pos_tuples(VOCABULARY, tags))
+                   for text_id, text_results, stream in results]
+    return results, METRICS.drain()
+
+
+def _merge_chunk(future, tokenizer):
+    results, timings = future.result()
+    METRICS.merge(timings)
+    return [(text_id, text_results, encode(tokenizer, pos_tuples) if pos_tuples is not None else None)
+            for text_id, text_results, pos_tuples in results]
+
+
+def _chunks(records, chunksize):
+    chunk = []
+    for text_record in records:
+        chunk.append(text_record)
+        if len(chunk) >= chunksize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def analyse_texts(records, tokenizer, configs, mx=200, loi=LOI, engine="taaled", workers=1, chunksize=16,
+                  profile=None, keep_streams=False):
+    """
+    Analyse (text id, text) records, optionally spread over a pool of worker processes.
+    Results are yielded in the same order as the input records regardless of the number of workers.
+    :param records: iterable of tuple (text id, text)
+    :param configs: list of tuple (include_function_words, parallel_analysis)
+    :param workers: int, number of worker processes. 1 analyses the texts in the current process
+    :param chunksize: int, number of texts tokenized together (and sent to a worker at once)
+    :param profile: tuple (text id, path): analyse this text under cProfile and save the stats to path
+    :param keep_streams: bool, if set True, also yield the token stream of each text (in the vocabulary of this process)
+    :return: generator of tuple (text id, results, TokenStream or None), see analyse_text()
+    """
+    if workers <= 1:
+        for chunk in _chunks(records, chunksize):
+            yield from _analyse_batch(chunk, tokenizer, configs, mx, loi, engine, profile, keep_streams)
+        return
+
+    # spawn instead of fork: a forked child cannot use a JVM started by the parent process
+    context = multiprocessing.get_context("spawn")
+    max_in_flight = 2 * workers  # bound the number of chunks waiting in memory
+    cache = get_cache()
+    cache_settings = (cache.path, cache.max_size) if cache is not None else None
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_worker, initargs=(tokenizer, cache_settings)) as pool:
+        pending = deque()
+        for chunk in _chunks(records, chunksize):
+            pending.append(pool.submit(_analyse_chunk, chunk, tokenizer, configs, mx, loi, engine, profile,
+                                       keep_streams))
+            if len(pending) >= max_in_flight:
+                yield from _merge_chunk(pending.popleft(), tokenizer)
+        while pending:
+            yield from _merge_chunk(pending.popleft(), tokenizer)
+
+
+def _records(data):
+    """
+    :param data: df with the column 'processed' (index: text id), or iterable of tuple (text id, text)
+    :return: iterator of tuple (text id, text)
+    """
+    if hasattr(data, "columns"):  # a list has an index method too
+        return zip(data.index, data['processed'])
+    return iter(data)
+
+
+def tokenize_n_make_ld_matrices(data, tokenizer, configs, output_dir, mx=200, workers=1, engine="taaled",
+                                resume=False, total=None, progress_interval=30, profile=None, output_format="tsv",
+                                store_dir=None):
+    """
+    Tokenize every text once and write one result file per configuration in a single pass
+    Rows are buffered in batches of whole texts as they are analysed, so data can be a stream of texts of any size
     :param data: df, dataframe with three columns: text id, raw text, processed (typo removed) text, where df index is text file name
+                 or iterable of tuple (text id, text), e.g. data_reader.iter_texts()
     :param tokenizer: str, possible options: (okt, komoran, mecab, kkma, hannanum, stanza)
-    :param include_function_words: bool
-                                    if set True: tokenize content + function words
-                                    if set False: tokenize only content words
-    :param parallel_analysis: bool
-                        if set True: do parallel analysis
-                        if set False: no parallel analysis
+    :param configs: list of tuple (include_function_words, parallel_analysis)
+    :param output_dir: str, output directory to store result files
     :param mx: int, minimum length of a text for parallel analysis
+    :param workers: int, number of worker processes for tokenizing and analysis (default 1: no worker process)
+    :param engine: str, lexical diversity engine, possible options: (taaled, numpy)
+    :param resume: bool, if set True, keep the rows of existing result files and only analyse the texts not in them
+                   (tsv output only)
+    :param total: int, number of texts in data for the progress ETA. If None, taken from data if it has a length
+    :param progress_interval: float, seconds between progress lines
+    :param profile: tuple (text id, path): analyse this text under cProfile and save the stats to path
+    :param output_format: str, possible options: (tsv, parquet, arrow, npz), see result_writer
+    :param store_dir: str, if given, keep the token streams in a corpus store in store_dir/tokenizer
+                      for later analyses without tagging (see corpus_store)
     :return: none
     """
 
     # filter out stanza with include_function_words=False
-    if tokenizer == 'stanza' and not include_function_words:
+    if tokenizer == 'stanza':
+        configs = [config for config in configs if config[0]]
+    if not configs:
         return
 
     logging.info("Start LD analysis . . .")
-    # indexes
-    loi = ["ntokens", "ntypes", "mtld", "mtldo", "mattr", "ttr", "rttr", "lttr", "maas", "msttr", "hdd"]
+    if workers > 1:
+        logging.info("Analysing with %s worker processes", workers)
+    loi = LOI
 
-    # set file name
-    if include_function_words:
-        file_name = output_dir + "/" + tokenizer + "_all_words.tsv"
-        if parallel_analysis:
-            file_name = output_dir + "/" + tokenizer + "_all_words_prll.tsv"
-    else:
-        file_name = output_dir + "/" + tokenizer + "_content_only.tsv"
-        if parallel_analysis:
-            file_name = output_dir + "/" + tokenizer + "_content_only_prll.tsv"
+    output_format = resolve_format(output_format)
+    writers = []
+    for include_function_words, parallel_analysis in configs:
+        file_name = result_file_name(output_dir, tokenizer, include_function_words, parallel_analysis,
+                                     WRITERS[output_format].extension)
+        metadata = {"tokenizer": tokenizer, "include_function_words": include_function_words,
+                    "parallel_analysis": parallel_analysis, "engine": engine, "mx": mx, "loi": loi}
+        writer = open_writer(output_format, file_name, columns(parallel_analysis, loi), metadata, resume=resume)
+        if writer.done:
+            logging.info("Resuming %s: %s files already analysed", file_name, len(writer.done))
+        writers.append(writer)
+    done = [writer.done for writer in writers]  # text ids already in each result file (resume)
+    store = CorpusStoreWriter(os.path.join(store_dir, tokenizer), tokenizer) if store_dir is not None else None
 
-    outf = open(file_name, "w", encoding='utf-8')
-    if parallel_analysis:
-        outf.write("filename" + '\t' + "length" + '\t' + '\t'.join(loi))
-    else:
-        outf.write("filename" + '\t' + '\t'.join(loi))
-
-    text_id = data.index
-    text_processed = data['processed']
-    skipped = 0
-    skippedl = []
-
-    for i, text in enumerate(text_processed):
-        _, pos_tuple, tokens_cleaned = tokenize(tokenizer, text)
-        if not include_function_words:
-            _, tokens_cleaned = remove_function_words(pos_tuple, tokenizer)
-        if len(tokens_cleaned) < 1:  # nothing to analysis
-            logging.info("%s has no analysable tokens. Skipping", text_id[i])
-            skipped += 1
-            skippedl.append(text_id[i])
-            continue
-        if parallel_analysis:
-            if len(tokens_cleaned) < mx:  # in case the text is too short for parallel analysis
-                skipped += 1
-                skippedl.append(text_id[i])
+    skippedls = [[] for _ in configs]
+    counts = {"texts": 0, "resumed": 0}
+    done_in_all = set.intersection(*done)
+    if total is None and hasattr(data, "__len__"):
+        total = len(data)
+    progress = Progress(total, interval=progress_interval)
+
+    def pending(records):
+        for tid, text in records:
+            if tid in done_in_all:  # nothing left to write for this text
+                counts["resumed"] += 1
+                if progress.total:
+                    progress.total -= 1
                 continue
-            ld_lists = parallel(text=tokens_cleaned, clss=True, functd=None, funct=lexdiv, loi=loi, mx=mx).ldvals
-            for length in ld_lists:  # iterate through text slices
-                outl = [text_id[i], str(length)]  # list of items to write, will add each index below
-                for index in loi:  # iterate through index list:
-                    outl.append(str(ld_lists[length][index]))  # add index to outr list (in same order as loi list)
-                outf.write("\n" + '\t'.join(outl))  # write row to file
-        else:  # no parallel analysis
-            ldout = lexdiv(tokens_cleaned).vald  # get dictionary version of lexical diversity output
-            outl = [text_id[i]]  # list of items to write, will add each index below
-            for index in loi:  # iterate through index list:
-                outl.append(str(ldout[index]))  # add index to outr list (in same order as loi list)
-            outf.write("\n" + '\t'.join(outl))  # write row to file
+            counts["texts"] += 1
+            yield tid, text
+
+    results = analyse_texts(pending(_records(data)), tokenizer, configs, mx=mx, loi=loi, engine=engine,
+                            workers=workers, profile=profile, keep_streams=store is not None)
+    for tid, text_results, stream in results:
+        if store is not None:
+            with stage("store"):
+                store.add(tid, stream)
+        if any(status == "empty" for status, _ in text_results):
+            logging.info("%s has no analysable tokens. Skipping", tid)
+        for (status, rows), writer, skippedl, done_ids in zip(text_results, writers, skippedls, done):
+            if tid in done_ids:
+                continue
+            if status is not None:
+                skippedl.append(tid)
+                continue
+            # all rows of a text go into the same batch, so an interrupted run can be resumed
+            with stage("write"):
+                writer.write(tid, rows)
+        progress.update()
+    progress.log()
+    if store is not None:
+        with stage("store"):
+            store.close()
+
+    for (include_function_words, parallel_analysis), writer, skippedl in zip(configs, writers, skippedls):
+        with stage("write"):
+            writer.close()
+
+        if len(configs) > 1:
+            config = "Tokenizer: {}, Include Function Words: {}, Parallel Analysis: {}".format(
+                tokenizer, include_function_words, parallel_analysis)
+            logging.info("\n================ %s =================", config)
+        logging.info("Analysis on %s files completed successfully", counts["texts"] - len(skippedl))
+        if counts["resumed"]:
+            logging.info("%s files were already analysed in the previous run", counts["resumed"])
+        logging.info("The result is saved as: %s", writer.path)
 
-    outf.flush()
-    outf.close()
+        if skippedl:
+            logging.info("%s files are skipped due to length problem", len(skippedl))
+            logging.info("List of skipped files: ")
+            logging.info("%s", skippedl)
 
-    logging.info("Analysis on %s files completed successfully", len(text_id) - skipped)
-    logging.info("The result is saved as: %s", file_name)
 
-    if skipped:
-        logging.info("%s files are skipped due to length problem", skipped)
-        logging.info("List of skipped files: ")
-        logging.info("%s", skippedl)
+def tokenize_n_make_ld_matrix(data, tokenizer, include_function_words, parallel_analysis, output_dir, mx=200,
+                              workers=1, engine="taaled", resume=False, total=None, progress_interval=30, profile=None,
+                              output_format="tsv", store_dir=None):
+    """
+    Tokenize and calculate all files in the df data and write output as tsv (or another output format)
+    (This code includes partial modification of TAALED package source code)
+    :param output_dir: str, output directory to store result files
+    :param data: df, dataframe with three columns: text id, raw text, processed (typo removed) text, where df index is text file name
+    :param tokenizer: str, possible options: (okt, komoran, mecab, kkma, hannanum, stanza)
+    :param include_function_words: bool
+                                    if set True: tokenize content + function words
+                                    if set False: tokenize only content words
+    :param parallel_analysis: bool
+                        if set True: do parallel analysis
+                        if set False: no parallel analysis
+    :param mx: int, minimum length of a text for parallel analysis
+    :param workers: int, number of worker processes for tokenizing and analysis (default 1: no worker process)
+    :param engine: str, lexical diversity engine, possible options: (taaled: TAALED package, numpy: vectorized engine)
+    :param resume: bool, if set True, keep the rows of an existing result file and only analyse the texts not in it
+    :param total: int, number of texts in data for the progress ETA (see tokenize_n_make_ld_matrices)
+    :param progress_interval: float, seconds between progress lines
+    :param profile: tuple (text id, path): analyse this text under cProfile and save the stats to path
+    :param output_format: str, possible options: (tsv, parquet, arrow, npz), see result_writer
+    :param store_dir: str, if given, keep the token streams in a corpus store (see tokenize_n_make_ld_matrices)
+    :return: none
+    """
+    tokenize_n_make_ld_matrices(data, tokenizer, [(include_function_words, parallel_analysis)], output_dir, mx=mx,
+                                workers=workers, engine=engine, resume=resume, total=total,
+                                progress_interval=progress_interval, profile=profile, output_format=output_format,
+                                store_dir=store_dir)
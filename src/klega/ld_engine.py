@@ -0,0 +1,298 @@
+"""
+Vectorized lexical diversity engine
+Computes the same indices as taaled.lexdiv on integer type ids with NumPy instead of walking token lists in Python
+"""
+import math
+import statistics as stat
+from collections import Counter
+
+import numpy as np
+
+ENGINES = ["taaled", "numpy"]
+# indices of the engine, in the order of taaled.lexdiv(...).vald
+INDICES = ["ntokens", "ntypes", "mtld", "mtld92", "mtldo", "mattr", "mattr11", "ttr", "rttr", "lttr", "maas", "msttr",
+           "hdd"]
+# indices that only depend on the type frequencies, not on the order of the tokens (see count_indices())
+COUNT_INDICES = ["ntokens", "ntypes", "ttr", "rttr", "lttr", "maas", "hdd"]
+
+
+def _safe_divide(numerator, denominator):
+    if denominator == 0 or denominator == 0.0:
+        return 0
+    return numerator / denominator
+
+
+def to_type_ids(tokens):
+    """
+    Map tokens to integer type ids (in order of first occurrence)
+    :param tokens: list of str
+    :return: np.ndarray of int32
+    """
+    vocab = {}
+    return np.fromiter((vocab.setdefault(token, len(vocab)) for token in tokens), dtype=np.int32, count=len(tokens))
+
+
+def _previous_occurrence(ids):
+    """
+    :return: np.ndarray, for each position the position of the previous occurrence of the same type (-1 if none)
+    """
+    order = np.argsort(ids, kind='stable')
+    sorted_ids = ids[order]
+    prev = np.full(len(ids), -1, dtype=np.int64)
+    same = sorted_ids[1:] == sorted_ids[:-1]
+    prev[order[1:][same]] = order[:-1][same]
+    return prev
+
+
+def _window_type_counts(ids, prev, window_length):
+    """
+    Number of types in every moving window, computed with rolling counts:
+    a token adds one type to the windows that contain it but not the previous occurrence of its type
+    :return: np.ndarray of type counts, one per window start
+    """
+    n = len(ids)
+    nwindows = n - window_length + 1
+    positions = np.arange(n)
+    first = np.maximum(prev + 1, positions - window_length + 1)
+    last = np.minimum(positions, nwindows - 1)
+    valid = first <= last
+    diff = np.zeros(nwindows + 1, dtype=np.int64)
+    np.add.at(diff, first[valid], 1)
+    np.add.at(diff, last[valid] + 1, -1)
+    return np.cumsum(diff[:-1])
+
+
+def _mattr(window_counts, start, length, ntypes, window_length):
+    """
+    MATTR of the slice [start, start + length) from the type counts of all windows of the full text
+    """
+    if length < (window_length + 1):
+        return _safe_divide(ntypes, length)
+    counts = window_counts[start:start + length - window_length + 1]
+    return stat.mean((counts / float(window_length)).tolist())  # the exact mean of the window TTRs, as taaled
+
+
+def _msttr(window_counts, start, length, ntypes, window_length):
+    """
+    MSTTR of the slice [start, start + length): segment type counts are the window counts at the segment starts
+    """
+    if length < (window_length + 1):
+        return _safe_divide(ntypes, length)
+    n_segments = length // window_length
+    sum_ttr = 0
+    for types in window_counts[start:start + n_segments * window_length:window_length].tolist():
+        sum_ttr += types / window_length  # same summation order as taaled
+    return _safe_divide(sum_ttr, n_segments)
+
+
+def _hdd_probability(frequency, ntokens, samples):
+    """
+    :return: float, probability that a type with the given frequency occurs in a random sample, divided by the
+             sample size, with the exact binomials of taaled: 1 - C(N - f, n) / C(N, n)
+    """
+    try:
+        prob_0 = float(math.comb(ntokens - frequency, samples)) / float(math.comb(ntokens, samples))
+    except OverflowError:  # binomials beyond the float range (corpora of millions of tokens): exact quotient
+        prob_0 = math.comb(ntokens - frequency, samples) / math.comb(ntokens, samples)
+    return (1.0 - prob_0) * (1 / samples)
+
+
+def hdd(frequencies, ntokens, samples=42):
+    """
+    HD-D: sum over types of the probability that the type occurs in a random sample of the given size
+    The probability is computed once per distinct frequency and summed type by type in the order of frequencies:
+    taaled sums in the order of set(tokens), which gives the same value when frequencies are in that order
+    :param frequencies: list of int, number of tokens of every type
+    """
+    if ntokens < samples:  # taaled returns 0 when the population is smaller than the sample
+        return 0.0
+    probabilities = {frequency: _hdd_probability(frequency, ntokens, samples) for frequency in set(frequencies)}
+    prob_sum = 0.0
+    for frequency in frequencies:
+        prob_sum += probabilities[frequency]
+    return prob_sum
+
+
+def _set_order_frequencies(tokens):
+    """
+    :param tokens: list of tokens (or of type ids)
+    :return: np.ndarray, number of tokens of every type in the order of set(tokens), the order taaled sums HD-D in
+    """
+    frequency = Counter(tokens)
+    return np.array([frequency[token] for token in set(tokens)], dtype=np.int64)
+
+
+def count_indices(frequencies, samples=42):
+    """
+    Indices of a text computed from its type frequencies only, e.g. of pooled texts from a document x type matrix
+    :param frequencies: np.ndarray, number of tokens of every type (types with no token are ignored),
+                        in the order HD-D is summed in (see hdd())
+    :return: dict, {index: value} of the indices in COUNT_INDICES
+    """
+    frequencies = frequencies[frequencies > 0]
+    ntokens = int(frequencies.sum())
+    ntypes = len(frequencies)
+    return {"ntokens": ntokens,
+            "ntypes": ntypes,
+            "ttr": _safe_divide(ntypes, ntokens),
+            "rttr": _safe_divide(ntypes, math.sqrt(ntokens)),
+            "lttr": _safe_divide(math.log10(ntypes), math.log10(ntokens)),
+            "maas": _safe_divide((math.log10(ntokens) - math.log10(ntypes)), math.pow(math.log10(ntokens), 2)),
+            "hdd": hdd(frequencies.tolist(), ntokens, samples)}
+
+
+def _mtld_factors(ids, mn, ttrval):
+    """
+    Forward pass of MTLD factor counting with a running type count
+    :return: tuple (factor lengths, factor proportions)
+    """
+    fl = []
+    fp = []
+    seen = set()
+    length = 0
+    last = len(ids) - 1
+    for x, type_id in enumerate(ids):
+        seen.add(type_id)
+        length += 1
+        ttr = len(seen) / length
+        if x == last:  # partial factor
+            fp.append(_safe_divide((1 - ttr), (1 - ttrval)))
+            fl.append(length)
+        elif ttr < ttrval and length >= mn:
+            fl.append(length)
+            fp.append(1)
+            seen = set()
+            length = 0
+    return fl, fp
+
+
+def _mtld_mfl(windowl, factorprop):
+    factorls = [_safe_divide(wl, fp) for wl, fp in zip(windowl, factorprop) if fp != 0]
+    return sum(factorls) / len(factorls)
+
+
+def mtld(ids, mn=10, ttrval=.720):
+    """
+    :return: tuple (mtld, mtldo) where mtld is the mean length of forward and backward factors
+             and mtldo is the original McCarthy and Jarvis calculation
+    """
+    ids = ids.tolist()
+    fwfl, fwfp = _mtld_factors(ids, mn, ttrval)
+    bwfl, bwfp = _mtld_factors(ids[::-1], mn, ttrval)
+
+    valo = stat.mean([_safe_divide(sum(fwfl), sum(fwfp)), _safe_divide(sum(bwfl), sum(bwfp))])
+    try:
+        valmfl2 = _mtld_mfl(fwfl + bwfl, fwfp + bwfp)
+    except ZeroDivisionError:
+        valmfl2 = 0
+    return valmfl2, valo
+
+
+def _vald(ids, window_counts, start, length, window_length=50, mn=10, ttrval=.720, samples=42, tokens=None):
+    """
+    All indices of the slice [start, start + length) of a text
+    :param ids: np.ndarray, type ids of the full text
+    :param window_counts: dict, {window length: type counts of every window of the full text}
+    :param tokens: list of tokens of the full text, for the summation order of HD-D. None: the type ids stand for
+                   the tokens
+    :return: dict, same keys as taaled.lexdiv(...).vald
+    """
+    chunk = ids[start:start + length]
+    chunk_tokens = chunk.tolist() if tokens is None else tokens[start:start + length]
+    counts = count_indices(_set_order_frequencies(chunk_tokens), samples)
+    ntypes = counts["ntypes"]
+
+    vald = {"ntokens": counts["ntokens"], "ntypes": ntypes}  # same key order as taaled
+    mtld72, mtldo = mtld(chunk, mn, ttrval)
+    vald["mtld"] = mtld72
+    vald["mtld92"], _ = mtld(chunk, mn, .92)
+    vald["mtldo"] = mtldo
+    vald["mattr"] = _mattr(window_counts.get(window_length), start, length, ntypes, window_length)
+    vald["mattr11"] = _mattr(window_counts.get(11), start, length, ntypes, 11)
+    for index in ["ttr", "rttr", "lttr", "maas"]:
+        vald[index] = counts[index]
+    vald["msttr"] = _msttr(window_counts.get(window_length), start, length, ntypes, window_length)
+    vald["hdd"] = counts["hdd"]
+    return vald
+
+
+def _sweep(ids, window_lengths):
+    """
+    Single pass over a text: previous occurrence positions and rolling window type counts
+    :return: tuple (prev, window_counts)
+    """
+    prev = _previous_occurrence(ids)
+    window_counts = {window_length: _window_type_counts(ids, prev, window_length)
+                     for window_length in window_lengths if len(ids) >= window_length}
+    return prev, window_counts
+
+
+class FastLexdiv:
+    """
+    Drop-in replacement of taaled.lexdiv: FastLexdiv(tokens).vald holds the same indices
+    """
+
+    def __init__(self, text=None, window_length=50, mn=10, ttrval=.720, samples=42, ids=None):
+        """
+        :param text: list of tokens (or a whitespace separated str, as in taaled)
+        :param ids: np.ndarray of type ids of the tokens. If given, text is not needed, and the ids stand for the tokens
+                    in the summation order of HD-D (the last digits of hdd may differ from taaled on the tokens)
+        """
+        if text is not None and type(text) != list:
+            text = text.split(" ")
+        if ids is None:
+            if text is None:
+                return
+            ids = to_type_ids(text)
+
+        _, window_counts = _sweep(ids, (window_length, 11))
+        self.vald = _vald(ids, window_counts, 0, len(ids), window_length, mn, ttrval, samples, tokens=text)
+        for key, value in self.vald.items():
+            setattr(self, key, value)
+
+
+def parallel_ld(tokens, loi, mn=50, mx=200, interval=5, window_length=50, ids=None):
+    """
+    Incremental version of taaled.parallel(text, funct=lexdiv, clss=True, loi=loi).ldvals
+    The first mx tokens are cut into consecutive samples of every length from mn to mx (by interval),
+    and the indices of each length are averaged over its samples.
+    Instead of analysing every sample from scratch, the first mx tokens are swept once and the
+    index values of each sample are read off the shared type counts.
+    :param tokens: list of tokens, at least mx long
+    :param loi: list of indexes to calculate
+    :param ids: np.ndarray of type ids of the tokens (e.g. token_stream.TokenStream.dense_ids()). If given,
+                tokens is not needed. Any small non-negative ids work: the indices only depend on which tokens are
+                equal, except for the summation order of HD-D (see FastLexdiv)
+    :return: dict, {length: {index: value}}, the same values as taaled when tokens are given
+    """
+    if tokens is not None:
+        tokens = tokens[:mx]
+    ids = to_type_ids(tokens) if ids is None else ids[:mx]
+    _, window_counts = _sweep(ids, (window_length, 11))
+
+    ldvals = {}
+    length = mn
+    for _ in range(int((mx - mn) / interval) + 1):
+        n_samples = int(mx / length)
+        valds = [_vald(ids, window_counts, y * length, length, window_length, tokens=tokens)
+                 for y in range(n_samples)]
+        if n_samples == 1:
+            ldvals[length] = {index: valds[0][index] for index in loi}
+        else:
+            ldvals[length] = {index: stat.mean([vald[index] for vald in valds]) for index in loi}
+        length += interval
+    return ldvals
+
+
+def get_lexdiv(engine="taaled"):
+    """
+    :param engine: str, possible options: (taaled, numpy)
+    :return: lexdiv class of the engine, used as lexdiv(tokens).vald
+    """
+    if engine == "taaled":
+        from taaled import lexdiv
+        return lexdiv
+    elif engine == "numpy":
+        return FastLexdiv
+    else:
+        raise ValueError("engine must be one of these options: (taaled, numpy)")
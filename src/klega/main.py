@@ -1,11 +1,18 @@
 from data_processor import typodelete
-from data_reader import read_texts_into_lists
+from spellcheck import get_spellchecker, BACKENDS
+from data_reader import read_texts_into_lists, iter_texts, count_texts
 import argparse
 import logging
-from ld_analyser import tokenize_n_make_ld_matrix
+from ld_analyser import tokenize_n_make_ld_matrix, tokenize_n_make_ld_matrices
+from korean_tokenizer import warm_up, tear_down, tagger_stats, set_cache, set_observer
+from metrics import METRICS, stage, record, set_export, export
+from result_writer import FORMATS
+from scheduler import run_jobs, parse_limits
+from shard import parse_shard, shard_dir, run_config, write_manifest, find_manifests, merge_shards, merge_logs
+import functools
+from token_cache import TokenCache, DEFAULT_CACHE_PATH, DEFAULT_CACHE_SIZE
+import json
 import warnings
-import numpy as np
-import pandas as pd
 import sys
 import os
 
@@ -18,9 +25,33 @@ logging.getLogger("stanza").setLevel(logging.WARNING)
 logging.getLogger("stanza.pipeline").setLevel(logging.WARNING)
 
 if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == "merge":
+        # merge the output directories of sharded runs (see --shard)
+        merge_parser = argparse.ArgumentParser(prog="main.py merge",
+                                               description="Merge the outputs of sharded runs (--shard K/N) into the output of a single run")
+        merge_parser.add_argument("shards", nargs='+',
+                                  help="Output directories of the shards, or directories containing them (e.g. the -o of the shard runs)")
+        merge_parser.add_argument("-o", "--outputdir", default='result', help="path to store the merged output files")
+        merge_args = merge_parser.parse_args(sys.argv[2:])
+        if not os.path.exists(merge_args.outputdir):
+            os.makedirs(merge_args.outputdir)
+        a_logger = logging.getLogger()
+        a_logger.setLevel(logging.DEBUG)
+        log_file = merge_args.outputdir + '/' + "log_" + current_time_as_str() + ".log"
+        a_logger.addHandler(logging.FileHandler(log_file))
+        try:
+            report = merge_shards(merge_args.shards, merge_args.outputdir)
+        except ValueError as e:
+            logging.error("Merge failed: %s", e)
+            sys.exit(1)
+        logging.info("FINISHED")
+        merge_logs(find_manifests(merge_args.shards), log_file)
+        # exit code 1 if the merged output is not the output of a complete single run
+        sys.exit(1 if report["missing_texts"] or report["duplicated_texts"] or report["problems"] else 0)
+
     # parse args
     parser = argparse.ArgumentParser()
-    parser.add_argument("-i", "--inputdir", required=True,
+    parser.add_argument("-i", "--inputdir",
                         help="Path to the directory which includes plain text files to be analysed")
     parser.add_argument("-t", "--tokenizer", nargs='+', default=["okt"],
                         help="Tokenizers: (okt, komoran, mecab, kkma, hannanum, stanza). You can give multiple tokenizers ex) -t kkma komoran")
@@ -33,9 +64,78 @@ if __name__ == '__main__':
                                 Note that functionwords=false in not provided in stanza. """)
     parser.add_argument("-p", "--parallel", action='store_true', help="do parallel analysis.")
     parser.add_argument("-o", "--outputdir", default='result', help="path to store output files (log, tsv files with ld values")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="Number of worker processes for tokenizing and LD analysis (default: 1, no worker process)")
     parser.add_argument("-no-typo-removal", "--notyporemoval", action='store_true', help="Note: Windows OS with Microsoft Office is required for this function.")
+    parser.add_argument("--typo-backend", choices=BACKENDS, default="msword",
+                        help="Spellchecker of the typo removal: msword (Microsoft Word, Windows only) or symspell (offline, needs --wordlist)")
+    parser.add_argument("--wordlist", help="Word list of the symspell typo backend, one word per line")
+    parser.add_argument("--read-threads", type=int, default=1,
+                        help="Number of threads reading input files concurrently, useful on network filesystems (default: 1)")
+    parser.add_argument("--stream", action='store_true',
+                        help="Read and analyse the texts one at a time instead of loading the whole corpus into memory. Requires -no-typo-removal")
+    parser.add_argument("--resume", action='store_true',
+                        help="Keep the rows of existing result files in the output directory and only analyse the texts not in them")
+    parser.add_argument("--ld-engine", choices=["taaled", "numpy"], default="taaled",
+                        help="Engine for lexical diversity indices: taaled (TAALED package) or numpy (vectorized, same values as taaled)")
+    parser.add_argument("--cache", nargs='?', const=DEFAULT_CACHE_PATH, default=None,
+                        help="Cache tokenization results in a file and reuse them in later runs (default file: {})".format(DEFAULT_CACHE_PATH))
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE,
+                        help="Size cap of the tokenization cache in MB. Least recently used entries are evicted (default: {})".format(DEFAULT_CACHE_SIZE))
+    parser.add_argument("--clear-cache", action='store_true', help="Delete all entries in the tokenization cache")
+    parser.add_argument("--cache-info", action='store_true', help="Print a summary of the tokenization cache")
+    parser.add_argument("--progress-interval", type=float, default=30,
+                        help="Seconds between progress lines (with throughput and ETA) in the log (default: 30)")
+    parser.add_argument("--profile-text",
+                        help="File name of a text to analyse under cProfile. The stats are saved in the output directory")
+    parser.add_argument("--concurrent", action='store_true',
+                        help="Run the tokenizers concurrently instead of one after another (see --limit)")
+    parser.add_argument("--limit", nargs='+', metavar="RESOURCE=N",
+                        help="Maximum number of concurrent tokenizers per resource with --concurrent: jvm (okt, komoran, kkma, hannanum, default 4), mecab (default 1), stanza (default 1)")
+    parser.add_argument("--output-format", choices=FORMATS, default="tsv",
+                        help="Format of the result files: tsv (default), parquet or arrow (require pyarrow) or npz")
+    parser.add_argument("--store", nargs='?', const="", default=None, metavar="DIR",
+                        help="Keep the tagged tokens in a corpus store (one per tokenizer) for later analyses without tagging again (default directory: OUTPUTDIR/store)")
+    parser.add_argument("--shard", metavar="K/N",
+                        help="Only analyse the K-th of N shards of the corpus (files are split by name), in OUTPUTDIR/shard_K_of_N. Merge the shards with: main.py merge OUTPUTDIR")
     args = parser.parse_args()
 
+    # cache maintenance (can be run without input)
+    if args.clear_cache or args.cache_info:
+        cache = TokenCache(args.cache or DEFAULT_CACHE_PATH, args.cache_size)
+        if args.clear_cache:
+            cache.clear()
+            print("Tokenization cache cleared:", cache.path)
+        if args.cache_info:
+            print(json.dumps(cache.info(), indent=2, ensure_ascii=False))
+        cache.close()
+        if args.inputdir is None:
+            sys.exit(0)
+    if args.inputdir is None:
+        parser.error("the following arguments are required: -i/--inputdir")
+    if args.stream and not args.notyporemoval:
+        parser.error("--stream requires -no-typo-removal: typo removal needs the whole corpus at once")
+    if args.typo_backend == "symspell" and not args.notyporemoval and args.wordlist is None:
+        parser.error("--typo-backend symspell requires --wordlist")
+    try:
+        limits = parse_limits(args.limit)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.resume and args.output_format != "tsv":
+        parser.error("--resume is only supported with --output-format tsv")
+    shard = None
+    if args.shard:
+        try:
+            shard = parse_shard(args.shard)
+        except ValueError as e:
+            parser.error(str(e))
+        args.outputdir = shard_dir(args.outputdir, shard)
+    if args.store is not None and args.resume:
+        parser.error("--store cannot be combined with --resume: the store would miss the texts of the previous run")
+    store_dir = None
+    if args.store is not None:
+        store_dir = args.store or os.path.join(args.outputdir, "store")
+
 
     # if output dir does not exist, make a new directory
     if not os.path.exists(args.outputdir):
@@ -45,10 +145,19 @@ if __name__ == '__main__':
     # set logger
     a_logger = logging.getLogger()
     a_logger.setLevel(logging.DEBUG)
-    log_file = args.outputdir + '/' + "log_" + current_time_as_str() + ".log"
+    run_time = current_time_as_str()
+    log_file = args.outputdir + '/' + "log_" + run_time + ".log"
     output_file_handler = logging.FileHandler(log_file)
     a_logger.addHandler(output_file_handler)
 
+    # stage timings: progress lines refresh the metrics files next to the log
+    metrics_file = args.outputdir + '/' + "metrics_" + run_time
+    set_export(metrics_file + ".json", metrics_file + ".prom")
+    set_observer(record)
+    profile = None
+    if args.profile_text:
+        profile = (args.profile_text, args.outputdir + '/' + "profile_" + args.profile_text + ".prof")
+
     if "stanza" in args.tokenizer and not args.functionwords: # if the user wants to exclude functionwords in stanza
         if not args.all:
             raise ValueError("Stanza does not provide functionwords=False. Please give functionwords argument for stanza tokenizer by adding -f to the command")
@@ -62,38 +171,116 @@ if __name__ == '__main__':
     else:
         logging.info("Include Function Words = %s", args.functionwords)
         logging.info("Parallel Analysis = %s", args.parallel)
+    if args.workers > 1:
+        logging.info("Worker processes = %s", args.workers)
     if args.notyporemoval:
         logging.info("Typo removal function is off: No typos will be removed.")
+    else:
+        logging.info("Typo removal backend = %s", args.typo_backend)
+    logging.info("LD engine = %s", args.ld_engine)
+    logging.info("Output format = %s", args.output_format)
+    if args.concurrent:
+        logging.info("Concurrent tokenizers, limits per resource = %s", limits)
+    if args.stream:
+        logging.info("Streaming mode: texts are read and analysed one at a time")
+    if args.resume:
+        logging.info("Resuming: texts already in the result files are not analysed again")
+    if args.cache:
+        logging.info("Tokenization cache = %s", args.cache)
+    if store_dir:
+        logging.info("Corpus store = %s", store_dir)
+    if shard:
+        logging.info("Shard %s of %s: %s of %s files", shard[0], shard[1], count_texts(args.inputdir, shard),
+                     count_texts(args.inputdir))
     logging.info("----------------------------------")
 
     # read and process text
 
-    if args.notyporemoval:
-        txt_id, text_list = read_texts_into_lists(args.inputdir, remove_num=False)
+    if args.stream:  # texts are read lazily for each tokenizer in the analysis loop below
+        data_df = None
+    elif args.notyporemoval:
+        txt_id, text_list = read_texts_into_lists(args.inputdir, remove_num=False, threads=args.read_threads,
+                                                  shard=shard)
+        import pandas as pd
         data_df = pd.DataFrame(index=txt_id, columns=['processed'])
         data_df['processed'] = text_list
     else:
-        txt_id, text_list = read_texts_into_lists(args.inputdir)
-        data_df = typodelete(txt_id, text_list, args.outputdir)
+        txt_id, text_list = read_texts_into_lists(args.inputdir, threads=args.read_threads, shard=shard)
+        with stage("typodelete"):
+            data_df = typodelete(txt_id, text_list, args.outputdir,
+                                 backend=get_spellchecker(args.typo_backend, args.wordlist), workers=args.workers)
+
+    token_cache = None
+    if args.cache:
+        token_cache = TokenCache(args.cache, args.cache_size)
+        set_cache(token_cache)
 
     # tokenize and analyse
-    if args.all:
+    if args.concurrent:
+        if args.all:
+            configs = [(f, p) for f in [True, False] for p in [True, False]]
+        else:
+            configs = [(args.functionwords, args.parallel)]
+        # streamed texts are read again by every job
+        data = functools.partial(iter_texts, args.inputdir, remove_num=False, threads=args.read_threads,
+                                 shard=shard) if args.stream else data_df
+        run_jobs([(tokenizer, configs) for tokenizer in args.tokenizer], data, args.outputdir, limits=limits,
+                 log_file=log_file, workers=args.workers, engine=args.ld_engine, resume=args.resume,
+                 total=count_texts(args.inputdir, shard) if args.stream else None,
+                 progress_interval=args.progress_interval, profile=profile, output_format=args.output_format,
+                 store_dir=store_dir)
+
+    elif args.all:
         f_options = [True, False]
         p_options = [True, False]
+        configs = [(f, p) for f in f_options for p in p_options]
         for tokenizer in args.tokenizer:
-            for f in f_options:
-                for p in p_options:
-                    config = "Tokenizer: {}, Include Function Words: {}, Parallel Analysis: {}".format(tokenizer, f, p)
-                    logging.info("\n\n\n================ %s =================", config)
-                    tokenize_n_make_ld_matrix(data=data_df, tokenizer=tokenizer,
-                                              include_function_words=f,
-                                              parallel_analysis=p, output_dir=args.outputdir)
+            logging.info("\n\n\n================ tokenizer %s (all configurations) =================", tokenizer)
+            # workers warm up their own tagger, and with a cache the tagger is only built on a cache miss
+            if args.workers <= 1 and token_cache is None:
+                warm_up([tokenizer])
+            # each text is tokenized once and analysed for every configuration
+            data = iter_texts(args.inputdir, remove_num=False, threads=args.read_threads, shard=shard) \
+                if args.stream else data_df
+            tokenize_n_make_ld_matrices(data=data, tokenizer=tokenizer, configs=configs,
+                                        output_dir=args.outputdir, workers=args.workers,
+                                        engine=args.ld_engine, resume=args.resume,
+                                        total=count_texts(args.inputdir, shard) if args.stream else None,
+                                        progress_interval=args.progress_interval, profile=profile,
+                                        output_format=args.output_format, store_dir=store_dir)
+            tear_down([tokenizer])
 
 
     else:
         for tokenizer in args.tokenizer:
             logging.info("\n\n\n================ tokenizer %s =================", tokenizer)
-            tokenize_n_make_ld_matrix(data=data_df, tokenizer=tokenizer,
-                                      include_function_words=args.functionwords, parallel_analysis=args.parallel, output_dir=args.outputdir)
+            # workers warm up their own tagger, and with a cache the tagger is only built on a cache miss
+            if args.workers <= 1 and token_cache is None:
+                warm_up([tokenizer])
+            data = iter_texts(args.inputdir, remove_num=False, threads=args.read_threads, shard=shard) \
+                if args.stream else data_df
+            tokenize_n_make_ld_matrix(data=data, tokenizer=tokenizer,
+                                      include_function_words=args.functionwords, parallel_analysis=args.parallel, output_dir=args.outputdir,
+                                      workers=args.workers, engine=args.ld_engine, resume=args.resume,
+                                      total=count_texts(args.inputdir, shard) if args.stream else None,
+                                      progress_interval=args.progress_interval, profile=profile,
+                                      output_format=args.output_format, store_dir=store_dir)
+            tear_down([tokenizer])
+
+    for tokenizer, stats in tagger_stats().items():
+        logging.info("Tagger %s: built %s time(s) in %.2fs, tagged %s texts in %.2fs", tokenizer,
+                     stats["constructions"], stats["construction_time"], stats["calls"], stats["tagging_time"])
+
+    if token_cache is not None:
+        cache_info = token_cache.info()
+        logging.info("Tokenization cache: %s hits, %s misses in this process, %s entries (%s MB)",
+                     cache_info["hits"], cache_info["misses"], cache_info["entries"], cache_info["size_mb"])
+        token_cache.close()
 
+    METRICS.log_summary()
+    export()
+    logging.info("Stage metrics are saved as: %s.json, %s.prom", metrics_file, metrics_file)
+    if shard:
+        manifest = write_manifest(args.outputdir, args.inputdir, shard, run_config(args), log_file)
+        logging.info("Shard manifest is saved as: %s", manifest)
     logging.info("FINISHED")
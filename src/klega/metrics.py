@@ -0,0 +1,282 @@
+"""
+Per-stage instrumentation for batch runs
+Stages (read, typodelete, tokenize, tagging, remove_function_words, lexdiv, parallel, write) are timed into a
+process-wide registry, reported as progress lines during the run and exported as a JSON summary and a
+Prometheus textfile at the end.
+"""
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+SAMPLE_SIZE = 10000  # latencies kept per stage for percentiles (reservoir sample)
+QUANTILES = (0.5, 0.9, 0.95, 0.99)
+
+
+class _Stage:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.tokens = 0
+        self.samples = []
+        self._rng = random.Random(0)
+
+    def add(self, seconds, tokens=0, count=1):
+        self.count += count
+        self.total += seconds
+        self.tokens += tokens
+
+    def sample(self, seconds, seen):
+        # reservoir sampling: every latency has the same chance to be kept, whatever the number of calls
+        if len(self.samples) < SAMPLE_SIZE:
+            self.samples.append(seconds)
+        else:
+            slot = self._rng.randrange(seen)
+            if slot < SAMPLE_SIZE:
+                self.samples[slot] = seconds
+
+    def quantile(self, q):
+        if not self.samples:
+            return None
+        values = sorted(self.samples)
+        return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+class Metrics:
+    """
+    Thread-safe registry of stage timings: call counts, cumulative time, processed tokens and latency percentiles
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+        self.texts = 0
+        self.started = time.time()
+
+    def record(self, stage, seconds, tokens=0):
+        """
+        :param stage: str, name of the stage
+        :param seconds: float, duration of one call
+        :param tokens: int, number of tokens processed in the call (0 if not applicable)
+        """
+        with self._lock:
+            entry = self._stages.get(stage)
+            if entry is None:
+                entry = self._stages[stage] = _Stage()
+            entry.add(seconds, tokens)
+            entry.sample(seconds, entry.count)
+
+    @contextmanager
+    def stage(self, stage, tokens=0):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start, tokens)
+
+    def add_texts(self, n=1):
+        with self._lock:
+            self.texts += n
+
+    def stage_tokens(self, stage):
+        with self._lock:
+            entry = self._stages.get(stage)
+            return entry.tokens if entry is not None else 0
+
+    def drain(self):
+        """
+        Take the timings recorded so far and reset them, e.g. to send them from a worker process to the parent
+        :return: dict, {stage: (count, total, tokens, samples)}
+        """
+        with self._lock:
+            snapshot = {name: (entry.count, entry.total, entry.tokens, entry.samples)
+                        for name, entry in self._stages.items()}
+            self._stages = {}
+        return snapshot
+
+    def merge(self, snapshot):
+        """
+        Add timings drained from another process. Percentiles are approximate: the other process's samples
+        are fed into this reservoir as if they were single calls
+        """
+        with self._lock:
+            for name, (count, total, tokens, samples) in snapshot.items():
+                entry = self._stages.get(name)
+                if entry is None:
+                    entry = self._stages[name] = _Stage()
+                seen = entry.count
+                entry.add(total, tokens, count)
+                for i, seconds in enumerate(samples):
+                    entry.sample(seconds, seen + (i + 1) * count // max(len(samples), 1))
+
+    def summary(self):
+        """
+        :return: dict, run totals and per-stage statistics (durations in seconds)
+        """
+        elapsed = max(time.time() - self.started, 1e-9)
+        with self._lock:
+            stages = {}
+            for name, entry in self._stages.items():
+                stages[name] = {"count": entry.count,
+                                "total_s": entry.total,
+                                "mean_s": entry.total / entry.count if entry.count else None,
+                                "tokens": entry.tokens,
+                                "tokens_per_s": entry.tokens / entry.total if entry.tokens and entry.total else None}
+                for q in QUANTILES:
+                    stages[name]["p{}_s".format(int(q * 100))] = entry.quantile(q)
+            tokens = self._stages["tokenize"].tokens if "tokenize" in self._stages else 0
+        return {"elapsed_s": elapsed,
+                "texts": self.texts,
+                "tokens": tokens,
+                "texts_per_s": self.texts / elapsed,
+                "tokens_per_s": tokens / elapsed,
+                "stages": stages}
+
+    def log_summary(self):
+        summary = self.summary()
+        logging.info("Run time %.1fs: %s texts (%.2f texts/s), %s tokens (%.0f tokens/s)", summary["elapsed_s"],
+                     summary["texts"], summary["texts_per_s"], summary["tokens"], summary["tokens_per_s"])
+        logging.info("%-22s %9s %10s %10s %10s %10s %12s", "stage", "count", "total(s)", "p50(ms)", "p95(ms)",
+                     "p99(ms)", "tokens/s")
+        for name, stage in sorted(summary["stages"].items(), key=lambda item: -item[1]["total_s"]):
+            logging.info("%-22s %9s %10.2f %10s %10s %10s %12s", name, stage["count"], stage["total_s"],
+                         *[_ms(stage[key]) for key in ("p50_s", "p95_s", "p99_s")],
+                         "-" if stage["tokens_per_s"] is None else "{:.0f}".format(stage["tokens_per_s"]))
+
+    def write_json(self, path):
+        _write_atomic(path, json.dumps(self.summary(), indent=2))
+
+    def write_prometheus(self, path):
+        """
+        Write the metrics in the Prometheus text format, e.g. for the node exporter textfile collector
+        """
+        summary = self.summary()
+        lines = ["# HELP klega_texts_total Texts analysed", "# TYPE klega_texts_total counter",
+                 "klega_texts_total {}".format(summary["texts"]),
+                 "# HELP klega_tokens_total Tokens produced by the tokenizer", "# TYPE klega_tokens_total counter",
+                 "klega_tokens_total {}".format(summary["tokens"]),
+                 "# HELP klega_elapsed_seconds Run time so far", "# TYPE klega_elapsed_seconds gauge",
+                 "klega_elapsed_seconds {:.3f}".format(summary["elapsed_s"]),
+                 "# HELP klega_stage_latency_seconds Latency of one call of a stage",
+                 "# TYPE klega_stage_latency_seconds summary"]
+        for name, stage in summary["stages"].items():
+            for q in QUANTILES:
+                value = stage["p{}_s".format(int(q * 100))]
+                if value is not None:
+                    lines.append('klega_stage_latency_seconds{{stage="{}",quantile="{}"}} {:.6g}'.format(name, q, value))
+            lines.append('klega_stage_latency_seconds_sum{{stage="{}"}} {:.6f}'.format(name, stage["total_s"]))
+            lines.append('klega_stage_latency_seconds_count{{stage="{}"}} {}'.format(name, stage["count"]))
+        lines += ["# HELP klega_stage_tokens_total Tokens processed by a stage", "# TYPE klega_stage_tokens_total counter"]
+        lines += ['klega_stage_tokens_total{{stage="{}"}} {}'.format(name, stage["tokens"])
+                  for name, stage in summary["stages"].items() if stage["tokens"]]
+        _write_atomic(path, "\n".join(lines) + "\n")
+
+
+def _ms(seconds):
+    return "-" if seconds is None else "{:.2f}".format(seconds * 1000)
+
+
+def _write_atomic(path, content):
+    # readers (e.g. the textfile collector) never see a half-written file
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+METRICS = Metrics()  # registry of the current process
+_export_paths = None
+
+
+def stage(name, tokens=0):
+    """
+    Time a block as a stage of the current process: with stage("write"): ...
+    """
+    return METRICS.stage(name, tokens)
+
+
+def record(name, seconds, tokens=0):
+    METRICS.record(name, seconds, tokens)
+
+
+def set_export(json_path, prometheus_path):
+    """
+    Files refreshed with every progress line and at export()
+    """
+    global _export_paths
+    _export_paths = (json_path, prometheus_path)
+
+
+def export():
+    if _export_paths is None:
+        return
+    json_path, prometheus_path = _export_paths
+    METRICS.write_json(json_path)
+    METRICS.write_prometheus(prometheus_path)
+
+
+def _format_duration(seconds):
+    seconds = int(seconds)
+    return "{}:{:02d}:{:02d}".format(seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+
+class Progress:
+    """
+    Periodic progress lines with throughput and ETA
+    """
+
+    def __init__(self, total=None, interval=30.0, label="texts"):
+        """
+        :param total: int, number of texts to process, or None if unknown (no ETA)
+        :param interval: float, seconds between progress lines
+        """
+        self.total = total
+        self.interval = interval
+        self.label = label
+        self.done = 0
+        self.started = time.perf_counter()
+        self._last = self.started
+        self._tokens_start = METRICS.stage_tokens("tokenize")
+
+    def update(self, n=1):
+        self.done += n
+        METRICS.add_texts(n)
+        now = time.perf_counter()
+        if now - self._last >= self.interval:
+            self._last = now
+            self.log()
+
+    def log(self):
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        rate = self.done / elapsed
+        tokens_rate = (METRICS.stage_tokens("tokenize") - self._tokens_start) / elapsed
+        if self.total:
+            eta = (self.total - self.done) / rate if rate else float("inf")
+            logging.info("Progress: %s/%s %s (%.1f%%), %.2f %s/s, %.0f tokens/s, elapsed %s, ETA %s", self.done,
+                         self.total, self.label, 100 * self.done / self.total, rate, self.label, tokens_rate,
+                         _format_duration(elapsed), "-" if eta == float("inf") else _format_duration(eta))
+        else:
+            logging.info("Progress: %s %s, %.2f %s/s, %.0f tokens/s, elapsed %s", self.done, self.label, rate,
+                         self.label, tokens_rate, _format_duration(elapsed))
+        export()
+
+
+def profiled(path, function, *args, **kwargs):
+    """
+    Run a function under cProfile, save the stats to path (readable with pstats or snakeviz)
+    and log the most expensive calls
+    :return: the return value of the function
+    """
+    profiler = cProfile.Profile()
+    result = profiler.runcall(function, *args, **kwargs)
+    profiler.dump_stats(path)
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(20)
+    logging.info("Profile saved as: %s\n%s", path, stream.getvalue())
+    return result
@@ -0,0 +1,328 @@
+"""
+Result writers
+Rows of lexical diversity indices are buffered and written in batches, either as tsv (default, same format as before)
+or in a columnar format: Parquet or Arrow IPC when pyarrow is installed, NumPy npz otherwise.
+Columnar results keep typed columns (float64 indices, int64 text lengths) and a metadata header with the tokenizer
+and configuration of the run, and are loaded without parsing any text (see read_results()).
+"""
+import importlib.util
+import json
+import logging
+import os
+
+import numpy as np
+
+pa = None  # pyarrow, imported on first use (see _pyarrow())
+
+FORMATS = ["tsv", "parquet", "arrow", "npz"]
+BATCH_ROWS = 10000  # rows buffered before a batch is written (one row group / record batch per batch)
+METADATA_KEY = "klega"
+
+
+def columns(parallel_analysis, loi):
+    """
+    :return: list of str, column names of a result file
+    """
+    if parallel_analysis:
+        return ["filename", "length"] + list(loi)
+    return ["filename"] + list(loi)
+
+
+def _column_type(column):
+    if column == "filename":
+        return str
+    if column == "length":
+        return np.int64
+    return np.float64  # ntokens and ntypes are means over samples in parallel analysis
+
+
+def _pyarrow():
+    """
+    :return: module pyarrow (with pyarrow.ipc and pyarrow.parquet), imported on first use
+    """
+    global pa
+    if pa is None:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+        pa = pyarrow
+    return pa
+
+
+def resolve_format(output_format):
+    """
+    :param output_format: str, possible options: (tsv, parquet, arrow, npz)
+    :return: str, the format actually used: parquet and arrow need pyarrow and fall back to npz without it
+    """
+    if output_format not in FORMATS:
+        raise ValueError("output format must be one of these options: (tsv, parquet, arrow, npz)")
+    if output_format in ("parquet", "arrow") and importlib.util.find_spec("pyarrow") is None:
+        logging.warning("pyarrow is not installed: results are written as npz instead of %s", output_format)
+        return "npz"
+    return output_format
+
+
+class ResultWriter:
+    """
+    Buffered writer of the result rows of one configuration
+    Rows are added per text with write() and written in batches of whole texts, so an interrupted run never
+    leaves a text half written in a batch
+    """
+    extension = None
+
+    def __init__(self, path, columns, metadata=None, batch_rows=BATCH_ROWS):
+        """
+        :param path: str, path of the result file
+        :param columns: list of str, column names (see columns())
+        :param metadata: dict, tokenizer and configuration of the run (not written in tsv files)
+        :param batch_rows: int, number of rows buffered before they are written
+        """
+        self.path = path
+        self.columns = columns
+        self.metadata = metadata or {}
+        self.batch_rows = batch_rows
+        self.done = set()  # text ids already in the file (resume)
+        self._rows = []
+
+    def write(self, text_id, rows):
+        """
+        :param text_id: str
+        :param rows: list of rows of index values of the text, see ld_analyser.analyse_text()
+        """
+        self._rows.extend([text_id] + row for row in rows)
+        if len(self._rows) >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        if self._rows:
+            self._write_batch(self._rows)
+            self._rows = []
+
+    def close(self):
+        self.flush()
+        self._close()
+
+    def _columns(self, rows):
+        """
+        :return: list of np.ndarray, one typed array per column
+        """
+        return [np.array(values, dtype=_column_type(column)) for column, values in zip(self.columns, zip(*rows))]
+
+    def _write_batch(self, rows):
+        raise NotImplementedError
+
+    def _close(self):
+        pass
+
+
+class TsvWriter(ResultWriter):
+    extension = ".tsv"
+
+    def __init__(self, path, columns, metadata=None, batch_rows=BATCH_ROWS, resume=False):
+        """
+        :param resume: bool, if set True, keep the complete texts of an existing file and append to it
+        """
+        super().__init__(path, columns, metadata, batch_rows)
+        done_ids = _resume_tsv(path, columns) if resume else None
+        if done_ids is None:
+            self._file = open(path, "w", encoding='utf-8')
+            self._file.write('\t'.join(columns))
+        else:
+            self._file = open(path, "a", encoding='utf-8')
+            self.done = done_ids
+
+    def _write_batch(self, rows):
+        # values are written with str(), as in the original tsv files
+        self._file.write(''.join("\n" + '\t'.join(map(str, row)) for row in rows))
+        self._file.flush()
+
+    def _close(self):
+        self._file.close()
+
+
+class ParquetWriter(ResultWriter):
+    extension = ".parquet"
+
+    def __init__(self, path, columns, metadata=None, batch_rows=BATCH_ROWS):
+        super().__init__(path, columns, metadata, batch_rows)
+        self._schema = _arrow_schema(columns, self.metadata)
+        self._writer = _pyarrow().parquet.ParquetWriter(path, self._schema)
+
+    def _write_batch(self, rows):
+        self._writer.write_table(pa.Table.from_arrays(self._columns(rows), schema=self._schema))
+
+    def _close(self):
+        self._writer.close()
+
+
+class ArrowWriter(ResultWriter):
+    extension = ".arrow"
+
+    def __init__(self, path, columns, metadata=None, batch_rows=BATCH_ROWS):
+        super().__init__(path, columns, metadata, batch_rows)
+        self._schema = _arrow_schema(columns, self.metadata)
+        self._sink = _pyarrow().OSFile(path, "wb")
+        self._writer = pa.ipc.new_file(self._sink, self._schema)
+
+    def _write_batch(self, rows):
+        self._writer.write_batch(pa.RecordBatch.from_arrays(self._columns(rows), schema=self._schema))
+
+    def _close(self):
+        self._writer.close()
+        self._sink.close()
+
+
+class NpzWriter(ResultWriter):
+    """
+    npz files cannot be appended to: batches are kept as typed arrays and the file is written on close()
+    """
+    extension = ".npz"
+
+    def __init__(self, path, columns, metadata=None, batch_rows=BATCH_ROWS):
+        super().__init__(path, columns, metadata, batch_rows)
+        self._batches = []
+
+    def _write_batch(self, rows):
+        self._batches.append(self._columns(rows))
+
+    def _close(self):
+        arrays = {column: np.concatenate([batch[i] for batch in self._batches]) if self._batches
+                  else np.array([], dtype=_column_type(column))
+                  for i, column in enumerate(self.columns)}
+        # filename is stored as a fixed-width unicode array, so the file loads without pickle
+        np.savez(self.path, __metadata__=np.array(json.dumps(self.metadata)), **arrays)
+        self._batches = []
+
+
+WRITERS = {"tsv": TsvWriter, "parquet": ParquetWriter, "arrow": ArrowWriter, "npz": NpzWriter}
+
+
+def _arrow_schema(columns, metadata):
+    pa = _pyarrow()
+    types = {str: pa.string(), np.int64: pa.int64(), np.float64: pa.float64()}
+    return pa.schema([(column, types[_column_type(column)]) for column in columns],
+                     metadata={METADATA_KEY: json.dumps(metadata)})
+
+
+def open_writer(output_format, path, columns, metadata=None, resume=False):
+    """
+    :param output_format: str, possible options: (tsv, parquet, arrow, npz), see resolve_format()
+    :param path: str, path of the result file (with the extension of the format, see ResultWriter.extension)
+    :param resume: bool, append to an existing tsv file (only supported by tsv)
+    :return: ResultWriter
+    """
+    if output_format == "tsv":
+        return TsvWriter(path, columns, metadata, resume=resume)
+    if resume:
+        raise ValueError("resume is only supported for tsv output")
+    return WRITERS[output_format](path, columns, metadata)
+
+
+def _resume_tsv(file_name, columns):
+    """
+    Prepare an existing result file for appending: keep the rows of completely written texts only
+    Rows are written as "\n" + row, so the last row never ends with a newline and may have been cut anywhere, even
+    inside its last value. The rows of the last text are always dropped (it is analysed again), and the file is
+    truncated in place before them
+    :return: set of text ids already in the file, or None if there is no file to resume
+    """
+    header = '\t'.join(columns).encode('utf-8')
+    try:
+        f = open(file_name, "r+b")
+    except FileNotFoundError:
+        return None
+    with f:
+        first_line = f.readline()
+        offset = len(first_line)
+        done_ids = set()
+        last_id = None
+        last_start = len(first_line.rstrip(b"\n"))  # truncate here: after the header or before the last text
+        for line in f:
+            text_id = line.split(b"\t", 1)[0]
+            if text_id != last_id:
+                if last_id is not None:
+                    done_ids.add(last_id.decode('utf-8'))
+                last_id = text_id
+                last_start = offset - 1  # the newline before the first row of the text
+            offset += len(line)
+
+        if first_line.rstrip(b"\n") != header:
+            if last_id is None and header.startswith(first_line):
+                return None  # empty file, or header cut by an interruption: start a new file
+            raise ValueError("{} cannot be resumed: its columns are not {}".format(file_name, columns))
+        f.truncate(last_start)
+    return done_ids
+
+
+def read_metadata(path):
+    """
+    :param path: str, path of a parquet, arrow or npz result file
+    :return: dict, the metadata header written with the results
+    """
+    extension = os.path.splitext(path)[1]
+    if extension == ".npz":
+        with np.load(path) as npz:
+            return json.loads(str(npz["__metadata__"]))
+    pa = _pyarrow()
+    if extension == ".parquet":
+        schema = pa.parquet.read_schema(path)
+    else:
+        with pa.memory_map(path) as source:
+            schema = pa.ipc.open_file(source).schema
+    return json.loads(schema.metadata[METADATA_KEY.encode()])
+
+
+def read_rows(path):
+    """
+    Read the rows of a result file of any format, grouped by text
+    Values of tsv files are kept as str, so that they are written back unchanged (see TsvWriter)
+    :param path: str, path of the result file
+    :return: tuple (list of column names, dict text id -> list of rows without the text id, in file order)
+    """
+    extension = os.path.splitext(path)[1]
+    if extension == ".tsv":
+        with open(path, encoding='utf-8') as f:
+            lines = f.read().split("\n")
+        header = lines[0].split('\t')
+        rows = [line.split('\t') for line in lines[1:] if line]
+        values = [list(column) for column in zip(*rows)] if rows else [[] for _ in header]
+    elif extension == ".npz":
+        with np.load(path) as npz:
+            header = [column for column in npz.files if column != "__metadata__"]
+            values = [npz[column].tolist() for column in header]
+    else:
+        pa = _pyarrow()
+        if extension == ".parquet":
+            table = pa.parquet.read_table(path)
+        else:
+            with pa.memory_map(path) as source:
+                table = pa.ipc.open_file(source).read_all()
+        header = table.column_names
+        values = [table.column(column).to_pylist() for column in header]
+
+    grouped = {}
+    for row in zip(*values):
+        grouped.setdefault(row[0], []).append(list(row[1:]))
+    return header, grouped
+
+
+def read_results(path):
+    """
+    Load a result file of any format as a DataFrame with the same columns as the tsv file
+    Arrow files are memory-mapped, the other columnar formats are read without parsing
+    :param path: str, path of the result file
+    :return: pandas DataFrame
+    """
+    import pandas as pd
+
+    extension = os.path.splitext(path)[1]
+    if extension == ".tsv":
+        return pd.read_csv(path, sep='\t', dtype={"filename": str})
+    if extension == ".npz":
+        with np.load(path) as npz:
+            return pd.DataFrame({column: npz[column] for column in npz.files if column != "__metadata__"})
+    pa = _pyarrow()
+    if extension == ".parquet":
+        return pa.parquet.read_table(path, memory_map=True).to_pandas()
+    with pa.memory_map(path) as source:
+        return pa.ipc.open_file(source).read_all().to_pandas()
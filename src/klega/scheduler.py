@@ -0,0 +1,134 @@
+"""
+Concurrent scheduler for tokenizer jobs
+Each tokenizer of a run is one job (all its configurations, see ld_analyser.tokenize_n_make_ld_matrices), and jobs
+are grouped by the resource their tagger uses:
+    jvm:    okt, komoran, kkma, hannanum share the JVM of the main process (JPype releases the GIL in Java calls)
+    mecab:  the MeCab C library, in a thread of the main process
+    stanza: the stanza pipeline, in a separate process
+Every resource has its own lane of at most `limit` concurrent jobs, so taggers that use different resources
+overlap instead of waiting for each other. Every job writes the same result files as in a sequential run.
+"""
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from korean_tokenizer import warm_up, tear_down, tagger_stats, get_cache, set_cache, set_observer
+from ld_analyser import tokenize_n_make_ld_matrices
+from metrics import METRICS, record
+from token_cache import TokenCache
+
+RESOURCES = {"okt": "jvm", "komoran": "jvm", "kkma": "jvm", "hannanum": "jvm", "mecab": "mecab", "stanza": "stanza"}
+DEFAULT_LIMITS = {"jvm": 4, "mecab": 1, "stanza": 1}
+PROCESS_RESOURCES = {"stanza"}  # resources whose jobs run in their own process
+
+
+def parse_limits(items):
+    """
+    :param items: list of str, e.g. ["jvm=2", "stanza=1"]
+    :return: dict, limits of every resource (defaults for the resources not given)
+    """
+    limits = dict(DEFAULT_LIMITS)
+    for item in items or []:
+        resource, _, value = item.partition("=")
+        if resource not in DEFAULT_LIMITS or not value.isdigit() or int(value) < 1:
+            raise ValueError("limits must look like RESOURCE=N with RESOURCE in (jvm, mecab, stanza) and N >= 1")
+        limits[resource] = int(value)
+    return limits
+
+
+def run_job(tokenizer, configs, data, output_dir, **kwargs):
+    """
+    Analyse the corpus with one tokenizer for all configurations
+    :param data: df of the corpus, or a function returning an iterable of (text id, text), e.g. to stream the texts
+    :param kwargs: arguments of ld_analyser.tokenize_n_make_ld_matrices
+    """
+    # workers warm up their own tagger, and with a cache the tagger is only built on a cache miss
+    if kwargs.get("workers", 1) <= 1 and get_cache() is None:
+        warm_up([tokenizer])
+    try:
+        tokenize_n_make_ld_matrices(data() if callable(data) else data, tokenizer, configs, output_dir, **kwargs)
+    finally:
+        tear_down([tokenizer])
+
+
+def _init_process(log_file, cache_settings):
+    logger = logging.getLogger()
+    logger.setLevel(logging.DEBUG)
+    if log_file is not None:
+        logger.addHandler(logging.FileHandler(log_file))
+    set_observer(record)
+    if cache_settings is not None:
+        set_cache(TokenCache(*cache_settings))
+
+
+def _run_job_in_process(tokenizer, configs, data, output_dir, kwargs):
+    run_job(tokenizer, configs, data, output_dir, **kwargs)
+    texts, METRICS.texts = METRICS.texts, 0
+    for name, stats in tagger_stats().items():
+        logging.info("Tagger %s: built %s time(s) in %.2fs, tagged %s texts in %.2fs", name,
+                     stats["constructions"], stats["construction_time"], stats["calls"], stats["tagging_time"])
+    return METRICS.drain(), texts  # timings are reported by the parent process
+
+
+def run_jobs(jobs, data, output_dir, limits=None, log_file=None, **kwargs):
+    """
+    Run tokenizer jobs concurrently, at most limits[resource] jobs at a time per resource
+    :param jobs: list of tuple (tokenizer, configs)
+    :param data: df of the corpus, shared by all jobs, or a picklable function returning an iterable of
+                 (text id, text) called once per job (e.g. functools.partial(data_reader.iter_texts, input_dir))
+    :param limits: dict, maximum number of concurrent jobs per resource (see DEFAULT_LIMITS)
+    :param log_file: str, log file of the run, also used by jobs in a separate process
+    :param kwargs: arguments of ld_analyser.tokenize_n_make_ld_matrices
+    :return: none. Raises RuntimeError after all jobs are finished if any of them failed
+    """
+    limits = dict(DEFAULT_LIMITS, **(limits or {}))
+    lanes = {}
+    for tokenizer, configs in jobs:
+        lanes.setdefault(RESOURCES[tokenizer], []).append((tokenizer, configs))
+
+    failed = []
+    pools = {}
+    cache = get_cache()
+    cache_settings = (cache.path, cache.max_size) if cache is not None else None
+    for resource in lanes:
+        if resource in PROCESS_RESOURCES:
+            # spawn instead of fork: a forked child cannot use a JVM started by the parent process
+            pools[resource] = ProcessPoolExecutor(max_workers=limits[resource],
+                                                  mp_context=multiprocessing.get_context("spawn"),
+                                                  initializer=_init_process, initargs=(log_file, cache_settings))
+
+    def lane(resource, queue, queue_lock):
+        while True:
+            with queue_lock:
+                if not queue:
+                    return
+                tokenizer, configs = queue.pop(0)
+            logging.info("Job %s started (%s)", tokenizer, resource)
+            try:
+                if resource in pools:
+                    timings, texts = pools[resource].submit(_run_job_in_process, tokenizer, configs, data,
+                                                            output_dir, kwargs).result()
+                    METRICS.merge(timings)
+                    METRICS.add_texts(texts)
+                else:
+                    run_job(tokenizer, configs, data, output_dir, **kwargs)
+                logging.info("Job %s finished", tokenizer)
+            except Exception:
+                logging.exception("Job %s failed", tokenizer)
+                failed.append(tokenizer)
+
+    threads = []
+    for resource, queue in lanes.items():
+        queue_lock = threading.Lock()
+        for _ in range(min(limits[resource], len(queue))):
+            thread = threading.Thread(target=lane, args=(resource, queue, queue_lock), name="klega-" + resource)
+            thread.start()
+            threads.append(thread)
+    for thread in threads:
+        thread.join()
+    for pool in pools.values():
+        pool.shutdown()
+
+    if failed:
+        raise RuntimeError("Tokenizer job(s) failed: {}".format(", ".join(failed)))
@@ -0,0 +1,243 @@
+"""
+Long-lived HTTP server around LdAnalyser for the KLEGA web application
+Taggers stay loaded between requests, concurrent requests are grouped into batches per tokenizer,
+and blocking tagging/LD work runs on a worker thread pool.
+
+Run: python -m klega.server --port 8000 --tokenizers okt mecab
+API:
+    POST /analyse   {"tokenizer": "okt", "text": "...", "engine": "taaled"}
+    GET  /metrics   latency percentiles, queue depth and batch sizes
+    GET  /health
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from klega.korean_tokenizer import tokenize_batch, warm_up, tagger_stats, TOKENIZERS
+from klega.ld_engine import ENGINES
+from klega.web import analyse, memoized
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+           500: "Internal Server Error"}
+
+
+def tokenize_batch_texts(tokenizer, texts):
+    """
+    Tokenize a batch of texts in one worker job (tagged in bulk where the tagger supports it)
+    :return: list of tokenize() results in the same order as texts
+    """
+    return tokenize_batch(tokenizer, texts)
+
+
+def _analyse_batch(tokenizer, requests):
+    """
+    Tokenize and analyse a batch of requests of the same tokenizer (runs on the worker pool)
+    :param requests: list of tuple (text, engine)
+    :return: list of tuple (result dict, None) or (None, error message)
+    """
+    tokenized = tokenize_batch_texts(tokenizer, [text for text, _ in requests])
+    results = []
+    for (text, engine), tokens in zip(requests, tokenized):
+        try:
+            results.append((_to_json(analyse(tokenizer, text, engine=engine, tokenized=tokens)), None))
+        except Exception as e:  # e.g. a text without any analysable token
+            results.append((None, "{}: {}".format(type(e).__name__, e)))
+    return results
+
+
+def _to_json(analyser):
+    return {"tokenizer": analyser.tokenizer,
+            "ld_all": analyser.ldout_all,
+            "ld_content": analyser.ldout_content,
+            "frequency_all": [[token, pos, count] for (token, pos), count in analyser.pos_with_frequency_all],
+            "frequency_content": [[token, pos, count] for (token, pos), count in analyser.pos_with_frequency_content]}
+
+
+class Metrics:
+    def __init__(self, window=1000):
+        self.latencies = deque(maxlen=window)  # seconds, most recent requests
+        self.batch_sizes = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+        self.memo_hits = 0
+        self.started = time.time()
+
+    @staticmethod
+    def percentile(values, q):
+        if not values:
+            return None
+        values = sorted(values)
+        return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+    def summary(self, queues):
+        latencies = list(self.latencies)
+        return {"uptime": round(time.time() - self.started, 1),
+                "requests": self.requests,
+                "errors": self.errors,
+                "memo_hits": self.memo_hits,
+                "latency_ms": {"p" + str(q): None if not latencies else round(self.percentile(latencies, q) * 1000, 2)
+                               for q in (50, 90, 95, 99)},
+                "queue_depth": {tokenizer: queue.qsize() for tokenizer, queue in queues.items()},
+                "mean_batch_size": round(sum(self.batch_sizes) / len(self.batch_sizes), 2) if self.batch_sizes else None,
+                "taggers": tagger_stats()}
+
+
+class LdServer:
+    def __init__(self, workers=4, max_batch=16, max_wait=0.01, max_body=1024 * 1024):
+        """
+        :param workers: int, number of threads running tagging and LD calculation
+        :param max_batch: int, maximum number of requests tokenized in one batch
+        :param max_wait: float, seconds a batch waits for more requests after its first one
+        :param max_body: int, maximum request body size in bytes
+        """
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_body = max_body
+        self.queues = {}
+        self.metrics = Metrics()
+
+    async def warm_up(self, tokenizers):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, warm_up, tokenizers)
+        for tokenizer in tokenizers:
+            self._queue(tokenizer)
+
+    def _queue(self, tokenizer):
+        if tokenizer not in self.queues:
+            self.queues[tokenizer] = asyncio.Queue()
+            asyncio.get_running_loop().create_task(self._batcher(tokenizer))
+        return self.queues[tokenizer]
+
+    async def _batcher(self, tokenizer):
+        queue = self.queues[tokenizer]
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            self.metrics.batch_sizes.append(len(batch))
+            try:
+                results = await loop.run_in_executor(self.executor, _analyse_batch, tokenizer,
+                                                     [(text, engine) for text, engine, _ in batch])
+            except Exception as e:
+                results = [(None, "{}: {}".format(type(e).__name__, e))] * len(batch)
+            for (_, _, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    async def analyse(self, tokenizer, text, engine):
+        analyser = memoized(tokenizer, text, engine)
+        if analyser is not None:  # re-submitted text: answer without queueing
+            self.metrics.memo_hits += 1
+            return _to_json(analyser), None
+        future = asyncio.get_running_loop().create_future()
+        await self._queue(tokenizer).put((text, engine, future))
+        return await future
+
+    async def handle(self, reader, writer):
+        start = time.perf_counter()
+        try:
+            status, body = await self._dispatch(reader)
+        except Exception as e:
+            logging.exception("Request failed")
+            status, body = 500, {"error": "{}: {}".format(type(e).__name__, e)}
+        self.metrics.requests += 1
+        if status != 200:
+            self.metrics.errors += 1
+        payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        writer.write("HTTP/1.1 {} {}\r\nContent-Type: application/json; charset=utf-8\r\nContent-Length: {}\r\n"
+                     "Connection: close\r\n\r\n".format(status, REASONS.get(status, ""), len(payload)).encode("ascii"))
+        writer.write(payload)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+        self.metrics.latencies.append(time.perf_counter() - start)
+
+    async def _dispatch(self, reader):
+        request_line = (await reader.readline()).decode("latin-1").split()
+        if len(request_line) < 2:
+            return 400, {"error": "malformed request"}
+        method, path = request_line[0], request_line[1].split("?")[0]
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if path == "/health":
+            return 200, {"status": "ok"}
+        if path == "/metrics":
+            return 200, self.metrics.summary(self.queues)
+        if path != "/analyse":
+            return 404, {"error": "unknown path " + path}
+        if method != "POST":
+            return 405, {"error": "use POST"}
+
+        try:
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            return 400, {"error": "invalid Content-Length"}
+        if length < 0:
+            return 400, {"error": "invalid Content-Length"}
+        if length > self.max_body:
+            return 413, {"error": "request body too large"}
+        try:
+            request = json.loads((await reader.readexactly(length)).decode("utf-8"))
+            tokenizer = request.get("tokenizer", "okt")
+            text = request["text"]
+            engine = request.get("engine", "taaled")
+        except (ValueError, KeyError, AttributeError, asyncio.IncompleteReadError):
+            return 400, {"error": "body must be JSON with a 'text' field"}
+        if not isinstance(text, str):  # the text is hashed for the memo: other JSON values cannot be analysed
+            return 400, {"error": "body must be JSON with a 'text' field"}
+        if not isinstance(tokenizer, str) or tokenizer not in TOKENIZERS:
+            return 400, {"error": "tokenizer must be one of " + ", ".join(TOKENIZERS)}
+        if not isinstance(engine, str) or engine not in ENGINES:
+            return 400, {"error": "engine must be one of " + ", ".join(ENGINES)}
+
+        result, error = await self.analyse(tokenizer, text, engine)
+        if error is not None:
+            return 400, {"error": error}
+        return 200, result
+
+
+async def serve(host, port, tokenizers, **kwargs):
+    server = LdServer(**kwargs)
+    if tokenizers:
+        logging.info("Loading taggers: %s", tokenizers)
+        await server.warm_up(tokenizers)
+    http = await asyncio.start_server(server.handle, host, port)
+    logging.info("KLEGA server listening on http://%s:%s", host, port)
+    async with http:
+        await http.serve_forever()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="KLEGA analysis server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("-t", "--tokenizers", nargs='*', default=["okt"], help="Taggers loaded at startup")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="Number of worker threads for tagging and LD calculation")
+    parser.add_argument("--max-batch", type=int, default=16, help="Maximum number of requests tokenized together")
+    parser.add_argument("--max-wait", type=float, default=10, help="Milliseconds a batch waits for more requests")
+    args = parser.parse_args()
+
+    asyncio.run(serve(args.host, args.port, args.tokenizers, workers=args.workers, max_batch=args.max_batch,
+                      max_wait=args.max_wait / 1000))
@@ -0,0 +1,253 @@
+"""
+Sharded runs
+A corpus is split into N shards by file name (see data_reader.shard_of), so N runs of `main.py --shard K/N` on
+several machines analyse every text exactly once without an external scheduler. Every shard writes its results to
+its own directory together with a manifest (file lists, configuration and checksums), and `main.py merge` combines
+the shard directories into the result files a single run over the whole corpus would have written.
+"""
+import csv
+import hashlib
+import json
+import logging
+import os
+
+from data_reader import list_texts, shard_of
+from result_writer import WRITERS, open_writer, read_metadata, read_rows
+
+MANIFEST = "manifest.json"
+MANIFEST_VERSION = 1
+PROCESSED_DATA = "processed_data.tsv"
+# options that change the result files: shards with different values cannot be merged
+CONFIG_KEYS = ["tokenizer", "all", "functionwords", "parallel", "notyporemoval", "typo_backend", "ld_engine",
+               "output_format"]
+
+
+def parse_shard(value):
+    """
+    :param value: str, "K/N", the K-th of N shards (1 <= K <= N)
+    :return: tuple (K, N)
+    """
+    index, _, count = value.partition("/")
+    if not (index.isdigit() and count.isdigit()) or not 1 <= int(index) <= int(count):
+        raise ValueError("shard must look like K/N with 1 <= K <= N, e.g. 1/4")
+    return int(index), int(count)
+
+
+def shard_dir(output_dir, shard):
+    """
+    :return: str, output directory of the shard, e.g. result/shard_1_of_4
+    """
+    return os.path.join(output_dir, "shard_{}_of_{}".format(*shard))
+
+
+def checksum(path):
+    """
+    :return: str, sha256 of the file content
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _listing_checksum(names):
+    # independent of the directory order, which may differ between machines
+    return hashlib.sha256("\n".join(sorted(names)).encode("utf-8")).hexdigest()
+
+
+def run_config(args):
+    """
+    :param args: argparse.Namespace of main.py
+    :return: dict, the options of the run that change the result files
+    """
+    config = {key: getattr(args, key) for key in CONFIG_KEYS}
+    if not args.notyporemoval and args.wordlist is not None:
+        config["wordlist"] = checksum(args.wordlist)  # the path may differ between machines, the content may not
+    return config
+
+
+def write_manifest(output_dir, input_dir, shard, config, log_file):
+    """
+    Write the manifest of a finished shard: the corpus listing, the texts of the shard and the result files,
+    with checksums of the input texts and of the result files
+    :param output_dir: str, output directory of the shard
+    :param input_dir: str, input directory of the whole corpus
+    :param shard: tuple (index, count)
+    :param config: dict, see run_config()
+    :param log_file: str, log file of the shard run
+    :return: str, path of the manifest
+    """
+    corpus = list_texts(input_dir)
+    index, count = shard
+    texts = {name: checksum(os.path.join(input_dir, name)) for name in corpus if shard_of(name, count) == index}
+    extensions = set(writer.extension for writer in WRITERS.values())
+    outputs = {}
+    for name in sorted(os.listdir(output_dir)):  # result files and processed texts
+        if os.path.splitext(name)[1] in extensions and os.path.isfile(os.path.join(output_dir, name)):
+            outputs[name] = checksum(os.path.join(output_dir, name))
+    manifest = {"version": MANIFEST_VERSION,
+                "shard": {"index": index, "count": count},
+                "config": config,
+                "corpus": {"path": os.path.abspath(input_dir), "count": len(corpus),
+                           "checksum": _listing_checksum(corpus), "files": corpus},
+                "texts": texts,
+                "outputs": outputs,
+                "log": os.path.basename(log_file)}
+    path = os.path.join(output_dir, MANIFEST)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, ensure_ascii=False)
+    return path
+
+
+def find_manifests(paths):
+    """
+    :param paths: list of str, shard directories, or directories containing shard directories
+    :return: list of tuple (shard directory, manifest), ordered by shard index
+    """
+    found = []
+    for path in paths:
+        if os.path.isfile(os.path.join(path, MANIFEST)):
+            directories = [path]
+        else:
+            directories = sorted(os.path.join(path, name) for name in os.listdir(path)
+                                 if os.path.isfile(os.path.join(path, name, MANIFEST)))
+        for directory in directories:
+            with open(os.path.join(directory, MANIFEST), encoding="utf-8") as f:
+                found.append((directory, json.load(f)))
+    return sorted(found, key=lambda item: item[1]["shard"]["index"])
+
+
+def _processed_rows(path):
+    """
+    :return: tuple (header line, dict text id -> line) of a processed_data.tsv file (lines with their newline)
+    """
+    with open(path, encoding="utf-8") as f:
+        lines = f.read().split("\n")
+    rows = {}
+    for line in lines[1:]:
+        if line:
+            rows[next(csv.reader([line], delimiter="\t"))[0]] = line + "\n"
+    return lines[0] + "\n", rows
+
+
+def merge_shards(paths, output_dir):
+    """
+    Merge shard directories into the result files of a single run over the whole corpus: same files, same rows,
+    in the order of the corpus listing. Shards are checked against each other and against their manifests
+    :param paths: list of str, shard directories, or directories containing shard directories
+    :param output_dir: str, directory of the merged result files
+    :return: dict, report with the missing shards, missing and duplicated texts, and the problems found
+    """
+    manifests = find_manifests(paths)
+    if not manifests:
+        raise ValueError("no shard manifest ({}) found in {}".format(MANIFEST, ", ".join(paths)))
+    first_dir, first = manifests[0]
+    count = first["shard"]["count"]
+    for directory, manifest in manifests[1:]:
+        if manifest["shard"]["count"] != count:
+            raise ValueError("{} is a shard of {} shards, {} of {}".format(directory, manifest["shard"]["count"],
+                                                                          first_dir, count))
+        if manifest["config"] != first["config"]:
+            raise ValueError("{} and {} were run with different options: {} != {}".format(
+                directory, first_dir, manifest["config"], first["config"]))
+        if manifest["corpus"]["checksum"] != first["corpus"]["checksum"]:
+            raise ValueError("{} and {} were run on different corpora".format(directory, first_dir))
+
+    report = {"shards": [manifest["shard"]["index"] for _, manifest in manifests],
+              "missing_shards": [], "missing_texts": [], "duplicated_texts": [], "problems": []}
+    present = set(report["shards"])
+    report["missing_shards"] = [index for index in range(1, count + 1) if index not in present]
+
+    # texts: every text of the corpus in one shard only
+    owner = {}  # text id -> shard directory its rows are taken from
+    checksums = {}
+    for directory, manifest in manifests:
+        for name, text_checksum in manifest["texts"].items():
+            if name in owner:
+                report["duplicated_texts"].append(name)
+                if checksums[name] != text_checksum:
+                    report["problems"].append("{}: different content in {} and {}".format(name, owner[name],
+                                                                                         directory))
+                continue
+            if shard_of(name, count) != manifest["shard"]["index"]:
+                report["problems"].append("{}: in {} but belongs to shard {}".format(name, directory,
+                                                                                   shard_of(name, count)))
+            owner[name] = directory
+            checksums[name] = text_checksum
+    corpus = first["corpus"]["files"]  # the order of a single run
+    report["missing_texts"] = [name for name in corpus if name not in owner]
+
+    # result files: unchanged since the shard run, and the same in every shard
+    outputs = []
+    for directory, manifest in manifests:
+        for name, output_checksum in manifest["outputs"].items():
+            if name not in outputs:
+                outputs.append(name)
+            if checksum(os.path.join(directory, name)) != output_checksum:
+                report["problems"].append("{}: changed since the shard run".format(os.path.join(directory, name)))
+    for directory, manifest in manifests:
+        for name in outputs:
+            if name not in manifest["outputs"]:
+                report["problems"].append("{}: missing in {}".format(name, directory))
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    for name in outputs:
+        path = os.path.join(output_dir, name)
+        if name == PROCESSED_DATA:
+            header = None
+            rows = {}
+            for directory, manifest in manifests:
+                if name in manifest["outputs"]:
+                    header, shard_rows = _processed_rows(os.path.join(directory, name))
+                    rows.update((tid, row) for tid, row in shard_rows.items() if owner.get(tid) == directory)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(header + "".join(rows[tid] for tid in corpus if tid in rows))
+        else:
+            _merge_results(name, manifests, owner, corpus, path)
+        logging.info("Merged %s", path)
+
+    for key in ["missing_shards", "missing_texts", "duplicated_texts"]:
+        if report[key]:
+            logging.warning("%s %s: %s", len(report[key]), key.replace("_", " "), report[key])
+    for problem in report["problems"]:
+        logging.warning("%s", problem)
+    logging.info("Merged %s shard(s) of %s: %s of %s texts", len(present), count, len(corpus) -
+                 len(report["missing_texts"]), len(corpus))
+    return report
+
+
+def _merge_results(name, manifests, owner, corpus, path):
+    """
+    Merge one result file of every shard with the writer of its format
+    """
+    rows = {}
+    header = None
+    metadata = None
+    for directory, manifest in manifests:
+        if name not in manifest["outputs"]:
+            continue
+        shard_path = os.path.join(directory, name)
+        header, shard_rows = read_rows(shard_path)
+        if metadata is None and not name.endswith(".tsv"):
+            metadata = read_metadata(shard_path)
+        rows.update((tid, text_rows) for tid, text_rows in shard_rows.items() if owner.get(tid) == directory)
+    output_format = os.path.splitext(name)[1][1:]
+    writer = open_writer(output_format, path, header, metadata)
+    for tid in corpus:
+        if tid in rows:
+            writer.write(tid, rows[tid])
+    writer.close()
+
+
+def merge_logs(manifests, log_file):
+    """
+    Append the logs of the shard runs to the log of the merge, in order of shard index
+    """
+    with open(log_file, "a", encoding="utf-8") as log:
+        for directory, manifest in manifests:
+            log.write("\n================ shard {}/{}: {} =================\n".format(
+                manifest["shard"]["index"], manifest["shard"]["count"], directory))
+            with open(os.path.join(directory, manifest["log"]), encoding="utf-8") as f:
+                log.write(f.read())
@@ -0,0 +1,255 @@
+"""
+Spellcheck backends for typo removal
+msword: Microsoft Word spelling errors through COM (Windows with Microsoft Office only)
+symspell: offline checker built from a word list, with a SymSpell deletion index over Hangul jamo
+          (https://github.com/wolfgarbe/SymSpell). It runs in process, on any OS, and across a process pool.
+"""
+import codecs
+import logging
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+from util import current_time_as_str
+
+BACKENDS = ["msword", "symspell"]
+
+# precomposed Hangul syllables: 0xAC00 + (initial * 21 + medial) * 28 + final
+_FINALS = "ㄱㄲㄳㄴㄵㄶㄷㄹㄺㄻㄼㄽㄾㄿㅀㅁㅂㅄㅅㅆㅇㅈㅊㅋㅌㅍㅎ"
+_JAMO = {0xAC00 + code: chr(0x1100 + code // 588) + chr(0x1161 + code % 588 // 28) +
+         (chr(0x11A7 + code % 28) if code % 28 else "") for code in range(11172)}
+_WORD = re.compile(r"\w+")
+_HANGUL_WORD = re.compile(r"[가-힣]+")
+
+# particles and endings that may follow a word of the word list in an eojeol. Suffixes can follow each other
+# (e.g. 었 + 습니다). 'ㄴ', 'ㄹ', 'ㅁ', 'ㅂ', 'ㅆ' are endings merged into the final consonant of the stem (e.g. 간, 갔다)
+PARTICLES = ["이", "가", "은", "는", "을", "를", "의", "에", "에서", "에게", "에게서", "한테", "께", "께서", "와", "과", "랑",
+             "이랑", "하고", "도", "만", "로", "으로", "로서", "으로서", "로써", "으로써", "부터", "까지", "보다", "처럼",
+             "같이", "마다", "조차", "마저", "밖에", "이나", "나", "든지", "이든지", "야", "이야", "요", "이요", "뿐", "들"]
+ENDINGS = ["다", "고", "지", "지만", "어", "아", "여", "어서", "아서", "여서", "었", "았", "였", "겠", "시", "으시",
+           "습니다", "니다", "습니까", "어요", "아요", "여요", "에요", "예요", "이에요", "이다", "였다", "세요",
+           "으세요", "는", "은", "을", "게", "면", "으면", "니", "으니", "니까", "으니까", "기", "음", "던", "는데", "은데",
+           "도록", "려고", "으려고", "러", "으러", "거나", "자", "네", "군", "구나", "죠", "서", "며", "으며",
+           "ㄴ", "ㄹ", "ㅁ", "ㅂ", "ㅆ"]
+
+
+def to_jamo(word):
+    """
+    :param word: str
+    :return: str, word with every Hangul syllable decomposed into its conjoining jamo (initial, medial, final)
+    """
+    return word.translate(_JAMO)
+
+
+def _suffix_jamo(suffix):
+    if len(suffix) == 1 and suffix in _FINALS:  # ending merged into the final consonant
+        return chr(0x11A8 + _FINALS.index(suffix))
+    return to_jamo(suffix)
+
+
+def _deletes(word, distance):
+    """
+    :return: set of str, every string obtained by deleting up to distance characters from word
+    """
+    deletes = {word}
+    level = {word}
+    for _ in range(distance):
+        level = {variant[:i] + variant[i + 1:] for variant in level for i in range(len(variant))}
+        deletes |= level
+    return deletes
+
+
+def edit_distance(a, b, max_distance):
+    """
+    Optimal string alignment distance (Levenshtein with transpositions)
+    :return: int, the distance, or max_distance + 1 if it is larger than max_distance
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous2, previous = previous, current
+    return previous[-1] if previous[-1] <= max_distance else max_distance + 1
+
+
+class SpellChecker:
+    """
+    Backend interface: find the spelling errors of texts
+    """
+
+    def spelling_errors(self, texts, workers=1):
+        """
+        :param texts: list of str
+        :param workers: int, number of worker processes (if supported by the backend)
+        :return: list of list of str, the misspelled words of each text, in order of occurrence
+        """
+        raise NotImplementedError
+
+
+class MsWordChecker(SpellChecker):
+    """
+    Spelling errors found by Microsoft Word (Windows with Microsoft Office and pywin32 only)
+    """
+
+    def spelling_errors(self, texts, workers=1):
+        import win32com.client
+
+        # save the raw text into ms word form to use ms word typo corrector
+        file_path = os.path.abspath(current_time_as_str() + ".txt")
+        with codecs.open(file_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(texts))  # do not add \n at the end of the file
+
+        # open the ms word document
+        msword = win32com.client.DispatchEx('Word.Application')
+        try:
+            doc = msword.Documents.Open(file_path)
+            assert int(doc.Paragraphs.Count) == len(texts)
+            # for each text(Paragraph in word), detect error
+            typo_lists = [[str(typo) for typo in p.Range.SpellingErrors] for p in doc.Paragraphs]
+            doc.Close(0)
+        finally:
+            msword.Quit(0)
+            os.remove(file_path)
+        return typo_lists
+
+
+class SymSpellChecker(SpellChecker):
+    """
+    Offline spellchecker built from a word list
+    An eojeol is correct if it is a word of the list, optionally followed by particles and endings.
+    It is a typo if it is not correct but a few jamo edits away from a word of the list (looked up in a SymSpell
+    deletion index, so the cost does not depend on the size of the list). Words far from every word of the list
+    (names, foreign and rare words) are kept, unlike in Microsoft Word.
+    """
+
+    def __init__(self, words, max_distance=2, suffixes=PARTICLES + ENDINGS):
+        """
+        :param words: iterable of str, correct words. Verbs and adjectives in dictionary form (ending in 다) also
+                      add their stem, so that conjugated forms are recognised
+        :param max_distance: int, maximum number of jamo edits between a typo and a word of the list.
+                             Short words allow fewer edits: 0 for one syllable, 1 for two syllables
+        :param suffixes: list of str, particles and endings
+        """
+        self.max_distance = max_distance
+        self._words = set()
+        for word in words:
+            self._words.add(to_jamo(word))
+            if len(word) > 1 and word.endswith("다"):
+                self._words.add(to_jamo(word[:-1]))
+        self._suffixes = set(_suffix_jamo(suffix) for suffix in suffixes)
+        self._max_suffix = max(len(suffix) for suffix in self._suffixes) if self._suffixes else 0
+
+        # deletion index: every string reachable by deleting up to max_distance jamo -> words it comes from
+        self._index = {}
+        for word in self._words:
+            for variant in _deletes(word, self._distance(word)):
+                self._index.setdefault(variant, []).append(word)
+        self._chains = {"": True}  # memo: is the string a sequence of suffixes
+        self._verdicts = {}  # memo: is the eojeol a typo
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        """
+        :param path: str, word list with one word per line. Further fields on a line (e.g. frequencies) are ignored
+        """
+        with open(path, encoding="utf-8") as f:
+            words = [line.split()[0] for line in f if line.strip() and not line.startswith("#")]
+        logging.info("Word list %s: %s words", path, len(words))
+        return cls(words, **kwargs)
+
+    def _distance(self, jamo):
+        return min(self.max_distance, max(0, (len(jamo) - 1) // 3))
+
+    def _is_suffix_chain(self, jamo):
+        chain = self._chains.get(jamo)
+        if chain is None:
+            chain = any(jamo[:i] in self._suffixes and self._is_suffix_chain(jamo[i:])
+                        for i in range(1, min(len(jamo), self._max_suffix) + 1))
+            self._chains[jamo] = chain
+        return chain
+
+    def _stems(self, jamo):
+        """
+        :return: list of str, the possible words of the eojeol once its particles and endings are removed
+        """
+        return [jamo[:i] for i in range(len(jamo), 0, -1) if self._is_suffix_chain(jamo[i:])]
+
+    def _near(self, jamo):
+        distance = self._distance(jamo)
+        if distance == 0:
+            return False
+        candidates = set()
+        for variant in _deletes(jamo, distance):
+            candidates.update(self._index.get(variant, ()))
+        # a pair is only found within the smaller distance of the two words (see _distance())
+        return any(edit_distance(jamo, candidate, min(distance, self._distance(candidate))) <=
+                   min(distance, self._distance(candidate)) for candidate in candidates)
+
+    def is_typo(self, word):
+        """
+        :param word: str, an eojeol of Hangul syllables
+        :return: bool
+        """
+        verdict = self._verdicts.get(word)
+        if verdict is None:
+            jamo = to_jamo(word)
+            words = self._words
+            if any(jamo[:i] in words and self._is_suffix_chain(jamo[i:]) for i in range(len(jamo), 0, -1)):
+                verdict = False  # a word of the list with its particles and endings
+            else:
+                verdict = any(self._near(stem) for stem in self._stems(jamo))
+            self._verdicts[word] = verdict
+        return verdict
+
+    def errors(self, text):
+        """
+        :return: list of str, the misspelled words of the text in order of occurrence
+        """
+        return [word for word in _WORD.findall(text) if _HANGUL_WORD.fullmatch(word) and self.is_typo(word)]
+
+    def spelling_errors(self, texts, workers=1):
+        if workers <= 1:
+            return [self.errors(text) for text in texts]
+        # every worker receives a copy of the index once, then checks chunks of texts
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                 initializer=_init_worker, initargs=(self,)) as pool:
+            return list(pool.map(_errors, texts, chunksize=max(1, min(256, len(texts) // (4 * workers)))))
+
+
+_worker_checker = None
+
+
+def _init_worker(checker):
+    global _worker_checker
+    _worker_checker = checker
+
+
+def _errors(text):
+    return _worker_checker.errors(text)
+
+
+def get_spellchecker(backend="msword", wordlist=None, **kwargs):
+    """
+    :param backend: str, possible options: (msword, symspell)
+    :param wordlist: str, path of the word list of the symspell backend
+    :return: SpellChecker
+    """
+    if backend == "msword":
+        return MsWordChecker()
+    elif backend == "symspell":
+        if wordlist is None:
+            raise ValueError("the symspell backend needs a word list")
+        return SymSpellChecker.from_file(wordlist, **kwargs)
+    else:
+        raise ValueError("backend must be one of these options: (msword, symspell)")
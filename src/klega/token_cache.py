@@ -0,0 +1,161 @@
+import os
+import json
+import atexit
+import zlib
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "klega", "tokens.sqlite")
+DEFAULT_CACHE_SIZE = 1024  # MB
+ACCESS_BATCH = 256  # cache hits whose access times are written together
+
+
+class TokenCache:
+    """
+    Persistent tokenization cache stored in a single SQLite file.
+    Each entry holds the pos_tuple_all of a text, keyed by (text hash, tokenizer, tokenizer version).
+    The least recently used entries are evicted once the cache grows over its size cap.
+    Access times of cache hits are kept in memory and written in batches (on put, on close and every ACCESS_BATCH
+    hits), so that a hit is a read only and worker processes sharing the file do not queue for the write lock.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_size=DEFAULT_CACHE_SIZE):
+        """
+        :param path: str, path of the cache file. The file is created if it does not exist
+        :param max_size: int, size cap of the cached data in MB
+        """
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._accessed = {}  # key -> access time of the hits not written yet
+        self._unwritten_hits = 0
+
+        if os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")  # worker processes read while another one writes
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS tokens (
+                                  text_hash TEXT NOT NULL,
+                                  tokenizer TEXT NOT NULL,
+                                  version TEXT NOT NULL,
+                                  data BLOB NOT NULL,
+                                  size INTEGER NOT NULL,
+                                  last_access REAL NOT NULL,
+                                  PRIMARY KEY (text_hash, tokenizer, version))""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS tokens_last_access ON tokens (last_access)")
+        self._conn.commit()
+        self._size = self._stored_size()
+        atexit.register(self.close)  # worker processes never close their cache: write their last hits at exit
+
+    @staticmethod
+    def text_hash(text):
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _stored_size(self):
+        return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM tokens").fetchone()[0]
+
+    def get(self, tokenizer, version, text):
+        """
+        :return: list of tuple ('token', 'Part-Of-Speech'), or None if the text is not cached
+        """
+        key = (self.text_hash(text), tokenizer, version)
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM tokens WHERE text_hash=? AND tokenizer=? AND version=?",
+                                     key).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._accessed[key] = time.time()
+            self._unwritten_hits += 1
+            if self._unwritten_hits >= ACCESS_BATCH:
+                self._write_accesses()
+                self._conn.commit()
+        return [tuple(pair) for pair in json.loads(zlib.decompress(row[0]).decode("utf-8"))]
+
+    def put(self, tokenizer, version, text, pos_tuple_all):
+        """
+        Store the tagging result of a text, evicting least recently used entries if the cache is full
+        :param pos_tuple_all: list of tuple ('token', 'Part-Of-Speech')
+        """
+        data = zlib.compress(json.dumps(pos_tuple_all, ensure_ascii=False, separators=(',', ':')).encode("utf-8"))
+        with self._lock:
+            self._write_accesses()  # in the same transaction, and before eviction reads the access times
+            self._conn.execute("INSERT OR REPLACE INTO tokens VALUES (?, ?, ?, ?, ?, ?)",
+                               (self.text_hash(text), tokenizer, version, data, len(data), time.time()))
+            self._conn.commit()
+            self._size += len(data)
+            if self._size > self.max_size * 1024 * 1024:
+                self._evict()
+
+    def _write_accesses(self):
+        """
+        Write the access times of the buffered hits (the caller holds the lock and commits)
+        """
+        if self._accessed:
+            self._conn.executemany("UPDATE tokens SET last_access=? WHERE text_hash=? AND tokenizer=? AND version=?",
+                                   [(access, ) + key for key, access in self._accessed.items()])
+            self._accessed = {}
+        self._unwritten_hits = 0
+
+    def _evict(self):
+        # other processes may share the file, so recount before deleting anything
+        self._size = self._stored_size()
+        limit = self.max_size * 1024 * 1024
+        if self._size <= limit:
+            return
+        target = int(limit * 0.9)  # free some room so that eviction does not run on every put
+        evicted = 0
+        rows = self._conn.execute("SELECT rowid, size FROM tokens ORDER BY last_access").fetchall()
+        to_delete = []
+        for rowid, size in rows:
+            if self._size <= target:
+                break
+            to_delete.append((rowid, ))
+            self._size -= size
+            evicted += 1
+        self._conn.executemany("DELETE FROM tokens WHERE rowid=?", to_delete)
+        self._conn.commit()
+        logging.debug("Token cache: %s entries evicted", evicted)
+
+    def clear(self):
+        with self._lock:
+            self._accessed = {}
+            self._unwritten_hits = 0
+            self._conn.execute("DELETE FROM tokens")
+            self._conn.commit()
+            self._conn.execute("VACUUM")
+            self._size = 0
+
+    def info(self):
+        """
+        :return: dict, summary of the cache contents and of the hits/misses of this process
+        """
+        with self._lock:
+            entries = self._conn.execute("SELECT tokenizer, version, COUNT(*), SUM(size) FROM tokens "
+                                         "GROUP BY tokenizer, version ORDER BY tokenizer").fetchall()
+            size = self._stored_size()
+        return {"path": self.path,
+                "max_size_mb": self.max_size,
+                "size_mb": round(size / 1024 / 1024, 2),
+                "entries": sum(row[2] for row in entries),
+                "tokenizers": [{"tokenizer": row[0], "version": row[1], "entries": row[2], "size": row[3]}
+                               for row in entries],
+                "hits": self.hits,
+                "misses": self.misses}
+
+    def close(self):
+        atexit.unregister(self.close)
+        with self._lock:
+            if self._conn is None:
+                return
+            self._write_accesses()
+            self._conn.commit()
+            self._conn.close()
+            self._conn = None
@@ -0,0 +1,176 @@
+"""
+Compact token streams for POS filtering
+A tagged text is stored as two parallel arrays, interned type ids (int32) and POS ids (uint16),
+so that removing stopwords and function words is a boolean mask operation instead of rebuilding
+lists of (token, POS) tuples.
+"""
+import threading
+
+import numpy as np
+
+from korean_tokenizer import STOPWORDS, FUNCTIONWORDS
+
+
+class Vocabulary:
+    """
+    Interned token types of the process: every distinct token string gets an int32 id (in order of first occurrence)
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+        self._lock = threading.Lock()  # texts of concurrent jobs are encoded with the same vocabulary
+
+    def __len__(self):
+        return len(self.strings)
+
+    def encode(self, tokens):
+        """
+        :param tokens: sequence of str
+        :return: np.ndarray of int32 type ids
+        """
+        ids = self.ids
+        codes = list(map(ids.get, tokens))  # dictionary lookups without a Python loop
+        if None in codes:  # new types: give them ids in order of first occurrence
+            strings = self.strings
+            with self._lock:
+                for position, code in enumerate(codes):
+                    if code is None:
+                        token = tokens[position]
+                        code = ids.get(token)
+                        if code is None:  # the string is stored before the id is published
+                            strings.append(token)
+                            code = ids[token] = len(strings) - 1
+                        codes[position] = code
+        return np.array(codes, dtype=np.int32)
+
+    def decode(self, type_ids):
+        """
+        :return: list of str
+        """
+        strings = self.strings
+        return [strings[type_id] for type_id in type_ids.tolist()]
+
+
+class TagSet:
+    """
+    POS tags of a tokenizer as integer ids, with boolean masks (indexed by POS id) of the stopword
+    and function word tags. Tags not in the lists (e.g. mecab compound tags like 'VV+EC') are added on first sight,
+    which is why ids are uint16 rather than uint8
+    """
+
+    def __init__(self, stopwords, functionwords):
+        self.ids = {}
+        self.tags = []
+        self._stopwords = set(stopwords)
+        self._functionwords = set(functionwords)
+        self.stopword = np.zeros(0, dtype=bool)
+        self.functionword = np.zeros(0, dtype=bool)
+        self._lock = threading.Lock()
+        for tag in list(stopwords) + list(functionwords):
+            self.intern(tag)
+
+    def intern(self, tag):
+        tag_id = self.ids.get(tag)
+        if tag_id is None:
+            with self._lock:
+                tag_id = self.ids.get(tag)
+                if tag_id is None:
+                    # the masks are replaced before the id is published, so a reader never sees an id past them
+                    self.stopword = np.append(self.stopword, tag in self._stopwords)
+                    self.functionword = np.append(self.functionword, tag in self._functionwords)
+                    self.tags.append(tag)
+                    tag_id = self.ids[tag] = len(self.tags) - 1
+        return tag_id
+
+    def encode(self, tags):
+        """
+        :param tags: sequence of str
+        :return: np.ndarray of uint16 POS ids
+        """
+        codes = list(map(self.ids.get, tags))
+        if None in codes:  # unseen tags: intern them first
+            codes = [self.intern(tag) for tag in tags]
+        return np.array(codes, dtype=np.uint16)
+
+
+class TokenStream:
+    """
+    A tagged text as parallel arrays of type ids and POS ids
+    """
+    __slots__ = ("type_ids", "pos_ids")
+
+    def __init__(self, type_ids, pos_ids):
+        self.type_ids = type_ids
+        self.pos_ids = pos_ids
+
+    def __len__(self):
+        return len(self.type_ids)
+
+    @classmethod
+    def from_pos_tuples(cls, pos_tuple, vocabulary, tag_set):
+        """
+        :param pos_tuple: list of tuple ('token', 'Part-Of-Speech'), e.g. pos_tuple_all of korean_tokenizer.tokenize()
+        """
+        if not pos_tuple:
+            return cls(np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.uint16))
+        tokens, tags = zip(*pos_tuple)
+        return cls(vocabulary.encode(tokens), tag_set.encode(tags))
+
+    def select(self, mask):
+        """
+        :param mask: np.ndarray of bool, one per token
+        :return: TokenStream of the tokens where mask is True (in the same order)
+        """
+        return TokenStream(self.type_ids[mask], self.pos_ids[mask])
+
+    def without(self, tag_mask):
+        """
+        :param tag_mask: np.ndarray of bool indexed by POS id, e.g. TagSet.stopword
+        :return: TokenStream without the tokens whose POS is in the mask
+        """
+        return self.select(~tag_mask[self.pos_ids])
+
+    def tokens(self, vocabulary):
+        """
+        :return: list of str, the tokens of the stream
+        """
+        return vocabulary.decode(self.type_ids)
+
+    def pos_tuples(self, vocabulary, tag_set):
+        """
+        :return: list of tuple ('token', 'Part-Of-Speech')
+        """
+        tags = tag_set.tags
+        return list(zip(vocabulary.decode(self.type_ids), [tags[pos_id] for pos_id in self.pos_ids.tolist()]))
+
+    def dense_ids(self):
+        """
+        :return: np.ndarray of int32, type ids renumbered from 0 within the stream (see ld_engine)
+        """
+        return np.unique(self.type_ids, return_inverse=True)[1].astype(np.int32)
+
+
+# vocabulary and tag sets shared by all texts of the process
+VOCABULARY = Vocabulary()
+_tag_sets = {}
+
+
+def tag_set(tokenizer):
+    """
+    :param tokenizer: str, possible options: (okt, komoran, mecab, kkma, hannanum, stanza)
+    :return: TagSet of the tokenizer
+    """
+    if tokenizer not in _tag_sets:
+        if tokenizer not in STOPWORDS:
+            raise ValueError("tokenizer must be one of these options: (okt, komoran, mecab, kkma, hannanum, stanza)")
+        _tag_sets[tokenizer] = TagSet(STOPWORDS[tokenizer], FUNCTIONWORDS.get(tokenizer, []))
+    return _tag_sets[tokenizer]
+
+
+def encode(tokenizer, pos_tuple):
+    """
+    :param pos_tuple: list of tuple ('token', 'Part-Of-Speech')
+    :return: TokenStream of the tagged text, with the vocabulary of the process
+    """
+    return TokenStream.from_pos_tuples(pos_tuple, VOCABULARY, tag_set(tokenizer))
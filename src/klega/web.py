@@ -2,13 +2,18 @@
 Author: Sooyeon Cho
 LD Analyser class for KLEGA web application
 """
-from collections import Counter
-from klega.korean_tokenizer import tokenize, remove_function_words
-from taaled import lexdiv
+import hashlib
+import threading
+from collections import Counter, OrderedDict
+import numpy as np
+from klega.korean_tokenizer import tokenize, remove_function_words, FUNCTIONWORDS
+from klega.ld_engine import get_lexdiv, to_type_ids, FastLexdiv
+
+MEMO_SIZE = 256  # number of analysed texts kept for re-submissions
 
 
 class LdAnalyser:
-    def __init__(self, tokenizer, text):
+    def __init__(self, tokenizer, text, engine="taaled"):
         self.pos_with_frequency_content = None
         self.ldout_content = None
         self.tokens_cleaned_content = None
@@ -20,32 +25,91 @@ class LdAnalyser:
         self.pos_tuple_all = None
         self.tokenizer = tokenizer
         self.text = text
+        self.engine = engine  # lexical diversity engine: taaled or numpy
 
 
 
-    def tokenize_text(self):
+    def tokenize_text(self, tokenized=None):
+        """
+        :param tokenized: tuple (pos_tuple_all, pos_tuple_cleaned, tokens_cleaned) returned by tokenize(),
+                          if the text was already tokenized (e.g. in a batch). If None, tokenize the text here
+        """
+        if tokenized is None:
+            tokenized = tokenize(self.tokenizer, self.text)
         # all
-        self.pos_tuple_raw, self.pos_tuple_all, self.tokens_cleaned_all = tokenize(self.tokenizer, self.text)
+        self.pos_tuple_raw, self.pos_tuple_all, self.tokens_cleaned_all = tokenized
         # content only
         self.pos_tuple_content, self.tokens_cleaned_content = remove_function_words(self.pos_tuple_all, self.tokenizer)
 
     def calculate_ld(self):
+        if self.engine == "numpy":
+            # content tokens are a subsequence of all tokens: map types to ids once and select the content positions
+            functionwords = FUNCTIONWORDS.get(self.tokenizer, [])
+            ids_all = to_type_ids(self.tokens_cleaned_all)
+            content = np.array([pair[1] not in functionwords for pair in self.pos_tuple_all], dtype=bool)
+            # the tokens give HD-D the summation order of taaled (see ld_engine.hdd())
+            self.ldout_all = FastLexdiv(self.tokens_cleaned_all, ids=ids_all).vald
+            self.ldout_content = FastLexdiv(self.tokens_cleaned_content, ids=ids_all[content]).vald
+        else:
+            lexdiv = get_lexdiv(self.engine)
+            self.ldout_all = lexdiv(self.tokens_cleaned_all).vald
+            self.ldout_content = lexdiv(self.tokens_cleaned_content).vald
         # all
-        self.ldout_all = lexdiv(self.tokens_cleaned_all).vald
         self.ldout_all = {key: round(self.ldout_all[key], 2) for key in self.ldout_all}
         # content only
-        self.ldout_content = lexdiv(self.tokens_cleaned_content).vald
         self.ldout_content = {key: round(self.ldout_content[key], 2) for key in self.ldout_content}
 
     def calculate_frequency(self):
         # all
         self.pos_with_frequency_all = Counter(self.pos_tuple_all)
         self.pos_with_frequency_all = self.pos_with_frequency_all.most_common()  # sort by frequency
-        # content only
-        self.pos_with_frequency_content = Counter(self.pos_tuple_content)
-        self.pos_with_frequency_content = self.pos_with_frequency_content.most_common()  # sort by frequency
+        # content only: same counts without function words, so filter the sorted list instead of counting again
+        functionwords = FUNCTIONWORDS.get(self.tokenizer, [])
+        self.pos_with_frequency_content = [item for item in self.pos_with_frequency_all
+                                           if item[0][1] not in functionwords]
 
-    def ldanalyse(self):
-        self.tokenize_text()
+    def ldanalyse(self, tokenized=None):
+        self.tokenize_text(tokenized)
         self.calculate_ld()
-        self.calculate_frequency()
\ No newline at end of file
+        self.calculate_frequency()
+
+
+_memo = OrderedDict()
+_memo_lock = threading.Lock()
+
+
+def _memo_key(tokenizer, text, engine):
+    return tokenizer, engine, hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def memoized(tokenizer, text, engine="taaled"):
+    """
+    :return: the memoized LdAnalyser of the text, or None if it has not been analysed recently
+    """
+    key = _memo_key(tokenizer, text, engine)
+    with _memo_lock:
+        analyser = _memo.get(key)
+        if analyser is not None:
+            _memo.move_to_end(key)
+        return analyser
+
+
+def analyse(tokenizer, text, engine="taaled", tokenized=None):
+    """
+    Analyse a text with LdAnalyser, reusing the result of an earlier call on the same text (LRU memo)
+    The returned analyser may be shared between callers: do not modify it
+    :param tokenized: optional result of tokenize() for the text, see LdAnalyser.tokenize_text()
+    :return: LdAnalyser object after ldanalyse()
+    """
+    analyser = memoized(tokenizer, text, engine)
+    if analyser is not None:
+        return analyser
+
+    analyser = LdAnalyser(tokenizer, text, engine=engine)
+    analyser.ldanalyse(tokenized)
+
+    with _memo_lock:
+        _memo[_memo_key(tokenizer, text, engine)] = analyser
+        if len(_memo) > MEMO_SIZE:
+            _memo.popitem(last=False)
+    return analyser
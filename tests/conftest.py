@@ -0,0 +1,100 @@
+import os
+import random
+import re
+import sys
+
+import pytest
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+# the modules of klega import each other by module name, as when main.py is run from src/klega,
+# and the web modules import the klega package (python -m klega.server)
+sys.path[:0] = [os.path.join(SRC, "klega"), SRC]
+
+SYLLABLES = "가나다라마바사아자차카타파하고노도로모보소오조초코토포호"
+PARTICLES = ["은", "는", "이", "가", "을", "를", "에", "의", ""]
+
+
+def korean_text(seed, words):
+    """
+    :return: str, a random text of Korean-looking words with particles, punctuation and numbers
+    """
+    rng = random.Random(seed)
+    vocabulary = ["".join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 3))) for _ in range(words // 3 + 5)]
+    out = []
+    for i in range(words):
+        out.append(rng.choice(vocabulary) + rng.choice(PARTICLES))
+        if i % 11 == 10:
+            out[-1] += rng.choice([".", ",", "!"])
+        if i % 17 == 16:
+            out.append(str(rng.randint(1, 99)))
+    return " ".join(out)
+
+
+@pytest.fixture
+def corpus():
+    """
+    :return: list of tuple (text id, text): texts of several lengths, including an empty text and a short one
+    """
+    lengths = [0, 8, 120, 260, 300, 420, 90, 250]
+    return [("t{:02d}.txt".format(i), korean_text(i, length)) for i, length in enumerate(lengths)]
+
+
+class FakeOkt:
+    """
+    Tags like okt without a JVM: latin words (e.g. the batch boundary marker) are 'Alpha', numbers 'Number',
+    and particles are split off nouns
+    """
+
+    def pos(self, text):
+        out = []
+        for word in re.findall(r"\w+|[^\w\s]", text):
+            if re.fullmatch(r"[A-Za-z]+", word):
+                out.append((word, "Alpha"))
+            elif word.isdigit():
+                out.append((word, "Number"))
+            elif not re.match(r"\w", word):
+                out.append((word, "Punctuation"))
+            elif len(word) > 1 and word[-1] in "은는이가을를에의":
+                out.extend([(word[:-1], "Noun"), (word[-1], "Josa")])
+            else:
+                out.append((word, "Noun"))
+        return out
+
+
+def use_fake_tagger():
+    """
+    Tag okt texts with FakeOkt in this process, and in the worker processes it starts (see ld_analyser)
+    """
+    import korean_tokenizer
+    import ld_analyser
+    korean_tokenizer.get_tagger = _fake_tagger
+    ld_analyser._init_worker = _init_worker_with_fake_tagger
+
+
+def _fake_tagger(tokenizer):
+    if tokenizer != "okt":
+        raise ValueError("only okt is faked")
+    return FakeOkt()
+
+
+def _init_worker_with_fake_tagger(tokenizer, cache_settings):
+    import ld_analyser
+    real_init_worker = ld_analyser._init_worker  # a new worker process has the real one
+    use_fake_tagger()
+    real_init_worker(tokenizer, cache_settings)
+
+
+def run_with_fake_tagger(target, *args):
+    """
+    Entry point of a new process: call target with okt faked (see use_fake_tagger())
+    """
+    use_fake_tagger()
+    target(*args)
+
+
+@pytest.fixture
+def fake_tagger(monkeypatch):
+    import korean_tokenizer
+    import ld_analyser
+    monkeypatch.setattr(korean_tokenizer, "get_tagger", _fake_tagger)
+    monkeypatch.setattr(ld_analyser, "_init_worker", _init_worker_with_fake_tagger)
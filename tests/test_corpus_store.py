@@ -0,0 +1,67 @@
+import os
+
+import pytest
+
+from corpus_store import CorpusStore
+from ld_analyser import LOI, analyse_texts, tokenize_n_make_ld_matrices
+from ld_engine import COUNT_INDICES, FastLexdiv
+from token_stream import VOCABULARY, tag_set
+
+pytestmark = pytest.mark.usefixtures("fake_tagger")
+
+CONFIGS = [(True, False), (True, True), (False, False), (False, True)]
+MX = 100
+
+
+@pytest.fixture
+def store(corpus, tmp_path):
+    output_dir = str(tmp_path / "result")
+    os.makedirs(output_dir)
+    tokenize_n_make_ld_matrices(corpus, "okt", CONFIGS, output_dir, mx=MX, engine="numpy",
+                                store_dir=str(tmp_path / "store"))
+    return CorpusStore(str(tmp_path / "store" / "okt"))
+
+
+def _approx(value):
+    return pytest.approx(value, rel=1e-12, abs=1e-12)
+
+
+def test_text_indices_are_the_rows_of_the_run(corpus, store):
+    assert store.texts == [tid for tid, _ in corpus]
+    for tid, results, stream in analyse_texts(iter(corpus), "okt", CONFIGS, mx=MX, engine="numpy", keep_streams=True):
+        assert store.tokens_of(tid) == stream.tokens(VOCABULARY)
+        for (include_function_words, parallel_analysis), (status, rows) in zip(CONFIGS, results):
+            indices = store.text_indices(tid, include_function_words, parallel_analysis, mx=MX, loi=LOI)
+            if status is not None:
+                assert indices is None
+            elif parallel_analysis:
+                assert [[length] + [indices[length][index] for index in LOI] for length in indices] == rows
+            else:
+                assert [indices[index] for index in LOI] == rows[0]
+
+
+def test_group_indices_pool_the_tokens_of_the_texts(corpus, store):
+    streams = {tid: stream for tid, _, stream in analyse_texts(iter(corpus), "okt", [(True, False)], engine="numpy",
+                                                                 keep_streams=True)}
+    functionword = tag_set("okt").functionword
+    group = [tid for tid, _ in corpus][2:5]
+    for text_ids in (group, None):
+        tokens = [token for tid in (text_ids or store.texts)
+                  for token in streams[tid].without(functionword).tokens(VOCABULARY)]
+        expected = FastLexdiv(tokens).vald
+        indices = store.group_indices(text_ids)
+        assert indices == {index: _approx(value) for index, value in expected.items()}
+        # the count matrix gives the indices that do not depend on the order of the tokens
+        assert store.group_indices(text_ids, loi=COUNT_INDICES) == {index: _approx(indices[index])
+                                                                     for index in COUNT_INDICES}
+    assert store.groups_indices({"group": group, "empty": []}) == {"group": store.group_indices(group),
+                                                                  "empty": None}
+
+
+def test_unknown_text_id_raises_key_error(store):
+    with pytest.raises(KeyError):
+        store.group_indices(["missing.txt"])
+    with pytest.raises(KeyError):
+        store.group_indices(["missing.txt"], loi=COUNT_INDICES)
+    with pytest.raises(KeyError):
+        store.text_indices("missing.txt")
@@ -0,0 +1,58 @@
+import random
+import re
+
+import pytest
+
+from data_processor import TypoMatcher, typodelete
+
+
+def _baseline(text, typos):
+    # the deletion before TypoMatcher: one alternation of the typos of the text
+    return re.sub(r'\b(?:%s)\b' % '|'.join(re.escape(typo) for typo in typos), '', text) if typos else text
+
+
+@pytest.mark.parametrize("text,typos", [
+    ("1-라", ["-", "ab", "나다"]),  # a non-word typo inside the text, between word runs
+    ("1-라 ab-cd", ["ab-c", "-", "ab"]),  # overlapping typos: the first in the spellchecker's order wins
+    ("ab-cd ab cd", ["cd", "ab-cd"]),
+    ("가나다 가나 나다 가나다", ["가나", "가나다"]),
+    ("typo, typo.typo typos", ["typo"]),
+    ("nothing to delete", []),
+])
+def test_delete_matches_the_alternation(text, typos):
+    # the matcher is built on the typos of the whole corpus, another text has the typo '1-'
+    matcher = TypoMatcher(typos + ["1-", "x.y"])
+    assert matcher.delete(text, typos) == _baseline(text, typos)
+
+
+def test_delete_matches_the_alternation_on_random_texts():
+    rng = random.Random(0)
+    pieces = ["가", "나다", "ab", "1", "-", " ", ".", "a-b", "라", "__"]
+    corpus_typos = set()
+    cases = []
+    for _ in range(3000):
+        text = "".join(rng.choice(pieces) for _ in range(rng.randint(0, 12)))
+        typos = list(dict.fromkeys(rng.choice(pieces[:9]).strip() or "-" for _ in range(rng.randint(0, 4))))
+        corpus_typos.update(typos)
+        cases.append((text, typos))
+    matcher = TypoMatcher(corpus_typos)
+    for text, typos in cases:
+        assert matcher.delete(text, typos) == _baseline(text, typos), (text, typos)
+
+
+class _Checker:
+    def __init__(self, typos):
+        self.typos = typos
+
+    def spelling_errors(self, texts, workers=1):
+        return [[typo for typo in self.typos if typo in text] for text in texts]
+
+
+def test_typodelete_deletes_the_typos_of_each_text():
+    pytest.importorskip("pandas")
+    texts = ["철수가\t학교에 갔따 갔따", "1-라 2-마", "오류 없음"]
+    df = typodelete(["a.txt", "b.txt", "c.txt"], texts, None, save=False, backend=_Checker(["갔따", "-", "1-"]))
+    assert list(df.index) == ["a.txt", "b.txt", "c.txt"]
+    assert list(df["raw"]) == [text.replace("\t", " ") for text in texts]
+    assert list(df["typo"]) == [["갔따"], ["-", "1-"], []]
+    assert list(df["processed"]) == ["철수가 학교에  ", "라 2마", "오류 없음"]
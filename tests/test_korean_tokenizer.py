@@ -0,0 +1,87 @@
+import logging
+
+import pytest
+
+import korean_tokenizer
+from conftest import FakeOkt, korean_text
+from korean_tokenizer import _OKT_BOUNDARY, _parse_mecab, _tag_okt_batch, tokenize, tokenize_batch
+
+TEXTS = [korean_text(seed, words) for seed, words in enumerate([40, 0, 7, 150, 1, 60])] + \
+        ["", "   ", "가나 " + _OKT_BOUNDARY + " 다라를", "abc 가나를. 12"]
+
+
+@pytest.mark.parametrize("tokenizer", ["okt", "komoran", "kkma", "hannanum"])
+@pytest.mark.parametrize("batch_size", [1, 3, 32])
+def test_tokenize_batch_is_tokenize_per_text(tokenizer, batch_size):
+    pytest.importorskip("konlpy")
+    assert tokenize_batch(tokenizer, TEXTS, batch_size) == [tokenize(tokenizer, text) for text in TEXTS]
+
+
+@pytest.mark.usefixtures("fake_tagger")
+@pytest.mark.parametrize("batch_size", [1, 3, 32])
+def test_okt_batch_is_tokenize_per_text(batch_size):
+    assert tokenize_batch("okt", TEXTS, batch_size) == [tokenize("okt", text) for text in TEXTS]
+
+
+def test_okt_texts_are_split_back_at_the_boundaries():
+    tagger = FakeOkt()
+    calls = []
+    pos = tagger.pos
+    tagger.pos = lambda text: calls.append(text) or pos(text)
+    assert _tag_okt_batch(tagger, TEXTS) == [pos(text) for text in TEXTS]
+    # one call for the joined texts, one per text that cannot be joined (empty, blank, containing the marker)
+    assert len(calls) == 1 + 4
+
+
+# output of mecab-ko-dic for "아버지가 방에 들어가신다." with MECAB_LEAN_ARGS and with the default format
+MECAB_LEAN_OUTPUT = "아버지\tNNG\n가\tJKS\n방\tNNG\n에\tJKB\n들어가\tVV\n신다\tEP+EF\n.\tSF\nEOS\n"
+MECAB_DEFAULT_OUTPUT = ("아버지\tNNG,*,F,아버지,*,*,*,*\n가\tJKS,*,F,가,*,*,*,*\n방\tNNG,*,T,방,*,*,*,*\n"
+                        "에\tJKB,*,F,에,*,*,*,*\n들어가\tVV,*,F,들어가,*,*,*,*\n"
+                        "신다\tEP+EF,*,F,신다,Inflect,EP,EF,시/EP/*+ㄴ다/EF/*\n.\tSF,*,*,*,*,*,*,*\nEOS\n")
+MECAB_POS = [("아버지", "NNG"), ("가", "JKS"), ("방", "NNG"), ("에", "JKB"), ("들어가", "VV"), ("신다", "EP+EF"),
+             (".", "SF")]
+
+
+class _MeCab:
+    """
+    MeCab module whose Tagger writes a fixed analysis with the node and EOS formats of its arguments, which it
+    splits on whitespace like MeCab's Param::open (quotes are kept)
+    """
+
+    class Tagger:
+        def __init__(self, args=""):
+            formats = dict(arg.split("=", 1) for arg in args.split())
+            unescape = (lambda value: value.replace("\\t", "\t").replace("\\n", "\n"))
+            self.node = unescape(formats["--node-format"]) if "--node-format" in formats else None
+            self.eos = unescape(formats.get("--eos-format", "EOS\\n"))
+
+        def parse(self, text):
+            if self.node is None:
+                return MECAB_DEFAULT_OUTPUT
+            return "".join(self.node.replace("%m", surface).replace("%f[0]", pos) for surface, pos in MECAB_POS) + \
+                self.eos
+
+
+def test_parse_mecab():
+    assert _parse_mecab(MECAB_LEAN_OUTPUT) == MECAB_POS
+    assert _parse_mecab("EOS\n") == []
+
+
+def test_mecab_lean_output_is_the_default_output(monkeypatch):
+    monkeypatch.setattr(korean_tokenizer, "_import", lambda tokenizer: _MeCab)
+    tagger = korean_tokenizer._build_mecab()
+    assert korean_tokenizer._mecab_lean
+    assert tagger.parse("") == MECAB_LEAN_OUTPUT
+    assert korean_tokenizer._tag("mecab", tagger, "") == MECAB_POS
+    monkeypatch.setattr(korean_tokenizer, "_mecab_lean", False)
+    assert korean_tokenizer._tag("mecab", _MeCab.Tagger(), "") == MECAB_POS
+
+
+def test_mecab_falls_back_to_the_default_output(monkeypatch, caplog):
+    monkeypatch.setattr(korean_tokenizer, "_import", lambda tokenizer: _MeCab)
+    monkeypatch.setattr(korean_tokenizer, "MECAB_LEAN_ARGS", "--node-format='%m\\t%f[0]\\n' --eos-format='EOS\\n'")
+    with caplog.at_level(logging.INFO):
+        tagger = korean_tokenizer._build_mecab()
+    assert not korean_tokenizer._mecab_lean
+    assert tagger.parse("") == MECAB_DEFAULT_OUTPUT
+    assert "default output" in caplog.text
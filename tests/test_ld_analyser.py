@@ -0,0 +1,87 @@
+import multiprocessing
+import os
+import pickle
+
+import pytest
+
+from conftest import korean_text, run_with_fake_tagger
+from ld_analyser import analyse_texts, tokenize_n_make_ld_matrices
+
+pytestmark = pytest.mark.usefixtures("fake_tagger")
+
+CONFIGS = [(True, False), (True, True), (False, False), (False, True)]
+
+
+def _files(output_dir):
+    files = {}
+    for name in sorted(os.listdir(str(output_dir))):
+        with open(os.path.join(str(output_dir), name), "rb") as f:
+            files[name] = f.read()
+    return files
+
+
+def _run(corpus, output_dir, **kwargs):
+    os.makedirs(str(output_dir))
+    tokenize_n_make_ld_matrices(corpus, "okt", CONFIGS, str(output_dir), engine="numpy", **kwargs)
+    return _files(output_dir)
+
+
+def _write_results(records, path, workers, chunksize):
+    results = [(tid, text_results) for tid, text_results, _ in analyse_texts(
+        iter(records), "okt", CONFIGS, engine="numpy", workers=workers, chunksize=chunksize)]
+    with open(path, "wb") as f:
+        pickle.dump(results, f)
+
+
+def _in_process(monkeypatch, target, *args):
+    """
+    Run target in a new process, with okt faked. HD-D sums over a set of token strings, whose order depends on the
+    hash seed: with the same seed in every process, the serial run and the worker processes give the same last digits
+    """
+    monkeypatch.setenv("PYTHONHASHSEED", "0")
+    process = multiprocessing.get_context("spawn").Process(target=run_with_fake_tagger, args=(target, ) + args)
+    process.start()
+    process.join()
+    assert process.exitcode == 0
+
+
+def test_workers_write_the_serial_output(corpus, tmp_path, monkeypatch):
+    records = corpus + [("u{:02d}.txt".format(i), korean_text(100 + i, 50 + 10 * i)) for i in range(30)]
+    for workers in (1, 2):  # texts of several chunks (see analyse_texts)
+        os.makedirs(str(tmp_path / str(workers)))
+        _in_process(monkeypatch, tokenize_n_make_ld_matrices, records, "okt", CONFIGS, str(tmp_path / str(workers)),
+                    200, workers, "numpy")
+    serial = _files(tmp_path / "1")
+    assert len(serial) == len(CONFIGS)
+    assert _files(tmp_path / "2") == serial
+
+
+def test_results_keep_the_order_of_the_records(corpus, tmp_path, monkeypatch):
+    # chunks smaller than the corpus, so results come from several chunks and workers
+    results = {}
+    for workers in (1, 2):
+        path = str(tmp_path / "{}.pickle".format(workers))
+        _in_process(monkeypatch, _write_results, corpus, path, workers, 3)
+        with open(path, "rb") as f:
+            results[workers] = pickle.load(f)
+    assert [tid for tid, _ in results[1]] == [tid for tid, _ in corpus]
+    assert results[2] == results[1]
+
+
+@pytest.mark.parametrize("cut", ["in_header", "after_header", "in_last_value", "before_last_row", "nothing"])
+def test_resume_completes_an_interrupted_run(corpus, tmp_path, cut):
+    expected = _run(corpus, tmp_path / "expected")
+    output_dir = str(tmp_path / "resumed")
+    os.makedirs(output_dir)
+    for name, content in expected.items():
+        size = {"in_header": content.index(b"\t") + 2,
+                "after_header": content.index(b"\n"),
+                "in_last_value": content.rindex(b".") + 3,  # the last row ends in the middle of a float
+                "before_last_row": content.rindex(b"\n"),  # the last text may have more rows to come
+                "nothing": len(content)}[cut]
+        with open(os.path.join(output_dir, name), "wb") as f:
+            f.write(content[:size])
+    tokenize_n_make_ld_matrices(corpus, "okt", CONFIGS, output_dir, engine="numpy", resume=True)
+    for name, content in expected.items():
+        with open(os.path.join(output_dir, name), "rb") as f:
+            assert f.read() == content, name
@@ -0,0 +1,55 @@
+import random
+
+import numpy as np
+import pytest
+
+from ld_engine import COUNT_INDICES, INDICES, FastLexdiv, count_indices, parallel_ld, to_type_ids
+
+taaled = pytest.importorskip("taaled")
+
+# type ids instead of tokens only change the summation order of HD-D (see ld_engine.hdd())
+REL = 1e-9
+
+
+def _tokens(seed, length, types):
+    rng = random.Random(seed)
+    vocabulary = ["w{}".format(i) for i in range(types)]
+    weights = [1 / (rank + 1) for rank in range(types)]  # a few frequent types and a long tail, as in texts
+    return rng.choices(vocabulary, weights, k=length)
+
+
+@pytest.mark.parametrize("seed", range(10))
+@pytest.mark.parametrize("length,types", [(1, 1), (9, 5), (10, 10), (11, 3), (49, 30), (50, 20), (51, 51),
+                                          (120, 40), (333, 90), (800, 200)])
+def test_fast_lexdiv_matches_taaled(length, types, seed):
+    tokens = _tokens(seed, length, types)
+    expected = taaled.lexdiv(tokens).vald
+    vald = FastLexdiv(tokens).vald
+    for index in INDICES:
+        assert str(vald[index]) == str(expected[index]), index
+    assert FastLexdiv(ids=to_type_ids(tokens)).vald == pytest.approx(vald, rel=REL)
+
+
+def test_count_indices_match_the_token_indices():
+    tokens = _tokens(0, 500, 120)
+    vald = FastLexdiv(tokens).vald
+    counts = count_indices(np.bincount(to_type_ids(tokens)))
+    for index in COUNT_INDICES:
+        assert counts[index] == pytest.approx(vald[index], rel=REL), index
+
+
+@pytest.mark.parametrize("seed", range(20))
+@pytest.mark.parametrize("length,mx", [(200, 200), (431, 200), (150, 120), (97, 50)])
+def test_parallel_ld_matches_taaled_parallel(length, mx, seed):
+    from taaled import parallel
+    loi = ["ntokens", "ntypes", "mtld", "mtldo", "mattr", "ttr", "rttr", "lttr", "maas", "msttr", "hdd"]
+    tokens = _tokens(seed, length, length // 3 + seed)
+    expected = parallel(text=tokens, clss=True, functd=None, funct=taaled.lexdiv, loi=loi, mx=mx).ldvals
+    ldvals = parallel_ld(tokens, loi, mx=mx)
+    assert list(ldvals) == list(expected)
+    for sample_length in expected:
+        for index in loi:  # the _prll files must not change: every value prints the same
+            assert str(ldvals[sample_length][index]) == str(expected[sample_length][index]), (sample_length, index)
+    ids_ldvals = parallel_ld(None, loi, mx=mx, ids=to_type_ids(tokens))
+    for sample_length in expected:
+        assert ids_ldvals[sample_length] == pytest.approx(ldvals[sample_length], rel=REL)
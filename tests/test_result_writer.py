@@ -0,0 +1,76 @@
+import pytest
+
+from result_writer import FORMATS, WRITERS, columns, open_writer, read_metadata, read_rows, resolve_format
+
+LOI = ["ntokens", "mattr", "hdd"]
+TEXTS = [("a.txt", [[12.0, 0.7512345678901234, 0.8123456789012345]]),
+         ("b.txt", [[40.0, 0.6666666666666666, 0.7]]),
+         ("c.txt", [[3.0, 1.0, 0.0]])]
+PARALLEL_TEXTS = [("a.txt", [[50, 50.0, 0.71, 0.8], [55, 55.0, 0.72, 0.81]]),
+                  ("b.txt", [[50, 50.0, 0.65, 0.79], [55, 55.0, 0.66, 0.78]])]
+
+
+def _write(output_format, path, header, texts, batch_rows=2, resume=False):
+    writer = open_writer(output_format, path, header, {"tokenizer": "okt"}, resume=resume)
+    writer.batch_rows = batch_rows
+    for text_id, rows in texts:
+        if text_id not in writer.done:
+            writer.write(text_id, rows)
+    writer.close()
+    return writer
+
+
+def _tsv(header, texts):
+    return "\t".join(header) + "".join("\n" + "\t".join(map(str, [text_id] + row))
+                                       for text_id, rows in texts for row in rows)
+
+
+@pytest.mark.parametrize("parallel_analysis,texts", [(False, TEXTS), (True, PARALLEL_TEXTS)])
+def test_tsv_batches_write_the_original_format(tmp_path, parallel_analysis, texts):
+    header = columns(parallel_analysis, LOI)
+    for batch_rows in (1, 2, 100):
+        path = str(tmp_path / "{}.tsv".format(batch_rows))
+        _write("tsv", path, header, texts, batch_rows)
+        with open(path, encoding="utf-8") as f:
+            assert f.read() == _tsv(header, texts)
+
+
+@pytest.mark.parametrize("output_format", FORMATS)
+@pytest.mark.parametrize("parallel_analysis,texts", [(False, TEXTS), (True, PARALLEL_TEXTS)])
+def test_formats_keep_the_rows(tmp_path, output_format, parallel_analysis, texts):
+    output_format = resolve_format(output_format)
+    header = columns(parallel_analysis, LOI)
+    path = str(tmp_path / ("results" + WRITERS[output_format].extension))
+    _write(output_format, path, header, texts)
+    read_header, rows = read_rows(path)
+    assert read_header == header
+    if output_format == "tsv":  # tsv values are read back as str
+        texts = [(text_id, [list(map(str, row)) for row in text_rows]) for text_id, text_rows in texts]
+    else:
+        assert read_metadata(path) == {"tokenizer": "okt"}
+    assert list(rows.items()) == texts
+
+
+@pytest.mark.parametrize("cut", [3, 9, -30, -9, -4, -1, 0])
+def test_tsv_resume_drops_the_last_text(tmp_path, cut):
+    header = columns(False, LOI)
+    path = str(tmp_path / "results.tsv")
+    expected = _tsv(header, TEXTS)
+    with open(path, "w", encoding="utf-8") as f:  # cut anywhere, e.g. inside the last value
+        f.write(expected[:cut] if cut else expected)
+    writer = _write("tsv", path, header, TEXTS, resume=True)
+    assert "c.txt" not in writer.done
+    with open(path, encoding="utf-8") as f:
+        assert f.read() == expected
+
+
+def test_tsv_resume_refuses_other_columns(tmp_path):
+    path = str(tmp_path / "results.tsv")
+    _write("tsv", path, columns(False, LOI), TEXTS)
+    with pytest.raises(ValueError):
+        open_writer("tsv", path, columns(True, LOI), resume=True)
+
+
+def test_only_tsv_can_be_resumed(tmp_path):
+    with pytest.raises(ValueError):
+        open_writer("npz", str(tmp_path / "results.npz"), columns(False, LOI), resume=True)
@@ -0,0 +1,48 @@
+import asyncio
+import json
+
+import pytest
+
+from klega.server import LdServer
+
+
+def _dispatch(request):
+    async def dispatch():
+        reader = asyncio.StreamReader()
+        reader.feed_data(request)
+        reader.feed_eof()
+        return await LdServer(workers=1)._dispatch(reader)
+    return asyncio.run(dispatch())
+
+
+def _post(body, content_length=None):
+    body = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+    content_length = len(body) if content_length is None else content_length
+    return _dispatch("POST /analyse HTTP/1.1\r\nContent-Length: {}\r\n\r\n".format(content_length).encode("ascii") +
+                     body)
+
+
+def test_health():
+    assert _dispatch(b"GET /health HTTP/1.1\r\n\r\n") == (200, {"status": "ok"})
+
+
+@pytest.mark.parametrize("content_length", ["abc", "-1", "1.5"])
+def test_invalid_content_length(content_length):
+    assert _post(b"{}", content_length) == (400, {"error": "invalid Content-Length"})
+
+
+@pytest.mark.parametrize("body", [b"not json", b"[1, 2]", {"tokenizer": "okt"}, {"text": 123}, {"text": ["a"]},
+                                  {"text": None}, {"text": {"a": 1}}])
+def test_body_without_a_text(body):
+    assert _post(body) == (400, {"error": "body must be JSON with a 'text' field"})
+
+
+@pytest.mark.parametrize("body,field", [({"text": "a", "tokenizer": ["okt"]}, "tokenizer"),
+                                        ({"text": "a", "tokenizer": {"okt": 1}}, "tokenizer"),
+                                        ({"text": "a", "tokenizer": "spacy"}, "tokenizer"),
+                                        ({"text": "a", "engine": ["numpy"]}, "engine"),
+                                        ({"text": "a", "engine": "spacy"}, "engine")])
+def test_unknown_tokenizer_or_engine(body, field):
+    status, response = _post(body)
+    assert status == 400
+    assert response["error"].startswith(field + " must be one of")
@@ -0,0 +1,90 @@
+import os
+
+import pytest
+
+from conftest import korean_text
+from data_reader import iter_texts, list_texts, shard_of
+from ld_analyser import tokenize_n_make_ld_matrices
+from shard import merge_shards, parse_shard, shard_dir, write_manifest
+
+CONFIGS = [(True, False), (False, True)]
+COUNT = 3
+
+
+@pytest.fixture
+def corpus_dir(tmp_path):
+    path = tmp_path / "corpus"
+    os.makedirs(str(path))
+    for i in range(12):
+        with open(str(path / "text{:02d}.txt".format(i)), "w", encoding="utf-8") as f:
+            f.write(korean_text(i, 60 + 30 * i))
+    return str(path)
+
+
+def _analyse(input_dir, output_dir, shard=None):
+    os.makedirs(output_dir)
+    tokenize_n_make_ld_matrices(iter_texts(input_dir, remove_num=False, shard=shard), "okt", CONFIGS, output_dir,
+                                mx=60, engine="numpy")
+
+
+def _run_shards(input_dir, output_dir, shards):
+    for index in shards:
+        directory = shard_dir(output_dir, (index, COUNT))
+        _analyse(input_dir, directory, (index, COUNT))
+        log_file = os.path.join(directory, "log.log")
+        open(log_file, "w").close()
+        write_manifest(directory, input_dir, (index, COUNT), {"tokenizer": "okt"}, log_file)
+
+
+def _files(directory):
+    files = {}
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".tsv"):
+            with open(os.path.join(directory, name), "rb") as f:
+                files[name] = f.read()
+    return files
+
+
+def test_parse_shard():
+    assert parse_shard("2/4") == (2, 4)
+    for value in ["0/4", "5/4", "4", "a/b", "-1/2"]:
+        with pytest.raises(ValueError):
+            parse_shard(value)
+
+
+def test_shards_partition_the_corpus(corpus_dir):
+    names = list_texts(corpus_dir)
+    shards = [list_texts(corpus_dir, (index, COUNT)) for index in range(1, COUNT + 1)]
+    assert sorted(name for shard in shards for name in shard) == sorted(names)
+    for index, shard in enumerate(shards, 1):
+        assert all(shard_of(name, COUNT) == index for name in shard)
+
+
+@pytest.mark.usefixtures("fake_tagger")
+def test_merge_reproduces_a_single_run(corpus_dir, tmp_path):
+    _analyse(corpus_dir, str(tmp_path / "single"))
+    _run_shards(corpus_dir, str(tmp_path / "shards"), range(1, COUNT + 1))
+    report = merge_shards([str(tmp_path / "shards")], str(tmp_path / "merged"))
+    assert report["shards"] == [1, 2, 3]
+    assert not report["missing_shards"] and not report["missing_texts"] and not report["duplicated_texts"]
+    assert not report["problems"]
+    assert _files(str(tmp_path / "merged")) == _files(str(tmp_path / "single"))
+
+
+@pytest.mark.usefixtures("fake_tagger")
+def test_merge_reports_a_missing_shard(corpus_dir, tmp_path):
+    _run_shards(corpus_dir, str(tmp_path / "shards"), [1, 3])
+    report = merge_shards([str(tmp_path / "shards")], str(tmp_path / "merged"))
+    assert report["missing_shards"] == [2]
+    assert report["missing_texts"] == list_texts(corpus_dir, (2, COUNT))
+    assert report["missing_texts"]
+
+
+@pytest.mark.usefixtures("fake_tagger")
+def test_merge_reports_a_changed_result_file(corpus_dir, tmp_path):
+    _run_shards(corpus_dir, str(tmp_path / "shards"), range(1, COUNT + 1))
+    changed = os.path.join(shard_dir(str(tmp_path / "shards"), (1, COUNT)), "okt_all_words.tsv")
+    with open(changed, "a", encoding="utf-8") as f:
+        f.write("\nextra.txt\t1.0")
+    report = merge_shards([str(tmp_path / "shards")], str(tmp_path / "merged"))
+    assert report["problems"] == ["{}: changed since the shard run".format(changed)]
@@ -0,0 +1,77 @@
+import random
+import sqlite3
+
+import pytest
+
+import token_cache
+from token_cache import ACCESS_BATCH, TokenCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+
+    def tick():
+        now[0] += 1
+        return now[0]
+    monkeypatch.setattr(token_cache.time, "time", tick)
+    return now
+
+
+def _pos_tuple(seed, length=60):
+    rng = random.Random(seed)  # random tokens, so that the compressed entries have about the same size
+    return [("".join(rng.choice("가나다라마바사아자차") for _ in range(4)), "Noun") for _ in range(length)]
+
+
+def _last_access(path, text):
+    with sqlite3.connect(path) as conn:
+        return conn.execute("SELECT last_access FROM tokens WHERE text_hash=?", (TokenCache.text_hash(text), ))\
+            .fetchone()[0]
+
+
+def test_get_returns_what_was_put(tmp_path):
+    cache = TokenCache(str(tmp_path / "tokens.sqlite"))
+    cache.put("okt", "1", "text", [("text", "Noun")])
+    assert cache.get("okt", "1", "text") == [("text", "Noun")]
+    assert cache.get("okt", "2", "text") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.close()
+
+
+def test_hits_are_written_in_batches(tmp_path, clock):
+    path = str(tmp_path / "tokens.sqlite")
+    cache = TokenCache(path)
+    cache.put("okt", "1", "text", [("text", "Noun")])
+    put_at = _last_access(path, "text")
+    changes = cache._conn.total_changes
+    for _ in range(ACCESS_BATCH - 1):
+        assert cache.get("okt", "1", "text") is not None
+    assert cache._conn.total_changes == changes  # hits are reads only
+    assert _last_access(path, "text") == put_at
+    cache.get("okt", "1", "text")
+    assert _last_access(path, "text") == clock[0]  # the time of the last hit
+
+
+def test_close_writes_the_last_hits(tmp_path, clock):
+    path = str(tmp_path / "tokens.sqlite")
+    cache = TokenCache(path)
+    cache.put("okt", "1", "text", [("text", "Noun")])
+    cache.get("okt", "1", "text")
+    hit_at = clock[0]
+    cache.close()
+    cache.close()
+    assert _last_access(path, "text") == hit_at
+
+
+def test_eviction_keeps_the_recent_hits(tmp_path, clock):
+    cache = TokenCache(str(tmp_path / "tokens.sqlite"), max_size=1)
+    cache.put("okt", "1", "a", _pos_tuple(0))
+    entry = cache._stored_size()
+    cache.max_size = 3.5 * entry / 1024 / 1024  # room for three entries
+    cache.put("okt", "1", "b", _pos_tuple(1))
+    cache.put("okt", "1", "c", _pos_tuple(2))
+    assert cache.get("okt", "1", "a") is not None  # a becomes the most recently used entry, in memory only
+    cache.put("okt", "1", "d", _pos_tuple(3))
+    assert cache.get("okt", "1", "b") is None
+    assert cache.get("okt", "1", "a") == _pos_tuple(0)
+    cache.close()
@@ -0,0 +1,72 @@
+import random
+
+import numpy as np
+import pytest
+
+from korean_tokenizer import FUNCTIONWORDS, STOPWORDS, TOKENIZERS, remove_function_words, remove_pos
+from token_stream import VOCABULARY, TagSet, TokenStream, Vocabulary, encode, tag_set
+
+# tags outside the lists, e.g. mecab compound tags, are interned on first sight
+OTHER_TAGS = ["Noun", "Verb", "NNG", "VV+EC", "NOUN", "N", "P"]
+
+
+def _pos_tuples(tokenizer, seed, length=300):
+    rng = random.Random(seed)
+    tags = STOPWORDS[tokenizer] + FUNCTIONWORDS.get(tokenizer, []) + OTHER_TAGS
+    return [("w{}".format(rng.randint(0, 40)), rng.choice(tags)) for _ in range(length)]
+
+
+@pytest.mark.parametrize("tokenizer", TOKENIZERS)
+def test_masks_follow_the_tag_lists(tokenizer):
+    tags = tag_set(tokenizer)
+    tags.encode(OTHER_TAGS)
+    assert len(tags.stopword) == len(tags.functionword) == len(tags.tags)
+    for tag, tag_id in tags.ids.items():
+        assert tags.tags[tag_id] == tag
+        assert tags.stopword[tag_id] == (tag in STOPWORDS[tokenizer])
+        assert tags.functionword[tag_id] == (tag in FUNCTIONWORDS.get(tokenizer, []))
+
+
+@pytest.mark.parametrize("tokenizer", TOKENIZERS)
+@pytest.mark.parametrize("seed", range(3))
+def test_filtering_matches_the_tag_lists(tokenizer, seed):
+    pos_tuple_all = _pos_tuples(tokenizer, seed)
+    stream = encode(tokenizer, pos_tuple_all)
+    assert stream.pos_tuples(VOCABULARY, tag_set(tokenizer)) == pos_tuple_all
+
+    pos_tuple_cleaned = remove_pos(pos_tuple_all, STOPWORDS[tokenizer])
+    cleaned = stream.without(tag_set(tokenizer).stopword)
+    assert cleaned.pos_tuples(VOCABULARY, tag_set(tokenizer)) == pos_tuple_cleaned
+    assert cleaned.tokens(VOCABULARY) == [token for token, _ in pos_tuple_cleaned]
+
+    content, tokens_content = remove_function_words(pos_tuple_cleaned, tokenizer)
+    content_stream = cleaned.without(tag_set(tokenizer).functionword)
+    assert content_stream.pos_tuples(VOCABULARY, tag_set(tokenizer)) == content
+    assert content_stream.tokens(VOCABULARY) == tokens_content
+
+
+def test_vocabulary_ids_in_order_of_first_occurrence():
+    vocabulary = Vocabulary()
+    assert vocabulary.encode(["b", "a", "b", "c"]).tolist() == [0, 1, 0, 2]
+    assert vocabulary.encode(["c", "d", "a"]).tolist() == [2, 3, 1]
+    assert vocabulary.decode(np.array([3, 0, 1], dtype=np.int32)) == ["d", "b", "a"]
+    assert len(vocabulary) == 4
+
+
+def test_dense_ids_keep_which_tokens_are_equal():
+    vocabulary = Vocabulary()
+    vocabulary.encode(["x{}".format(i) for i in range(100)])  # ids of the stream far from 0
+    tokens = ["x{}".format(i) for i in [70, 99, 70, 12, 99, 99, 50]]
+    stream = TokenStream.from_pos_tuples([(token, "Noun") for token in tokens], vocabulary, TagSet([], []))
+    dense = stream.dense_ids()
+    assert dense.dtype == np.int32
+    assert sorted(set(dense.tolist())) == list(range(len(set(tokens))))
+    for i in range(len(tokens)):
+        for j in range(len(tokens)):
+            assert (dense[i] == dense[j]) == (tokens[i] == tokens[j])
+
+
+def test_empty_stream():
+    stream = TokenStream.from_pos_tuples([], Vocabulary(), TagSet(["SF"], ["JKS"]))
+    assert len(stream) == 0
+    assert len(stream.without(np.array([True, False]))) == 0